@@ -1,19 +1,34 @@
+import asyncio
 import discord
 import logging
 import re
 import os
-import json
-import aiohttp
 import base64
+import io
+import sys
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
+
+#   .env laden, bevor die gemeinsamen Module ihre Einstellungen beim Import lesen
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+#   Gemeinsame Module von Einzel- und Gruppenchat liegen im Paket shared im Projektverzeichnis
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streaming import StreamingReply
+from shared.send_queue import OutboundQueue, merge_paragraphs
+from shared.image_cache import image_cache
+from shared.image_fetcher import image_fetcher
+from shared.image_preprocessing import to_data_url
+from shared.image_analysis import ImageAnalyzer, analysis_to_text
+from shared.answer_cache import answer_cache
+from shared.memory import ConversationMemory, make_openai_summarizer
+from sessions import SessionManager
+from shared.persistence import conversation_store
+from shared.openai_scheduler import scheduler, PRIORITY_ANSWER, PRIORITY_IMAGE, PRIORITY_BACKGROUND
 
 #   Fehlerprotokollierung
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('discord')
 
-#   .env laden
-load_dotenv()
 DISCORD_BOT_TOKEN = os.getenv('hermine_token')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
@@ -25,19 +40,47 @@ if not DISCORD_BOT_TOKEN:
 else:
     print("hermine_token geladen.")
 
-#   OpenAI-Client mit API-Schlüssel initialisieren
-openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+#   Alle OpenAI-Anfragen laufen über den Scheduler (Ratenbegrenzung, Prioritäten, Wiederholungen)
+#   Antworten haben Vorrang vor der Bildgenerierung, Zusammenfassungen laufen im Hintergrund
+openai_client = scheduler.client(PRIORITY_ANSWER)
+image_client = scheduler.client(PRIORITY_IMAGE)
 
 #   Discord-Client initialisieren
 intents = discord.Intents.default()
 intents.message_content = True
 client = discord.Client(intents=intents)
 
+#   Antworten werden während der Generierung schrittweise angezeigt (aus der .env-Datei, Standard: an)
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'true').lower() == 'true'
+#   Kurze Absätze werden zu einer Nachricht (max. 2000 Zeichen) zusammengefasst (aus der .env-Datei, Standard: an)
+MERGE_PARAGRAPHS = os.getenv('MERGE_PARAGRAPHS', 'true').lower() == 'true'
+
+#   Nachrichten werden pro Kanal über eine Warteschlange im Rahmen der Discord-Grenzen versendet
+outbox = OutboundQueue()
+
+#   Modell und Größe für die Bildgenerierung
+IMAGE_MODEL = "dall-e-3"
+IMAGE_SIZE = "1024x1024"
+
+#   Maximale Anzahl gleichzeitig laufender Bildgenerierungen
+MAX_PARALLEL_IMAGES = 3
+#   Maximale Wartezeit in Sekunden für ein einzelnes Bild
+IMAGE_TIMEOUT = 60
+image_semaphore = asyncio.Semaphore(MAX_PARALLEL_IMAGES)
+
 #   Liste der erlaubten Textkanäle, in denen der Bot aktiv sein darf (durch Platzhalter ersetzt)
 ALLOWED_CHANNELS = [1234567890987654321, 9876543210123456789]
 
-#   Speicher für diese Sitzung initialisieren
-conversation_history = []
+#   Sitzungen initialisieren: jeder Nutzer hat pro Kanal einen eigenen Gesprächsverlauf
+#   Begrenzter Gesprächsverlauf: ältere Nachrichten werden zusammengefasst, Bilder nur einmal gesendet
+#   Gesprächsverläufe werden dauerhaft gespeichert (Schlüssel "Kanal-ID:Nutzer-ID") und nach einem Neustart wiederhergestellt
+summarizer = make_openai_summarizer(scheduler.client(PRIORITY_BACKGROUND))
+sessions = SessionManager(lambda key: ConversationMemory(summarizer=summarizer, persistence=conversation_store,
+                                                         key=f"{key[0]}:{key[1]}"))
+#   Beschreibung gesendeter Bilder für den Gesprächsverlauf (einmal pro Bild, günstiges Modell, im Hintergrund)
+image_analyzer = ImageAnalyzer(scheduler.client(PRIORITY_BACKGROUND), model="gpt-4o-mini")
+#   Laufende Hintergrundaufgaben (Referenz, damit sie nicht vorzeitig entfernt werden)
+background_tasks = set()
 
 PROMPT1 = """
 Du bist Hermine Granger, eine intelligente, belesene, loyale und mutige Hexe. 
@@ -85,23 +128,53 @@ def extract_image_prompts(answer):
     return re.findall(r"\[BILD:(.*?)\]", answer)
 
 #   DALLE-E generiert Bilder basierend auf den Prompts
+#   Bereits erstellte Bilder (gleicher Prompt) werden aus dem Bildzwischenspeicher geladen
+#   Gibt die Bilddaten (PNG) zurück, damit sie als Anhang hochgeladen werden können
 async def generate_image(PROMPT1):
-    response = await openai_client.images.generate(
-        model="dall-e-3",
+    key = image_cache.make_key(PROMPT1, "hermine", model=IMAGE_MODEL, size=IMAGE_SIZE)
+    image_bytes = await image_cache.get(key)
+    if image_bytes is not None:
+        print(f"[Bildcache] Treffer für '{PROMPT1}' ({image_cache.stats()})")
+        return image_bytes
+
+    response = await image_client.images.generate(
+        model=IMAGE_MODEL,
         prompt=PROMPT1,
-        size="1024x1024",
+        size=IMAGE_SIZE,
+        response_format="b64_json",  #   Bilddaten direkt statt einer ablaufenden URL
         n=1
     )
-    return response.data[0].url #   URL des generieten Bildes wird ausgegeben
+    image_bytes = base64.b64decode(response.data[0].b64_json)
+    await image_cache.put(key, image_bytes)
+    print(f"[Bildcache] Neues Bild für '{PROMPT1}' gespeichert ({image_cache.stats()})")
+    return image_bytes   #   Bilddaten des generierten Bildes werden ausgegeben
+
+#   Startet die Bildgenerierung für alle Prompts gleichzeitig
+#   Höchstens MAX_PARALLEL_IMAGES Bilder werden parallel erstellt, jedes Bild hat eine eigene Frist (IMAGE_TIMEOUT)
+#   Die Aufgaben werden in der Reihenfolge der Prompts zurückgegeben
+def start_image_generation(prompts):
+    async def generate_limited(prompt):
+        async with image_semaphore:
+            return await asyncio.wait_for(generate_image(prompt), timeout=IMAGE_TIMEOUT)
+    return [asyncio.create_task(generate_limited(prompt.strip())) for prompt in prompts]
 
-#   Funktion zum Herunterladen von Bildern
-#   Lädt ein Bild von einer angegebenen URL herunter
-async def download_image(url):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            if resp.status == 200:
-                return await resp.read()
-    return None
+#   Versendet die generierten Bilder in der ursprünglichen Reihenfolge, sobald sie fertig sind
+async def send_generated_images(channel, image_tasks):
+    for task in image_tasks:
+        try:
+            image_bytes = await task    #   Mit dem Bildprompt wurde über Dall-e ein Bild generiert
+            #   Bild wird als Anhang hochgeladen und in die Einbettung eingefügt
+            file = discord.File(io.BytesIO(image_bytes), filename="bild.png")
+            embed = discord.Embed() #   Discord-Einbettung
+            embed.set_image(url="attachment://bild.png")    #   Bild wird eingefügt
+            await outbox.send(channel, embed=embed, file=file) #   Nachricht wird abgesendet
+        #   Fehlerbehandlung bei der Bildgenerierung
+        except asyncio.TimeoutError:
+            logger.error(f"Bild wurde nicht innerhalb von {IMAGE_TIMEOUT}s erstellt")
+            await outbox.send(channel, "Fehler beim Erstellen eines Bildes: Zeitüberschreitung")
+        except Exception as e:
+            logger.error(f"Bildfehler: {e}")
+            await outbox.send(channel, f"Fehler beim Erstellen eines Bildes: {e}")
 
 #   Event: Einzelbot Hermine wird gestartet
 @client.event
@@ -111,7 +184,6 @@ async def on_ready():
 #   Verarbeitung eingehender Nutzeranfragen
 @client.event
 async def on_message(message):
-    global conversation_history  #  Zugriff auf die globale Variable, um sie innerhalb der Funktion zu verändern
     #   Prüfen, ob Nachricht von einem selbst verfasst wurde
     if message.author == client.user:
         return  #   Nicht auf eigene Nachrichten antworten
@@ -123,10 +195,29 @@ async def on_message(message):
     user_text = message.content.strip() if message.content else ""
 
     #   Übergangsnachricht verschicken
-    loading_msg = await message.channel.send("Hermine denkt nach...")
+    loading_msg = await outbox.send(message.channel, "Hermine denkt nach...")
+
+    #   Sitzung des Nutzers in diesem Kanal (eigener Verlauf, eigenes Lock)
+    #   Anfragen derselben Sitzung werden nacheinander bearbeitet, verschiedene Sitzungen parallel
+    async with sessions.use(message.channel.id, message.author.id) as session:
+        await answer_message(message, user_text, loading_msg, session.memory)
+
+#   Ersetzt den vorläufigen Text der Bilder einer Nutzeranfrage durch eine Bildanalyse
+async def describe_images(conversation_history, entry, images):
+    try:
+        analyses = await asyncio.gather(*(image_analyzer.analyze(key, image["b64"], image["mime_type"])
+                                          for key, image in images))
+        description = " / ".join(text for text in map(analysis_to_text, analyses) if text)
+        if description:
+            conversation_history.describe_images(entry, description[:500])
+    except Exception as e:
+        logger.error(f"Bildbeschreibung fehlgeschlagen: {e}")
 
+#   Beantwortet eine Nutzeranfrage mit dem Gesprächsverlauf der Sitzung
+async def answer_message(message, user_text, loading_msg, conversation_history):
     #   Erstellt einen Nachrichteneintrag für den Chatverlauf
     entry = {"role": "user", "content": []}
+    images = []     #   (Anhang-ID, Bilddaten) für die spätere Bildbeschreibung
 
     #   Wenn Nutzer eine Nachricht schickt, wird sie dem erstellten Eintrag hinzugefügt
     if user_text:
@@ -135,77 +226,143 @@ async def on_message(message):
     #   Falls ein Bild gesendet wird
     for attachment in message.attachments:
         if attachment.content_type and attachment.content_type.startswith("image"):
-            #   Lade das Bild als Byte-Daten herunter
-            image_bytes = await download_image(attachment.url)
-            if image_bytes:
-                #   Wandle das Bild in einen Base64-String um für OpenAI
-                b64_image = base64.b64encode(image_bytes).decode("utf-8")
+            #   Lade das Bild über die gemeinsame HTTP-Sitzung herunter (Größenbegrenzung, Zwischenspeicher)
+            #   Es wird verkleinert und außerhalb des Event-Loops in einen Base64-String für OpenAI umgewandelt
+            image = await image_fetcher.fetch(attachment.url, key=attachment.id)
+            if image:
+                images.append((attachment.id, image))
                 #   image_url wird dem Eintrag hinzugefügt
                 entry["content"].append({
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{b64_image}"}
+                    "image_url": {"url": to_data_url(image)}
                 })
 
+    #   Antwortzwischenspeicher: nur für reine Textanfragen
+    #   Der Kontext besteht aus den bisherigen Nachrichten (vor der aktuellen Anfrage)
+    cache_key = None
+    if answer_cache and user_text and len(entry["content"]) == 1:
+        context = conversation_history.texts()
+        cache_key = answer_cache.make_key("hermine", user_text, context)
+
     #   Wenn die Nutzeranfrage Text oder Bild enthält, wird sie dem Gesprächsverlauf hinzugefüt
+    #   Bis zur Bildbeschreibung steht der Text des Nutzers für das Bild
     if entry["content"]:
-        conversation_history.append(entry)
+        conversation_history.add(entry, description=user_text or None)
         print("Nutzeranfrage: ", user_text)
 
     #   GPT-Aufruf mit Kontext aus der Gesprächshistorie
-    messages = [{"role": "system", "content": PROMPT1}] + conversation_history
+    #   Zusammenfassung + neueste Nachrichten innerhalb des Tokenbudgets
+    messages = [{"role": "system", "content": PROMPT1}] + conversation_history.messages()
+
+    #   Im Streaming-Modus wird die Übergangsnachricht schrittweise durch die Antwort ersetzt
+    reply = StreamingReply(message.channel, loading_msg, split_message, outbox, merge=MERGE_PARAGRAPHS) if STREAM_RESPONSES else None
+
+    #   Laufende Bildgenerierungen (werden gestartet, sobald ein Bild-Tag vollständig ist)
+    image_tasks = []
 
     try:
-        #   OpenAI API-Aufruf
-        response = await openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages
-        )
-        #   Extrahiere die erste Antwort
-        answer = response.choices[0].message.content
-
-        #   Bild-Tags werden aus dem Text entfernt
-        text_only = re.sub(r"\[BILD:.*?\]", "", answer).strip()
-        #   Antwort wird in Absätze aufgeteilt, getrennt durch zwei Zeilenumbrüche
-        paragraphs = [p.strip() for p in text_only.split("\n\n") if p.strip()]
+        cached_answer = answer_cache.get(cache_key) if cache_key else None
+        if cached_answer is not None:
+            #   Antwort aus dem Zwischenspeicher, kein OpenAI-Aufruf nötig
+            print(f"[Antwortcache] Treffer ({answer_cache.stats()})")
+            answer = cached_answer
+            image_tasks = start_image_generation(extract_image_prompts(answer))
+            if reply:
+                await reply.feed(answer)
+                await reply.finish()
+        elif reply:
+            #   OpenAI API-Aufruf mit Streaming, fertige Absätze werden sofort angezeigt
+            stream = await openai_client.chat.completions.create(
+                model="gpt-4o",
+                messages=messages,
+                stream=True
+            )
+            answer = ""
+            #   Der Stream belegt einen Platz im Scheduler, bis er gelesen ist (auch im Fehlerfall wird er geschlossen)
+            #   feed() wartet nicht auf Discord, der Stream wird ohne Unterbrechung gelesen
+            async with stream:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content or ""
+                    answer += delta
+                    #   Neue, vollständige Bild-Tags starten ihre Bildgenerierung schon während des Streams
+                    if "]" in delta:
+                        image_tasks += start_image_generation(extract_image_prompts(answer)[len(image_tasks):])
+                    await reply.feed(delta)
+            await reply.finish()
+        else:
+            #   OpenAI API-Aufruf
+            response = await openai_client.chat.completions.create(
+                model="gpt-4o",
+                messages=messages
+            )
+            #   Extrahiere die erste Antwort
+            answer = response.choices[0].message.content
+            #   Bildgenerierung startet sofort, parallel zum Versand der Textabsätze
+            image_tasks = start_image_generation(extract_image_prompts(answer))
+
+        if cache_key and cached_answer is None:
+            answer_cache.put(cache_key, answer)
 
         #   Bot-Antwort auch im Konversationsspeicher merken
-        conversation_history.append({
+        conversation_history.add({
             "role": "assistant",
             "content": [{"type": "text", "text": answer}]
         })
+        #   Bilder wurden erfolgreich mitgeschickt, ab jetzt wird nur noch ihre Beschreibung verwendet
+        #   (schlägt die Anfrage fehl, werden sie bei der nächsten Anfrage erneut mitgeschickt)
+        conversation_history.mark_images_sent()
+        if images:
+            task = asyncio.create_task(describe_images(conversation_history, entry, images))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+        #   Ältere Nachrichten werden im Hintergrund zusammengefasst
+        conversation_history.schedule_compaction()
         print("Hermines Antwort: ", answer)
 
-        #   Lösche die Übergangsnachricht
-        await loading_msg.delete()
-
-        # Bildgenerierung
-        if "[BILD:" in answer:
-            #   Extrahiert Bildprompts werden als Liste in der Variablen image_prompts gespeichert
-            image_prompts = extract_image_prompts(answer)
-            for image_prompt in image_prompts:
-                try:
-                    img_url = await generate_image(image_prompt.strip())    #   Mit dem Bildprompt wird über Dall-e ein Bild generiert
-                    embed = discord.Embed() #   Discord-Einbettung
-                    embed.set_image(url=img_url)    #   Bild wird eingefügt
-                    await message.channel.send(embed=embed) #   Nachricht wird abgesendet
-                #   Fehlerbehandlung bei der Bildgenerierung
-                except Exception as e:
-                    logger.error(f"Bildfehler: {e}")
-                    await message.channel.send(f"Fehler beim Erstellen eines Bildes: {e}")
-
-        #   Teile die Bot-Antwort in maximal 5 Antworten auf
-        for para in paragraphs[:5]:
-            if len(para) > 2000:
-                #   Teilantworten dürfen maximal 2000 Zeichen haben, sonst werden sie aufgeteilt
-                for chunk in split_message(para):
-                    await message.channel.send(chunk)
-            else:
-                await message.channel.send(para)
+        if not reply:
+            #   Lösche die Übergangsnachricht
+            await outbox.delete(loading_msg)
+
+        if not reply:
+            #   Bild-Tags werden aus dem Text entfernt
+            text_only = re.sub(r"\[BILD:.*?\]", "", answer).strip()
+            #   Antwort wird in Absätze aufgeteilt, getrennt durch zwei Zeilenumbrüche
+            paragraphs = [p.strip() for p in text_only.split("\n\n") if p.strip()]
+
+            #   Teile die Bot-Antwort in maximal 5 Antworten auf
+            paragraphs = paragraphs[:5]
+            #   Kurze Absätze werden zusammengefasst, damit weniger Nachrichten gesendet werden
+            if MERGE_PARAGRAPHS:
+                paragraphs = merge_paragraphs(paragraphs)
+            #   Teilantworten dürfen maximal 2000 Zeichen haben, sonst werden sie aufgeteilt
+            #   Alle Nachrichten werden sofort in die Warteschlange gelegt und in Reihenfolge versendet
+            sends = [outbox.send(message.channel, chunk) for para in paragraphs for chunk in split_message(para)]
+            await asyncio.gather(*sends)
+
+        #   Bildgenerierung: Bilder werden nach dem Text in der ursprünglichen Reihenfolge versendet
+        await send_generated_images(message.channel, image_tasks)
 
     #   Fehlerbehandlung für alle anderen Probleme bei der Verarbeitung
     except Exception as e:
+        #   Laufende Bildgenerierungen werden abgebrochen
+        for task in image_tasks:
+            task.cancel()
         logger.error(f"Fehler: {e}")
-        await loading_msg.delete()
-        await message.channel.send("Es ist ein Fehler aufgetreten 😕")
+        if reply:
+            await reply.abort()
+        else:
+            await outbox.delete(loading_msg)
+        await outbox.send(message.channel, "Es ist ein Fehler aufgetreten 😕")
+
+#   Startet Hermine und schließt beim Beenden die gemeinsame HTTP-Sitzung für Bilddownloads
+async def main():
+    try:
+        await client.start(DISCORD_BOT_TOKEN)
+    finally:
+        await image_fetcher.close()
 
-client.run(DISCORD_BOT_TOKEN)
\ No newline at end of file
+#   Startpunkt des Programms
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+
+#   Lädt Variablen aus der .env-Datei
+load_dotenv()
+
+#   Zeit in Sekunden, nach der eine inaktive Sitzung entfernt wird
+SESSION_IDLE_TIMEOUT = int(os.getenv("SESSION_IDLE_TIMEOUT", 30 * 60))
+#   Maximale Anzahl gleichzeitig gespeicherter Sitzungen
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", 200))
+#   Obergrenze für den geschätzten Speicherbedarf aller Gesprächsverläufe (in Tokens)
+MAX_TOTAL_TOKENS = int(os.getenv("MAX_TOTAL_TOKENS", 2_000_000))
+#   Abstand in Sekunden, in dem inaktive Sitzungen gesucht und der Speicherbedarf geprüft wird
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", 60))
+
+#   Sitzung eines Nutzers in einem Kanal
+#   Jede Sitzung hat einen eigenen Gesprächsverlauf und ein eigenes Lock,
+#   damit Anfragen desselben Nutzers nacheinander, Anfragen verschiedener Nutzer parallel bearbeitet werden
+class UserSession:
+    def __init__(self, key, memory):
+        self.key = key  #   (Kanal-ID, Nutzer-ID)
+        self.memory = memory    #   Gesprächsverlauf der Sitzung
+        self.lock = asyncio.Lock()
+        self.last_active = time.monotonic()
+        self.users = 0  #   Anfragen, die die Sitzung gerade bearbeiten oder auf ihr Lock warten
+        self.rehydrated = None  #   Wiederherstellung aus dem dauerhaften Speicher (Future)
+
+    #   Sitzungen in Benutzung werden nie entfernt
+    def in_use(self):
+        return self.users > 0
+
+#   Verwaltung aller Sitzungen
+#   Inaktive Sitzungen werden nach idle_timeout entfernt, bei zu vielen Sitzungen
+#   oder zu großem Speicherbedarf werden die am längsten ungenutzten Sitzungen zuerst entfernt
+#   Geprüft wird nur in Abständen von sweep_interval oder wenn eine neue Sitzung die Obergrenze überschreitet
+class SessionManager:
+    def __init__(self, create_memory, max_sessions=MAX_SESSIONS, idle_timeout=SESSION_IDLE_TIMEOUT, max_total_tokens=MAX_TOTAL_TOKENS,
+                 sweep_interval=SESSION_SWEEP_INTERVAL):
+        self.create_memory = create_memory  #   Erstellt den Gesprächsverlauf für eine neue Sitzung (erhält den Schlüssel)
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_total_tokens = max_total_tokens
+        self.sweep_interval = sweep_interval
+        self.next_sweep = time.monotonic() + sweep_interval
+        self.sessions = OrderedDict()   #   Schlüssel -> UserSession, zuletzt genutzte Sitzung am Ende
+
+    #   Sitzung für die Dauer einer Anfrage: zählt die Anfrage als Nutzer und hält das Lock der Sitzung
+    #   Anfragen derselben Sitzung werden so nacheinander bearbeitet, verschiedene Sitzungen parallel
+    @asynccontextmanager
+    async def use(self, channel_id, user_id):
+        session = await self.get(channel_id, user_id)
+        session.users += 1
+        try:
+            async with session.lock:
+                yield session
+        finally:
+            session.users -= 1
+            session.last_active = time.monotonic()
+
+    #   Gibt die Sitzung eines Nutzers in einem Kanal zurück und erstellt sie bei Bedarf
+    #   Gleichzeitige Anfragen an eine neue Sitzung warten auf dieselbe Wiederherstellung
+    async def get(self, channel_id, user_id):
+        key = (channel_id, user_id)
+        session = self.sessions.get(key)
+        if session is None:
+            session = UserSession(key, self.create_memory(key))
+            #   Nach einem Neustart oder Entfernen wird der Verlauf aus dem dauerhaften Speicher geladen
+            session.rehydrated = asyncio.ensure_future(self._rehydrate(session))
+            self.sessions[key] = session
+        session.last_active = time.monotonic()
+        self.sessions.move_to_end(key)
+        if len(self.sessions) > self.max_sessions or session.last_active >= self.next_sweep:
+            self.evict(keep=key)
+        await session.rehydrated
+        return session
+
+    @staticmethod
+    async def _rehydrate(session):
+        try:
+            await session.memory.rehydrate()
+        except Exception as e:
+            print(f"[Sitzungen] Wiederherstellung von Sitzung {session.key} fehlgeschlagen: {e}")
+
+    #   Geschätzter Speicherbedarf aller Sitzungen (in Tokens)
+    def total_tokens(self):
+        return sum(session.memory.estimated_tokens() for session in self.sessions.values())
+
+    #   Entfernt inaktive Sitzungen und hält die Obergrenzen ein
+    #   Sitzungen in Benutzung und die Sitzung keep bleiben erhalten
+    def evict(self, keep=None):
+        now = time.monotonic()
+        self.next_sweep = now + self.sweep_interval
+        for key, session in list(self.sessions.items()):
+            if key != keep and not session.in_use() and now - session.last_active > self.idle_timeout:
+                del self.sessions[key]
+
+        total_tokens = self.total_tokens()
+        for key, session in list(self.sessions.items()):
+            if len(self.sessions) <= self.max_sessions and total_tokens <= self.max_total_tokens:
+                break
+            if key == keep or session.in_use():
+                continue
+            total_tokens -= session.memory.estimated_tokens()
+            del self.sessions[key]
+            print(f"[Sitzungen] Sitzung {key} entfernt (Obergrenze erreicht)")
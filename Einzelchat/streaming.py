@@ -0,0 +1,153 @@
+import asyncio
+import re
+import time
+
+#   Mindestabstand in Sekunden zwischen zwei Bearbeitungen derselben Nachricht
+#   Discord erlaubt nur wenige Bearbeitungen pro Kanal und Sekunde
+EDIT_INTERVAL = 1.2
+
+#   Entfernt vollständige Bild-Tags und ein noch unvollständiges Bild-Tag am Ende des Textes
+def strip_image_tags(text):
+    text = re.sub(r"\[BILD:.*?\]", "", text)
+    #   Ein begonnenes, aber noch nicht geschlossenes Tag (z.B. "[BIL" oder "[BILD: Mona") wird abgeschnitten
+    start = text.rfind("[")
+    if start != -1 and "]" not in text[start:] and "[BILD:".startswith(text[start:start + 6]):
+        text = text[:start]
+    return text.strip()
+
+#   Klasse zur schrittweisen Anzeige einer gestreamten Antwort in Discord
+#   Fertige Absätze (getrennt durch zwei Zeilenumbrüche) werden als eigene Nachricht verschickt
+#   Der aktuell entstehende Absatz wird in regelmäßigen Abständen durch Bearbeiten der Nachricht aktualisiert
+#   Die Übergangsnachricht ("Hermine denkt nach...") wird dabei zum ersten Absatz
+#   Senden, Bearbeiten und Löschen laufen über die Warteschlange des Bots (OutboundQueue, gleiche Ratenbegrenzung)
+#   Die Anzeige läuft in einer eigenen Aufgabe, damit das Lesen des Streams nicht auf Discord warten muss
+#   merge: kurze Absätze werden wie bei merge_paragraphs an die vorherige Nachricht angehängt, solange sie passen
+class StreamingReply:
+    def __init__(self, channel, placeholder, split_message, outbox, merge=True, max_paragraphs=5, max_length=2000,
+                 edit_interval=EDIT_INTERVAL):
+        self.channel = channel
+        self.placeholder = placeholder  #   Übergangsnachricht, wird mit dem ersten Absatz überschrieben
+        self.split_message = split_message  #   Funktion zum Aufteilen zu langer Absätze
+        self.outbox = outbox    #   Ausgehende Warteschlange (send, edit, delete)
+        self.merge = merge
+        self.max_paragraphs = max_paragraphs    #   Maximale Anzahl an Absätzen (= Nachrichten)
+        self.max_length = max_length    #   Maximale Länge einer Discord-Nachricht
+        self.edit_interval = edit_interval
+        self.buffer = ""    #   Text des aktuell entstehenden Absatzes
+        self.current = placeholder  #   Nachricht, die gerade bearbeitet wird
+        self.current_text = None    #   Angezeigter Text der aktuellen Nachricht
+        self.prefix = ""    #   Fertige Absätze in der aktuellen Nachricht (beim Zusammenfassen)
+        self.paragraph_count = 0    #   Bereits verschickte Absätze
+        self.last_edit = 0.0    #   Zeitpunkt der letzten Bearbeitung
+        self.pending = ""   #   Empfangener Text, den die Anzeige noch nicht übernommen hat
+        self.received = asyncio.Event()     #   Signal an die Anzeige: neuer Text oder Ende des Streams
+        self.ended = False
+        self.display_task = None    #   Aufgabe, die die Nachrichten sendet und bearbeitet
+
+    #   Wurde die Übergangsnachricht bereits mit Antworttext überschrieben?
+    @property
+    def placeholder_used(self):
+        return self.current is not self.placeholder or self.current_text is not None
+
+    #   Neuer Textabschnitt aus dem Stream
+    #   Wartet nicht auf Discord: der Text wird nur übergeben, die Anzeige übernimmt ihn, sobald sie frei ist
+    async def feed(self, delta):
+        if not delta:
+            return
+        self.pending += delta
+        self.received.set()
+        if self.display_task is None:
+            self.display_task = asyncio.create_task(self._display())
+
+    #   Anzeige: übernimmt jeweils den gesamten bis dahin empfangenen Text
+    #   Während eine Nachricht gesendet oder bearbeitet wird, sammelt sich neuer Text in pending
+    async def _display(self):
+        while True:
+            await self.received.wait()
+            self.received.clear()
+            self.buffer += self.pending
+            self.pending = ""
+            #   Alle vollständigen Absätze werden abgeschlossen
+            while "\n\n" in self.buffer:
+                paragraph, self.buffer = self.buffer.split("\n\n", 1)
+                await self._finish_paragraph(paragraph)
+            if self.ended and not self.pending:
+                return
+            await self._preview()
+
+    #   Wartet, bis die Anzeige den gesamten empfangenen Text übernommen hat
+    async def _end_display(self):
+        self.ended = True
+        self.received.set()
+        if self.display_task is not None:
+            await self.display_task
+
+    #   Stream ist beendet: letzter Absatz wird abgeschlossen
+    async def finish(self):
+        await self._end_display()
+        if self.buffer.strip():
+            await self._finish_paragraph(self.buffer)
+        self.buffer = ""
+        #   Wurde kein Text angezeigt (z.B. nur ein Bild-Tag), wird die Übergangsnachricht gelöscht
+        if not self.placeholder_used:
+            await self.outbox.delete(self.placeholder)
+
+    #   Fehlerfall: Anzeige beenden und Übergangsnachricht entfernen, falls sie noch angezeigt wird
+    async def abort(self):
+        if self.display_task is not None and not self.display_task.done():
+            self.display_task.cancel()
+        if self.display_task is not None:
+            await asyncio.gather(self.display_task, return_exceptions=True)
+        if not self.placeholder_used:
+            await self.outbox.delete(self.placeholder)
+
+    #   Zeigt den Text in der aktuellen Nachricht an (neue Nachricht oder Bearbeitung)
+    async def _show(self, text):
+        if self.current is None:
+            self.current = await self.outbox.send(self.channel, text)
+        elif text != self.current_text:
+            await self.outbox.edit(self.current, text)
+        self.current_text = text
+        self.last_edit = time.monotonic()
+
+    #   Zwischenstand des aktuellen Absatzes anzeigen (höchstens alle edit_interval Sekunden)
+    async def _preview(self):
+        if self.paragraph_count >= self.max_paragraphs:
+            return
+        if time.monotonic() - self.last_edit < self.edit_interval:
+            return
+        text = strip_image_tags(self.buffer)[:self.max_length]
+        if text:
+            await self._show_paragraph(text)
+
+    #   Zeigt einen (entstehenden) Absatz hinter den fertigen Absätzen der aktuellen Nachricht an
+    #   Passt er nicht mehr dazu, wird die Nachricht auf die fertigen Absätze zurückgesetzt und eine neue begonnen
+    async def _show_paragraph(self, text):
+        if self.prefix and len(self.prefix) + len(text) > self.max_length:
+            await self._show(self.prefix.rstrip())
+            self.current = None
+            self.current_text = None
+            self.prefix = ""
+        await self._show(self.prefix + text)
+
+    #   Vollständigen Absatz anzeigen, zu lange Absätze werden auf mehrere Nachrichten aufgeteilt
+    async def _finish_paragraph(self, paragraph):
+        text = strip_image_tags(paragraph)
+        if not text or self.paragraph_count >= self.max_paragraphs:
+            return
+        chunks = list(self.split_message(text, self.max_length))
+        for i, chunk in enumerate(chunks):
+            if i == 0:
+                await self._show_paragraph(chunk)
+            else:
+                self.current = await self.outbox.send(self.channel, chunk)
+                self.current_text = chunk
+        self.paragraph_count += 1
+        if self.merge and len(chunks) == 1:
+            #   Der nächste Absatz wird an diese Nachricht angehängt, solange sie nicht zu lang wird
+            self.prefix = self.current_text + "\n\n"
+        else:
+            #   Der nächste Absatz beginnt in einer neuen Nachricht
+            self.current = None
+            self.current_text = None
+            self.prefix = ""
@@ -1,18 +1,22 @@
-import random
+import asyncio
+import base64
+import io
 import discord  # Discordmodul importieren
 import logging  # Skriptfehler identifizieren
 import re   #   Trennung von Strings
 import os   # Zugriff auf Funktionen des Betriebssystems
-import aiohttp
-import base64
+import time
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
 from message_storage import storage
-import json
+from shared.openai_scheduler import scheduler, PRIORITY_IMAGE
+from shared.image_fetcher import image_fetcher
+from shared.image_cache import image_cache
+from shared.send_queue import OutboundQueue
+from metrics import setup_logging, stage, observe_stage, enter_turn
 
 
-#   Fehler im Terminal protokollieren
-logging.basicConfig(level=logging.INFO)    # Nur Fehler anzeigen
+#   Protokollierung über eine Warteschlange, damit Ausgaben den Event-Loop nicht blockieren
+setup_logging()
 
 #   Lädt Variablen aus der .env-Datei
 load_dotenv()
@@ -24,14 +28,27 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY nicht gefunden! Überprüfe deine .env-Datei.")
 
-#   OpenAI-Client mit API-Schlüssel initialisieren
-openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+#   OpenAI-Anfragen laufen über den gemeinsamen Scheduler, Bildgenerierung mit niedriger Priorität
+openai_client = scheduler.client(PRIORITY_IMAGE)
 
 #   Discord-Client Setup
 intents = discord.Intents.default()
 intents.message_content = True  # Aktiviert die Fähigkeit des Bots, Nachrichten zu lesen
 client = discord.Client(intents=intents)    #   Discord-Client initialisieren
 
+#   Modell und Größe für die Bildgenerierung
+IMAGE_MODEL = "dall-e-3"
+IMAGE_SIZE = "1024x1024"
+
+#   Maximale Anzahl gleichzeitig laufender Bildgenerierungen (für alle Charakterbots)
+MAX_PARALLEL_IMAGES = 3
+#   Maximale Wartezeit in Sekunden für ein einzelnes Bild
+IMAGE_TIMEOUT = 60
+image_semaphore = asyncio.Semaphore(MAX_PARALLEL_IMAGES)
+
+#   Ausgehende Warteschlangen aller Charakterbots (Bot-Name -> OutboundQueue), z.B. für Kennzahlen
+outboxes = {}
+
 #   Funktion zur Aufteilung von langen Nachrichten in mehrere Nachrichten
 #   Eine Nachricht ist maximal 2000 Zeichen lang
 #   Nachrichten sollen nicht mitten im Satz/Wort geteilt werden
@@ -57,23 +74,42 @@ def extract_image_prompts(answer):
     return re.findall(r"\[BILD:(.*?)]", answer)
 
 #   DALLE-E generiert Bilder basierend auf den Prompts
-async def generate_image(PROMPT1):
-    response = await openai_client.images.generate(
-        model="dall-e-3",
-        prompt=PROMPT1,
-        size="1024x1024",
-        n=1 #   Nur ein Bild pro Prompt
-    )
-    return response.data[0].url #   URL des generieten Bildes wird ausgegeben
+#   Bereits erstellte Bilder (gleicher Prompt, gleiche Persona) werden aus dem Bildzwischenspeicher geladen
+#   Gibt die Bilddaten (PNG) zurück, damit sie als Anhang hochgeladen werden können
+async def generate_image(PROMPT1, persona=None):
+    key = image_cache.make_key(PROMPT1, persona, model=IMAGE_MODEL, size=IMAGE_SIZE)
+    image_bytes = await image_cache.get(key)
+    if image_bytes is not None:
+        print(f"[Bildcache] Treffer für '{PROMPT1}'")
+        return image_bytes
+
+    with stage("image", persona or ""):
+        response = await openai_client.images.generate(
+            model=IMAGE_MODEL,
+            prompt=PROMPT1,
+            size=IMAGE_SIZE,
+            response_format="b64_json",  #   Bilddaten direkt statt einer ablaufenden URL
+            n=1 #   Nur ein Bild pro Prompt
+        )
+    image_bytes = base64.b64decode(response.data[0].b64_json)
+    await image_cache.put(key, image_bytes)
+    print(f"[Bildcache] Neues Bild für '{PROMPT1}' gespeichert")
+    return image_bytes   #   Bilddaten des generierten Bildes werden ausgegeben
+
+#   Startet die Bildgenerierung für alle Prompts gleichzeitig
+#   Höchstens MAX_PARALLEL_IMAGES Bilder werden parallel erstellt, jedes Bild hat eine eigene Frist (IMAGE_TIMEOUT)
+#   Die Aufgaben werden in der Reihenfolge der Prompts zurückgegeben
+def start_image_generation(prompts, persona=None):
+    async def generate_limited(prompt):
+        async with image_semaphore:
+            return await asyncio.wait_for(generate_image(prompt, persona), timeout=IMAGE_TIMEOUT)
+    return [asyncio.create_task(generate_limited(prompt.strip())) for prompt in prompts]
 
 #   Funktion zum Herunterladen von Bildern
 #   Lädt ein Bild von einer angegebenen URL herunter
+#   Nutzt die gemeinsame HTTP-Sitzung und den Bildzwischenspeicher aller Bots
 async def download_image(url):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            if resp.status == 200:
-                return await resp.read()
-    return None
+    return await image_fetcher.fetch_bytes(url)
 
 #   Funktion zum Erstellen und späteren Starten eines Charakterbots
 def create_bot(bot_name, DISCORD_BOT_TOKEN):
@@ -82,6 +118,13 @@ def create_bot(bot_name, DISCORD_BOT_TOKEN):
     intents = discord.Intents.default()
     intents.message_content = True
     client = discord.Client(intents=intents)
+    #   Nachrichten werden pro Kanal über eine Warteschlange im Rahmen der Discord-Grenzen versendet
+    #   Wartezeit in der Warteschlange und Dauer des Versands werden als Kennzahlen erfasst
+    def on_sent(queued_seconds, send_seconds):
+        observe_stage("send_queue", queued_seconds, bot_name)
+        observe_stage("discord_send", send_seconds, bot_name)
+    outbox = OutboundQueue(on_sent=on_sent)
+    outboxes[bot_name] = outbox
 
 
     @client.event
@@ -91,76 +134,141 @@ def create_bot(bot_name, DISCORD_BOT_TOKEN):
         await message_loop()    #   Startet die Schleife message_loop zur Bearbeitung von eingehenden Nachrichten
 
     #   Asynchrone Funktion, die aufgerufen wird, wenn eine Nachricht erhalten wird
+    #   Aufträge verschiedener Kanäle werden parallel versendet, innerhalb eines Kanals nacheinander
     async def message_loop():
+        running = set()     #   Laufende Versandaufgaben (Referenz verhindert vorzeitiges Aufräumen)
         while True:
-            #   Warte, bis Mediatorbot Auswahl getroffen hat und Nutzeranfrage zur Beantwortung freigibt
-            await storage.wait_for_send_message_event()
+            #   Warte, bis Mediatorbot diesen Bot ausgewählt und einen Auftrag in seine Warteschlange gelegt hat
+            job = await storage.next_job(bot_name)
             #print(bot_name + " aufgewacht")
-            #   Prüfe, ob zur Beantwortung freigegeben
-            if not await storage.wasIChosen(bot_name):
-                continue    #Falls nicht, wird der Schleifendurchlauf hier abgebrochen
-
-            #   Alle Konversationsdaten aufrufen
-            data = await storage.get_all_data()
-            #   Nachrichtenbegrenzung prüfen
-            current_reply_count = await storage.get_reply_count(data['message_id'])
-            #   Antwortenanzahl pro Nutzeranfrage auf maximal 5 setzen
-            if current_reply_count >= 5:
-                print("Antwortgrenze erreicht. Breche ab.")
-                continue
-
-            #   Antwortenanzahl auf bis zu 5 Antworten pro Nutzeranfrage reduzieren
-            #   mindestens eine Antwort wird generiert
-            #   mit 70%iger Wahrscheinlichkeit wird nach der letzten Antwort eine weitere generiert
-#            if current_reply_count >= 1:
-#                continue_propability = 0.7
-#                if random.random() > continue_propability:
-#                    print(f"Zufällig gestoppt bei {current_reply_count}")
-#                    continue
-
-            #   Antworttext des Charakterbots holen
-            answer = await storage.getMyAnswer(bot_name)
-            #   Erlaubte Kanäle entsprechen den Kanälen, in denen der Mediator eine Berechtigung hat
-            channel_id = data["channel_id"]
-            channel = discord.utils.get(client.get_all_channels(),id=channel_id)
-
-            #   Verarbeitung von Antworten mit Bildgenerierung
-            if "[BILD:" in answer:
-                #   Extrahiert Bildprompts werden als Liste in der Variablen image_prompts gespeichert
-                image_prompts = extract_image_prompts(answer)
-                for prompt in image_prompts:
-                    #   Antwortengrenze prüfen
-                    if await storage.get_reply_count(data["message_id"]) >= 5:
-                        print("Antwortgrenze erreicht. Versende keine Antwort mehr.")
-                        return  #   Wenn hier eine Überschreitung vorliegt, wird die Schleife abgebrochen
-
-                    try:
-                        img_url = await generate_image(prompt.strip())  #   Mit dem Bildprompt wird über Dall-e ein Bild generiert
-                        embed = discord.Embed() #   Discord-Einbettung
-                        embed.set_image(url=img_url)    #   Bild wird eingefügt
-                        sent_message = await channel.send(embed=embed)  #   Nachricht wird abgesendet
-                        #   Nachricht in den Botnachrichten-Speicher hinzufügen
-                        await storage.store_bot_messages(f"[BILD: {img_url}]", data['message_id'], sent_message.id, is_image=True, bot_name=bot_name)
-                        #print(f"Bot hat nachricht gespeichert {sent_message.id}")
-
-                    #   Fehlerbehandlung bei der Bildgenerierung
-                    except Exception as e:
-                        logger.error(f"Fehler bei Bild {e}")
-                        await channel.send(f"Fehler beim Erstellen von Bild {e}")
+            task = asyncio.create_task(handle_job(job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+
+    #   Versendet einen Auftrag im zugehörigen Kanal
+    #   Enthält der Auftrag ein Future ("done"), wird es mit der ID der letzten gesendeten Nachricht erfüllt
+    #   Aufträge zu einer älteren Nutzeranfrage werden verworfen bzw. abgebrochen, sobald eine neue eintrifft
+    async def handle_job(job):
+        session = await storage.session(job["channel_id"])
+        session.take_job()
+        last_sent_id = None
+        try:
+            if not session.track(job["root_message_id"], asyncio.current_task()):
+                print(f"[{bot_name}] Auftrag zu einer älteren Nutzeranfrage wird verworfen.")
+                return
+            #   Bildgenerierungen dieses Auftrags zählen zur Nutzeranfrage
+            enter_turn(job["root_message_id"])
+            async with session.send_lock:
+                #   Zeit von der Auswahl des Bots bis zum Beginn des Versands
+                observe_stage("dispatch_wait", time.monotonic() - job["queued_at"], bot_name)
+                try:
+                    last_sent_id = await send_answer(session, job)
+                except Exception as e:
+                    logger.error(f"Fehler beim Versenden der Antwort: {e}")
+        finally:
+            done = job.get("done")
+            if done is not None and not done.done():
+                done.set_result(last_sent_id)
+
+    #   Versendet die Antwort des Bots in dem Kanal der übergebenen Sitzung
+    #   Gibt die ID der letzten gesendeten Nachricht zurück (None, falls nichts gesendet wurde)
+    async def send_answer(session, job):
+        #   Alle Daten des Auftrags
+        data = {"message_id": job["message_id"], "channel_id": job["channel_id"]}
+        #   Nachrichtenbegrenzung prüfen
+        current_reply_count = await session.get_reply_count(data['message_id'])
+        #   Antwortenanzahl pro Nutzeranfrage auf maximal 5 setzen
+        if current_reply_count >= 5:
+            print("Antwortgrenze erreicht. Breche ab.")
+            return None
 
+        #   Antwortenanzahl auf bis zu 5 Antworten pro Nutzeranfrage reduzieren
+        #   mindestens eine Antwort wird generiert
+        #   mit 70%iger Wahrscheinlichkeit wird nach der letzten Antwort eine weitere generiert
+#        if current_reply_count >= 1:
+#            continue_propability = 0.7
+#            if random.random() > continue_propability:
+#                print(f"Zufällig gestoppt bei {current_reply_count}")
+#                return
+
+        #   Antworttext des Charakterbots holen
+        answer = job["answer"]
+        #   Erlaubte Kanäle entsprechen den Kanälen, in denen der Mediator eine Berechtigung hat
+        channel_id = data["channel_id"]
+        channel = discord.utils.get(client.get_all_channels(),id=channel_id)
+
+        #   Verarbeitung von Antworten mit Bildgenerierung
+        #   Alle Bilder werden sofort parallel erstellt, währenddessen wird bereits der Text versendet
+        image_tasks = []
+        if "[BILD:" in answer:
+            #   Extrahiert Bildprompts werden als Liste in der Variablen image_prompts gespeichert
+            image_prompts = extract_image_prompts(answer)
+            image_tasks = start_image_generation(image_prompts, persona=bot_name)
+
+        last_sent_id = None
+        sends = []  #   Nachrichten in der Warteschlange (werden bei Abbruch nicht mehr gesendet)
+
+        #   Fehlermeldungen zur Bildgenerierung werden wie Bildnachrichten gespeichert: sie zählen nicht zur
+        #   Antwortgrenze, und der Orchestrator findet sie im Index, statt vergeblich darauf zu warten
+        async def send_image_error(text):
+            send = outbox.send(channel, text)
+            sends.append(send)
+            sent_message = await send
+            await asyncio.shield(
+                session.store_bot_messages(text, data['message_id'], sent_message.id, is_image=True, bot_name=bot_name))
+
+        try:
             #   Text ohne Bildanweisungen senden
             text_only = re.sub(r"\[BILD:.*?]", "", answer).strip()
             if text_only:
                 #   Antwort wird in mehrere Nachrichten aufgeteilt, welche jeweils maximal 2000 Zeichen haben
+                #   Alle Teile antworten auf dieselbe Nachricht, die Antwortgrenze wurde oben bereits geprüft
                 chunks = list(split_message(text_only))
-                for chunk in chunks:
-                    #   Antwortengrenze prüfen
-                    if await storage.get_reply_count(data["message_id"]) >= 5:
-                        print("Antwortgrenze erreicht. Keine weitere Antwort mehr.")
-                        return  #   Wenn hier eine Überschreitung vorliegt, wird die Schleife abgebrochen
-                    sent_message = await channel.send(chunk)    #   Nachricht wird abgesendet
+                chunk_sends = [outbox.send(channel, chunk) for chunk in chunks]
+                sends += chunk_sends
+                for chunk, send in zip(chunks, chunk_sends):
+                    sent_message = await send   #   Nachricht wurde abgesendet
+                    #   Nachricht sofort in den Botnachrichten-Speicher hinzufügen (Index im Arbeitsspeicher,
+                    #   dauerhaftes Speichern läuft im Hintergrund), damit der Orchestrator die Antwortkette kennt
+                    #   shield: Bereits gesendete Nachrichten werden auch bei Abbruch des Auftrags noch gespeichert
+                    await asyncio.shield(
+                        session.store_bot_messages(chunk, data['message_id'], sent_message.id, is_image=False, bot_name=bot_name))
+                    last_sent_id = sent_message.id
+
+            #   Bilder werden in der ursprünglichen Reihenfolge versendet, sobald sie fertig sind
+            #   Bildnachrichten zählen nicht zur Antwortgrenze (wurde vor dem Versand bereits geprüft)
+            for task in image_tasks:
+                try:
+                    image_bytes = await task  #   Mit dem Bildprompt wurde über Dall-e ein Bild generiert
+                    #   Bild wird als Anhang hochgeladen und in die Einbettung eingefügt
+                    file = discord.File(io.BytesIO(image_bytes), filename="bild.png")
+                    embed = discord.Embed() #   Discord-Einbettung
+                    embed.set_image(url="attachment://bild.png")    #   Bild wird eingefügt
+                    send = outbox.send(channel, embed=embed, file=file)
+                    sends.append(send)
+                    sent_message = await send   #   Nachricht wurde abgesendet
+                    img_url = sent_message.embeds[0].image.url if sent_message.embeds else None
                     #   Nachricht in den Botnachrichten-Speicher hinzufügen
-                    await storage.store_bot_messages(chunk, data['message_id'], sent_message.id, is_image=False, bot_name=bot_name)
+                    await asyncio.shield(
+                        session.store_bot_messages(f"[BILD: {img_url}]", data['message_id'], sent_message.id, is_image=True, bot_name=bot_name))
+                    last_sent_id = sent_message.id
+                    #print(f"Bot hat nachricht gespeichert {sent_message.id}")
+
+                #   Fehlerbehandlung bei der Bildgenerierung
+                except asyncio.TimeoutError:
+                    logger.error(f"Bild wurde nicht innerhalb von {IMAGE_TIMEOUT}s erstellt")
+                    await send_image_error("Fehler beim Erstellen von Bild: Zeitüberschreitung")
+                except Exception as e:
+                    logger.error(f"Fehler bei Bild {e}")
+                    await send_image_error(f"Fehler beim Erstellen von Bild {e}")
+        finally:
+            #   Nicht mehr benötigte Bildgenerierungen und noch nicht gesendete Nachrichten werden abgebrochen
+            for task in image_tasks:
+                task.cancel()
+            for send in sends:
+                send.cancel()
+        return last_sent_id
+
     #   Funktion zum Starten des Charakterbots
     async def run():
             await client.start(DISCORD_BOT_TOKEN)
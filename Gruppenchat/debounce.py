@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+#   Nachricht aus mehreren kurz hintereinander gesendeten Nutzernachrichten
+#   Bietet dieselben Attribute wie eine Discord-Nachricht, die der Orchestrator verwendet
+#   Texte werden zeilenweise zusammengefügt, Anhänge aller Nachrichten übernommen
+#   ID, Kanal und Autor stammen von der letzten Nachricht
+class CoalescedMessage:
+    def __init__(self, messages):
+        last = messages[-1]
+        self.messages = messages
+        self.id = last.id
+        self.channel = last.channel
+        self.author = last.author
+        self.embeds = []
+        self.content = "\n".join(m.content.strip() for m in messages if m.content and m.content.strip())
+        self.attachments = [attachment for m in messages for attachment in m.attachments]
+
+#   Sammelt Nutzernachrichten pro Kanal, bis für window Sekunden keine neue Nachricht eintrifft
+#   Danach wird handler einmal mit allen gesammelten Nachrichten aufgerufen
+#   Spätestens max_wait Sekunden nach der ersten Nachricht wird die Runde gestartet
+class MessageDebouncer:
+    def __init__(self, handler, window=0.5, max_wait=6.0):
+        self.handler = handler  #   async handler(message), erhält eine Discord-Nachricht oder CoalescedMessage
+        self.window = window
+        self.max_wait = max_wait
+        self.pending = {}   #   Kanal-ID -> {"messages", "first", "timer"}
+
+    #   Nimmt eine Nutzernachricht entgegen
+    async def add(self, message):
+        #   Ohne Zeitfenster wird jede Nachricht sofort bearbeitet
+        if self.window <= 0:
+            await self.handler(message)
+            return
+        channel_id = message.channel.id
+        entry = self.pending.get(channel_id)
+        if entry is None:
+            entry = {"messages": [], "first": time.monotonic(), "timer": None}
+            self.pending[channel_id] = entry
+        entry["messages"].append(message)
+        #   Jede neue Nachricht startet das Zeitfenster neu
+        if entry["timer"]:
+            entry["timer"].cancel()
+        delay = min(self.window, entry["first"] + self.max_wait - time.monotonic())
+        entry["timer"] = asyncio.create_task(self._flush_later(channel_id, max(delay, 0)))
+
+    #   Wartet das Zeitfenster ab und übergibt die gesammelten Nachrichten als eine Runde
+    async def _flush_later(self, channel_id, delay):
+        await asyncio.sleep(delay)
+        entry = self.pending.pop(channel_id, None)
+        if not entry:
+            return
+        messages = entry["messages"]
+        if len(messages) > 1:
+            print(f"[Debounce] {len(messages)} Nachrichten in Kanal {channel_id} zusammengefasst")
+        try:
+            await self.handler(messages[0] if len(messages) == 1 else CoalescedMessage(messages))
+        except Exception as e:
+            print(f"[Debounce] Fehler bei der Bearbeitung: {e}")
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import time
+from collections import deque
+from dotenv import load_dotenv
+from shared.openai_scheduler import scheduler
+
+#   Lädt Variablen aus der .env-Datei
+load_dotenv()
+
+#   Abgesicherte Anfragen an/aus (aus der .env-Datei, Standard: "off")
+HEDGING = os.getenv("HEDGING", "off").lower() == "on"
+#   Perzentil der bisherigen Antwortzeiten, ab dem eine zweite Anfrage gestartet wird
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 0.9))
+#   Modell für die zweite Anfrage (leer = gleiches Modell wie die erste Anfrage)
+HEDGE_FALLBACK_MODEL = os.getenv("HEDGE_FALLBACK_MODEL", "") or None
+#   Maximale Anzahl gleichzeitig laufender zweiter Anfragen
+HEDGE_MAX_IN_FLIGHT = int(os.getenv("HEDGE_MAX_IN_FLIGHT", 2))
+#   Anzahl gespeicherter Antwortzeiten pro Anfrageart und Mindestanzahl, bevor abgesichert wird
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+
+#   Abgesicherte Anfragen gegen einzelne sehr langsame Antworten
+#   Ist eine Anfrage nach dem gewählten Perzentil der bisherigen Antwortzeiten noch nicht fertig,
+#   wird eine zweite Anfrage gestartet (gleiches oder schnelleres Modell)
+#   Abgesichert wird erst, wenn min_samples Antwortzeiten bekannt sind, höchstens max_in_flight Anfragen gleichzeitig
+#   und nur, solange der Scheduler freie Kapazität hat (keine zusätzliche Last bei Überlastung)
+#   Die erste erfolgreiche Antwort wird verwendet, die andere Anfrage abgebrochen
+#   Eine Frist (deadline, Zeitpunkt nach loop.time()) begrenzt beide Anfragen zusammen
+class Hedger:
+    def __init__(self, percentile=HEDGE_PERCENTILE, fallback_model=HEDGE_FALLBACK_MODEL, enabled=HEDGING,
+                 min_samples=MIN_SAMPLES, max_in_flight=HEDGE_MAX_IN_FLIGHT, scheduler=None):
+        self.percentile = percentile
+        self.fallback_model = fallback_model
+        self.enabled = enabled
+        self.min_samples = min_samples
+        self.max_in_flight = max_in_flight
+        self.scheduler = scheduler  #   optional: OpenAIScheduler, dessen Auslastung geprüft wird
+        self.in_flight = 0  #   laufende zweite Anfragen
+        self.latencies = {}     #   Anfrageart -> letzte Antwortzeiten (Sekunden)
+        self.stats_by_key = {}  #   Anfrageart -> Kennzahlen
+
+    #   Wartezeit bis zur zweiten Anfrage für diese Anfrageart (None, solange zu wenige Antwortzeiten bekannt sind)
+    def hedge_delay(self, key):
+        samples = self.latencies.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(int(len(ordered) * self.percentile), len(ordered) - 1)
+        return ordered[index]
+
+    def _hedge_done(self, task):
+        self.in_flight -= 1
+
+    def _record(self, key, latency):
+        self.latencies.setdefault(key, deque(maxlen=LATENCY_WINDOW)).append(latency)
+
+    def _count(self, key, field):
+        stats = self.stats_by_key.setdefault(key, {"requests": 0, "hedged": 0, "hedge_skipped": 0, "primary_wins": 0,
+                                                   "hedge_wins": 0, "deadline_exceeded": 0})
+        stats[field] += 1
+
+    #   Führt call(model) aus und sichert die Anfrage bei Bedarf mit einer zweiten Anfrage ab
+    #   key: Anfrageart (z.B. "persona", "selector"), für getrennte Antwortzeiten und Kennzahlen
+    async def run(self, key, call, model, deadline=None):
+        loop = asyncio.get_running_loop()
+        self._count(key, "requests")
+
+        def remaining():
+            return None if deadline is None else max(deadline - loop.time(), 0)
+
+        async def timed(call_model):
+            start = time.monotonic()
+            result = await call(call_model)
+            self._record(key, time.monotonic() - start)
+            return result
+
+        primary = asyncio.create_task(timed(model))
+        tasks = {primary: "primary"}
+        try:
+            hedge_after = self.hedge_delay(key) if self.enabled else None
+            if hedge_after is not None and remaining() is not None:
+                hedge_after = min(hedge_after, remaining())
+            done, _ = await asyncio.wait({primary}, timeout=hedge_after if hedge_after is not None else remaining())
+            if not done and hedge_after is not None and (remaining() is None or remaining() > 0):
+                #   Erste Anfrage ist langsamer als üblich: zweite Anfrage starten, sofern Kapazität frei ist
+                if self.in_flight < self.max_in_flight and (self.scheduler is None or self.scheduler.has_capacity()):
+                    self._count(key, "hedged")
+                    self.in_flight += 1
+                    hedge = asyncio.create_task(timed(self.fallback_model or model))
+                    hedge.add_done_callback(self._hedge_done)
+                    tasks[hedge] = "hedge"
+                else:
+                    self._count(key, "hedge_skipped")
+
+            #   Die erste erfolgreiche Antwort gewinnt, Fehler einer Anfrage werden ignoriert, solange die andere läuft
+            pending = set(tasks)
+            last_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=remaining(), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self._count(key, "deadline_exceeded")
+                    raise asyncio.TimeoutError(f"Frist für {key} überschritten")
+                for task in done:
+                    if task.exception() is None:
+                        self._count(key, "primary_wins" if tasks[task] == "primary" else "hedge_wins")
+                        if len(tasks) > 1:
+                            print(f"[Hedging] {key}: {tasks[task]} war schneller ({self.stats()[key]})")
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            #   Die unterlegene bzw. noch laufende Anfrage wird abgebrochen
+            for task in tasks:
+                task.cancel()
+
+    #   Kennzahlen pro Anfrageart inkl. Anteil abgesicherter Anfragen und aktueller Wartezeit bis zur zweiten Anfrage
+    def stats(self):
+        result = {}
+        for key, stats in self.stats_by_key.items():
+            requests = stats["requests"]
+            delay = self.hedge_delay(key)
+            result[key] = {
+                **stats,
+                "hedge_rate": round(stats["hedged"] / requests, 3) if requests else 0.0,
+                "hedge_delay": round(delay, 3) if delay is not None else None
+            }
+        return result
+
+#   Gemeinsame Instanz
+hedger = Hedger(scheduler=scheduler)
@@ -0,0 +1,626 @@
+import argparse
+import asyncio
+import base64
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from aiohttp import web
+import discord
+from dotenv import load_dotenv
+
+#   .env laden, bevor die gemeinsamen Module ihre Einstellungen beim Import lesen
+#   (Einstellungen des Lasttests werden später ausdrücklich gesetzt und haben Vorrang)
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+#   Gemeinsame Module von Einzel- und Gruppenchat liegen im Paket shared im Projektverzeichnis
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+#   Lasttest des Gruppenchats ohne Discord und ohne OpenAI-Schlüssel
+#   Orchestrator und die drei Charakterbots laufen unverändert gegen einen lokalen Discord-Ersatz (FakeGateway)
+#   und einen lokalen OpenAI-Ersatz (FakeOpenAI, über OPENAI_BASE_URL) mit einstellbaren Antwortzeiten
+#   Simulierte Besucher schreiben in mehrere Kanäle, am Ende werden Antwortzeiten, Modellaufrufe pro
+#   Nutzernachricht und die Einhaltung der Antwortgrenze (5 Antworten pro Nutzeranfrage) ausgegeben
+#
+#   Beispiel:
+#   python loadtest.py --channels 3 --visitors 2 --messages 5 --latency persona=lognormal:1.5,0.4 --latency selector=fixed:0.4
+#   python loadtest.py --env ORCHESTRATION_MODE=plan --json ergebnis.json
+
+BOT_NAMES = ["hermine", "leonardo", "goten"]
+#   Maximale Anzahl an Textantworten pro Nutzeranfrage (siehe orchestrator.py und bot_instructions.py)
+MAX_REPLIES = 5
+#   Erste ID der simulierten Discord-Nachrichten (Discord-IDs steigen mit der Zeit)
+FIRST_SNOWFLAKE = 1_300_000_000_000_000_000
+
+#   Fragen der simulierten Museumsbesucher
+QUESTIONS = [
+    "Hallo zusammen!",
+    "Wer hat die Mona Lisa gemalt?",
+    "Warum lächelt die Mona Lisa eigentlich?",
+    "Kannst du mir eine Flugmaschine zeichnen?",
+    "Was ist euer Lieblingsbild hier im Museum?",
+    "Wie lange hat Leonardo am Abendmahl gearbeitet?",
+    "Hermine, welcher Zauber passt zu diesem Gemälde?",
+    "Goten, bist du stärker als ein Drache?",
+    "Was bedeutet Sfumato?",
+    "Danke, das war spannend!"
+]
+
+#   Bausteine für die Antworten des OpenAI-Ersatzes
+ANSWER_WORDS = ("Die Mona Lisa wurde um 1503 in Florenz begonnen und zeigt Lisa del Giocondo mit einem "
+                "rätselhaften Lächeln vor einer weiten Landschaft aus Flüssen Wegen und Bergen im Dunst").split()
+
+#   Kleinstes gültiges PNG (1x1 Pixel) für Bildgenerierung und Bildanhänge
+PNG_1PX = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+)
+
+#   Antwortzeiten des OpenAI-Ersatzes pro Anfrageart (überschreibbar mit --latency art=verteilung)
+DEFAULT_LATENCIES = {
+    "persona": "lognormal:1.2,0.4",
+    "persona_bild": "lognormal:3,0.4",
+    "selector": "lognormal:0.6,0.3",
+    "plan": "lognormal:2.5,0.4",
+    "analysis": "lognormal:2,0.3",
+    "summary": "lognormal:1,0.3",
+    "image": "lognormal:8,0.3",
+    "other": "fixed:0.5"
+}
+
+#   Wandelt eine Verteilung in eine Funktion um, die Wartezeiten in Sekunden zieht
+#   fixed:x | uniform:a,b | exp:mittelwert | lognormal:median,sigma
+def parse_distribution(spec, rng):
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v.strip()] if params else []
+    if kind == "fixed" and len(values) == 1:
+        return lambda: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == "exp" and len(values) == 1:
+        return lambda: rng.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+    if kind == "lognormal" and len(values) == 2:
+        return lambda: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Unbekannte Verteilung: {spec}")
+
+#   Perzentil einer sortierten Liste (nächster Rang)
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def summarize_latencies(values):
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "p50": percentile(ordered, 0.5),
+        "p90": percentile(ordered, 0.9),
+        "p95": percentile(ordered, 0.95),
+        "p99": percentile(ordered, 0.99),
+        "max": ordered[-1] if ordered else None
+    }
+
+#   Lokaler Ersatz für die OpenAI-API (Chat Completions und Bildgenerierung)
+#   Antwortet je nach Anfrageart mit passenden Inhalten (Persona-Antwort, Botname, Plan, Bildanalyse, Zusammenfassung)
+#   error_rate: Anteil der Anfragen, die mit 429 (Retry-After) beantwortet werden
+class FakeOpenAI:
+    def __init__(self, latencies, error_rate=0.0, image_answer_ratio=0.0, seed=None):
+        self.rng = random.Random(seed)
+        self.latencies = {kind: parse_distribution(spec, self.rng) for kind, spec in latencies.items()}
+        self.error_rate = error_rate
+        self.image_answer_ratio = image_answer_ratio
+        self.calls = Counter()  #   Anfrageart -> Anzahl
+        self.errors = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.last_activity = time.monotonic()
+        self.runner = None
+        self.base_url = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self.chat)
+        app.router.add_post("/v1/images/generations", self.images)
+        app.router.add_get("/files/{name}", self.file)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    #   Bestimmt die Anfrageart anhand der Prompts der jeweiligen Module
+    @staticmethod
+    def classify(body):
+        texts = []
+        has_image = False
+        for message in body.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, list):
+                for part in content:
+                    if part.get("type") == "image_url":
+                        has_image = True
+                    else:
+                        texts.append(part.get("text", ""))
+            else:
+                texts.append(str(content or ""))
+        text = "\n".join(texts)
+        if "Du planst als Orchestrator" in text:
+            return "plan", text
+        if "Du analysierst ein Bild" in text:
+            return "analysis", text
+        if "Du dienst als Orchestrator" in text:
+            return "selector", text
+        if "Du fasst einen laufenden Chatverlauf" in text:
+            return "summary", text
+        if "Hier handelt es sich um einem Gruppenchat" in text:
+            return ("persona_bild" if has_image else "persona"), text
+        return "other", text
+
+    async def _delay(self, kind):
+        sample = self.latencies.get(kind) or self.latencies["other"]
+        await asyncio.sleep(max(sample(), 0))
+
+    def _rate_limited(self, kind):
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.errors[kind] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached (Lasttest)", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429, headers={"Retry-After": "0.5"}
+            )
+        return None
+
+    def _answer(self, kind, text):
+        rng = self.rng
+        if kind == "selector":
+            #   Nur Bots, deren Antworten im Prompt stehen, sind wählbar
+            candidates = [bot for bot in BOT_NAMES if f"'{bot}':" in text] or BOT_NAMES
+            return rng.choice(candidates)
+        if kind == "plan":
+            turns = []
+            for _ in range(rng.randint(1, 3)):
+                bot = rng.choice([b for b in BOT_NAMES if not turns or turns[-1]["bot"] != b])
+                turns.append({"bot": bot, "text": " ".join(rng.sample(ANSWER_WORDS, rng.randint(8, 20)))})
+            return json.dumps({"turns": turns}, ensure_ascii=False)
+        if kind == "analysis":
+            return json.dumps({"kuenstler": "Leonardo da Vinci", "titel": "Mona Lisa",
+                               "beschreibung": " ".join(ANSWER_WORDS)}, ensure_ascii=False)
+        if kind == "summary":
+            return "Der Besucher interessiert sich für die Mona Lisa und Leonardos Erfindungen."
+        answer = " ".join(rng.sample(ANSWER_WORDS, rng.randint(8, 24))) + "."
+        if rng.random() < self.image_answer_ratio:
+            answer += " [BILD: Eine Skizze der Mona Lisa]"
+        return answer
+
+    async def chat(self, request):
+        body = await request.json()
+        kind, text = self.classify(body)
+        self.calls[kind] += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await self._delay(kind)
+            error = self._rate_limited(kind)
+            if error is not None:
+                return error
+            content = self._answer(kind, text)
+        finally:
+            self.in_flight -= 1
+            self.last_activity = time.monotonic()
+        prompt_tokens = len(text) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        return web.json_response({
+            "id": f"chatcmpl-{self.rng.getrandbits(48):x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        })
+
+    async def images(self, request):
+        await request.json()
+        self.calls["image"] += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await self._delay("image")
+            error = self._rate_limited("image")
+            if error is not None:
+                return error
+        finally:
+            self.in_flight -= 1
+            self.last_activity = time.monotonic()
+        return web.json_response({
+            "created": int(time.time()),
+            "data": [{"b64_json": base64.b64encode(PNG_1PX).decode("ascii")}]
+        })
+
+    #   Bildanhänge der Besucher und hochgeladene Bilder der Bots
+    async def file(self, request):
+        return web.Response(body=PNG_1PX, content_type="image/png")
+
+#   Discord-Ersatz: Nutzer, Anhänge, Nachrichten und Kanäle mit den Attributen, die die Bots verwenden
+class FakeUser:
+    def __init__(self, user_id, name, bot):
+        self.id = user_id
+        self.name = name
+        self.bot = bot
+
+    def __str__(self):
+        return self.name
+
+class FakeAttachment:
+    def __init__(self, attachment_id, url, filename="bild.png", content_type="image/png"):
+        self.id = attachment_id
+        self.url = url
+        self.filename = filename
+        self.content_type = content_type
+
+class FakeMessage:
+    def __init__(self, message_id, channel, author, content, embeds=None, attachments=None):
+        self.id = message_id
+        self.channel = channel
+        self.author = author
+        self.content = content or ""
+        self.embeds = embeds or []
+        self.attachments = attachments or []
+
+#   Sicht eines Clients auf einen Kanal, channel.send sendet im Namen dieses Clients
+class FakeChannel:
+    def __init__(self, gateway, channel_id, user):
+        self.gateway = gateway
+        self.id = channel_id
+        self.name = f"kanal-{channel_id}"
+        self.user = user
+
+    async def send(self, content=None, *, embed=None, file=None, **kwargs):
+        return await self.gateway.post(self.id, self.user, content, embed=embed, file=file)
+
+#   Discord-Ersatz für discord.Client: Ereignisse werden registriert, start() meldet den Client am Gateway an
+class FakeClient:
+    gateway = None  #   wird vom Lasttest gesetzt
+    names = {}  #   Token -> Anzeigename
+
+    def __init__(self, *args, **kwargs):
+        self.handlers = {}
+        self.user = None
+
+    def event(self, coro):
+        self.handlers[coro.__name__] = coro
+        return coro
+
+    async def start(self, token, *args, **kwargs):
+        self.user = self.gateway.register(self, self.names.get(token))
+        if "on_ready" in self.handlers:
+            await self.handlers["on_ready"]()
+        await self.gateway.closed.wait()
+
+    def get_all_channels(self):
+        return [FakeChannel(self.gateway, channel_id, self.user) for channel_id in self.gateway.channel_ids]
+
+#   Verteilt Nachrichten an alle angemeldeten Clients (wie Discord an alle Bots im Kanal)
+#   und protokolliert jede Nachricht mit Zeitpunkt für die Auswertung
+class FakeGateway:
+    def __init__(self, channel_ids, file_base_url, send_latency=None):
+        self.channel_ids = channel_ids
+        self.file_base_url = file_base_url
+        self.send_latency = send_latency    #   Funktion für die Dauer eines channel.send (oder None)
+        self.clients = []
+        self.transcript = []    #   {"id", "channel_id", "author", "bot", "content", "is_image", "time"}
+        self.handler_tasks = set()
+        self.handler_errors = Counter()
+        self.next_id = FIRST_SNOWFLAKE
+        self.last_activity = time.monotonic()
+        self.closed = asyncio.Event()
+
+    def new_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def register(self, client, name=None):
+        user = FakeUser(self.new_id(), name or f"bot{len(self.clients) + 1}", bot=True)
+        self.clients.append((client, user))
+        return user
+
+    async def post(self, channel_id, author, content=None, embed=None, file=None, attachments=None):
+        if self.send_latency:
+            await asyncio.sleep(max(self.send_latency(), 0))
+        message_id = self.new_id()
+        embeds = []
+        if embed is not None:
+            #   Wie bei Discord zeigt die Einbettung danach auf die hochgeladene Datei
+            embed = embed.copy()
+            embed.set_image(url=f"{self.file_base_url}/files/{message_id}.png")
+            embeds.append(embed)
+        if file is not None:
+            #   Hochgeladene Dateien sind wie bei Discord als Anhang der Nachricht sichtbar
+            attachments = [FakeAttachment(self.new_id(), f"{self.file_base_url}/files/{message_id}.png",
+                                          filename=getattr(file, "filename", None) or "bild.png")]
+        self.transcript.append({
+            "id": message_id,
+            "channel_id": channel_id,
+            "author": author.name,
+            "bot": author.bot,
+            "content": content or "",
+            "is_image": bool(embeds),
+            "time": time.monotonic()
+        })
+        self.last_activity = time.monotonic()
+        for client, user in self.clients:
+            handler = client.handlers.get("on_message")
+            if handler is None:
+                continue
+            message = FakeMessage(message_id, FakeChannel(self, channel_id, user), author, content, embeds, attachments)
+            task = asyncio.create_task(self._dispatch(handler, message))
+            self.handler_tasks.add(task)
+            task.add_done_callback(self.handler_tasks.discard)
+        return FakeMessage(message_id, FakeChannel(self, channel_id, author), author, content, embeds, attachments)
+
+    async def _dispatch(self, handler, message):
+        try:
+            await handler(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.handler_errors[f"{type(e).__name__}: {e}"] += 1
+
+#   Ein Besucher schreibt nacheinander mehrere Nachrichten in einen Kanal
+async def visitor(gateway, channel_id, number, args, rng, think_time):
+    user = FakeUser(gateway.new_id(), f"besucher-{channel_id}-{number}", bot=False)
+    for _ in range(args.messages):
+        await asyncio.sleep(max(think_time(), 0))
+        attachments = None
+        if rng.random() < args.image_ratio:
+            attachment_id = gateway.new_id()
+            attachments = [FakeAttachment(attachment_id, f"{gateway.file_base_url}/files/anhang-{attachment_id}.png")]
+        await gateway.post(channel_id, user, rng.choice(QUESTIONS), attachments=attachments)
+
+#   Wartet, bis für settle Sekunden weder Nachrichten noch OpenAI-Anfragen aktiv waren
+async def wait_until_idle(gateway, fake_openai, settle, max_wait):
+    start = time.monotonic()
+    while time.monotonic() - start < max_wait:
+        last = max(gateway.last_activity, fake_openai.last_activity)
+        if fake_openai.in_flight == 0 and time.monotonic() - last >= settle:
+            return True
+        await asyncio.sleep(0.2)
+    return False
+
+#   Wertet Protokoll und gespeicherte Antwortketten aus
+def build_report(gateway, fake_openai, db_path, duration):
+    user_messages = [entry for entry in gateway.transcript if not entry["bot"]]
+    bot_entries = {entry["id"]: entry for entry in gateway.transcript if entry["bot"]}
+    user_by_id = {entry["id"]: entry for entry in user_messages}
+
+    with contextlib.closing(sqlite3.connect(db_path)) as connection:
+        rows = connection.execute("SELECT sent_message_id, received_message_id, root_message_id, bot_name, is_image "
+                                  "FROM bot_messages ORDER BY sent_message_id").fetchall()
+    stored = {sent: {"received": received, "root": root, "bot": bot, "is_image": bool(is_image)}
+              for sent, received, root, bot, is_image in rows}
+
+    #   Runden: alle gespeicherten Botnachrichten zu einer Nutzeranfrage
+    turns = defaultdict(list)
+    for sent, info in stored.items():
+        turns[info["root"]].append(sent)
+
+    first_reply, turn_duration = [], []
+    too_many_replies = []
+    too_deep = []
+    stale_replies = 0
+    repeated_bot = 0
+    text_depth = {}
+    for sent in sorted(stored):
+        info = stored[sent]
+        if not info["is_image"]:
+            text_depth[sent] = text_depth.get(info["received"], 0) + 1
+            if text_depth[sent] > MAX_REPLIES:
+                too_deep.append(sent)
+    for root, sent_ids in turns.items():
+        user_entry = user_by_id.get(root)
+        times = [bot_entries[sent]["time"] for sent in sent_ids if sent in bot_entries]
+        if user_entry and times:
+            first_reply.append(min(times) - user_entry["time"])
+            turn_duration.append(max(times) - user_entry["time"])
+        text_replies = [sent for sent in sent_ids if not stored[sent]["is_image"]]
+        if len(text_replies) > MAX_REPLIES:
+            too_many_replies.append(root)
+        #   Antworten, die erst nach einer neueren Nutzernachricht im selben Kanal gesendet wurden
+        if user_entry:
+            newer = [u["time"] for u in user_messages
+                     if u["channel_id"] == user_entry["channel_id"] and u["id"] > root]
+            if newer:
+                stale_replies += sum(1 for t in times if t > min(newer))
+        #   Derselbe Bot antwortet direkt auf sich selbst
+        for sent in sent_ids:
+            received = stored.get(stored[sent]["received"])
+            if received and received["bot"] == stored[sent]["bot"] and not stored[sent]["is_image"]:
+                repeated_bot += 1
+
+    #   Textnachrichten der Bots, die nicht in den Antwortketten gespeichert wurden (z.B. Fehlermeldungen)
+    unstored = [sent for sent in bot_entries if sent not in stored]
+    answered = sum(1 for entry in user_messages if entry["id"] in turns)
+    calls = dict(fake_openai.calls)
+    total_calls = sum(calls.values())
+
+    return {
+        "duration_s": round(duration, 2),
+        "user_messages": len(user_messages),
+        "answered_user_messages": answered,
+        "unanswered_user_messages": len(user_messages) - answered,
+        "bot_messages": len(bot_entries),
+        "first_reply_latency_s": {k: (round(v, 3) if v is not None else None) for k, v in summarize_latencies(first_reply).items()},
+        "turn_duration_s": {k: (round(v, 3) if v is not None else None) for k, v in summarize_latencies(turn_duration).items()},
+        "model_calls": calls,
+        "model_calls_per_user_message": round(total_calls / len(user_messages), 2) if user_messages else 0.0,
+        "model_calls_per_answered_turn": round(total_calls / answered, 2) if answered else 0.0,
+        "rate_limited_calls": dict(fake_openai.errors),
+        "max_parallel_model_calls": fake_openai.max_in_flight,
+        "reply_chains": {
+            "turns": len(turns),
+            "max_text_replies": max((sum(1 for s in ids if not stored[s]["is_image"]) for ids in turns.values()), default=0),
+            "turns_over_limit": len(too_many_replies),
+            "messages_over_depth_limit": len(too_deep),
+            "replies_after_newer_user_message": stale_replies,
+            "bot_replying_to_itself": repeated_bot,
+            "unstored_bot_messages": len(unstored)
+        },
+        "handler_errors": dict(gateway.handler_errors)
+    }
+
+def print_report(report):
+    print("\n===== Lasttest Gruppenchat =====")
+    print(f"Dauer: {report['duration_s']} s")
+    print(f"Nutzernachrichten: {report['user_messages']} (beantwortet: {report['answered_user_messages']}, "
+          f"ohne eigene Antwort: {report['unanswered_user_messages']}), Botnachrichten: {report['bot_messages']}")
+    for label, key in (("Erste Antwort", "first_reply_latency_s"), ("Gesamte Runde", "turn_duration_s")):
+        stats = report[key]
+        print(f"{label} (s): p50={stats['p50']} p90={stats['p90']} p95={stats['p95']} p99={stats['p99']} "
+              f"max={stats['max']} (n={stats['count']})")
+    print(f"Modellaufrufe: {report['model_calls']}")
+    print(f"Modellaufrufe pro Nutzernachricht: {report['model_calls_per_user_message']}, "
+          f"pro beantworteter Runde: {report['model_calls_per_answered_turn']}, "
+          f"max. gleichzeitig: {report['max_parallel_model_calls']}")
+    if report["rate_limited_calls"]:
+        print(f"Mit 429 beantwortete Aufrufe: {report['rate_limited_calls']}")
+    print(f"Verarbeitungsstufen (ms): {report['stages_ms']}")
+    print(f"Event-Loop-Verzögerung (ms): {report['event_loop']['lag_ms']}, Locks: {report['event_loop']['locks']}")
+    for entry in report["event_loop"]["profiler"]["top"][:5]:
+        print(f"  {entry['seconds']:8.3f} s  {entry['chain']}  ({entry['leaf']})")
+    chains = report["reply_chains"]
+    print(f"Antwortketten: {chains}")
+    if report["handler_errors"]:
+        print(f"Fehler in Ereignissen: {report['handler_errors']}")
+    ok = chains["turns_over_limit"] == 0 and chains["messages_over_depth_limit"] == 0
+    print("Antwortgrenze eingehalten" if ok else f"ANTWORTGRENZE VERLETZT (max. {MAX_REPLIES} Antworten pro Nutzeranfrage)")
+    return ok
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Lasttest des Gruppenchats mit Discord- und OpenAI-Ersatz")
+    parser.add_argument("--channels", type=int, default=2, help="Anzahl der Kanäle")
+    parser.add_argument("--visitors", type=int, default=2, help="Besucher pro Kanal")
+    parser.add_argument("--messages", type=int, default=3, help="Nachrichten pro Besucher")
+    parser.add_argument("--think-time", default="exp:15", help="Pause vor jeder Besuchernachricht (Verteilung)")
+    parser.add_argument("--image-ratio", type=float, default=0.0, help="Anteil der Besuchernachrichten mit Bild")
+    parser.add_argument("--image-answer-ratio", type=float, default=0.0,
+                        help="Anteil der Persona-Antworten mit [BILD: ...]")
+    parser.add_argument("--latency", action="append", default=[],
+                        help="Antwortzeit einer Anfrageart, z.B. persona=lognormal:1.2,0.4 (mehrfach möglich)")
+    parser.add_argument("--discord-latency", default="fixed:0.05", help="Dauer eines channel.send (Verteilung)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Anteil der OpenAI-Anfragen mit 429")
+    parser.add_argument("--env", action="append", default=[],
+                        help="Einstellung für die Bots, z.B. ORCHESTRATION_MODE=plan (mehrfach möglich)")
+    parser.add_argument("--settle", type=float, default=10.0, help="Ruhezeit in Sekunden bis zum Ende des Tests")
+    parser.add_argument("--max-duration", type=float, default=900.0, help="Maximale Testdauer in Sekunden")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--log", default=None, help="Ausgaben der Bots in diese Datei schreiben (Standard: verwerfen)")
+    parser.add_argument("--json", default=None, help="Ergebnis zusätzlich als JSON speichern")
+    return parser.parse_args(argv)
+
+async def run(args, workdir):
+    rng = random.Random(args.seed)
+    latencies = dict(DEFAULT_LATENCIES)
+    for item in args.latency:
+        kind, _, spec = item.partition("=")
+        latencies[kind.strip()] = spec.strip()
+    fake_openai = FakeOpenAI(latencies, error_rate=args.error_rate, image_answer_ratio=args.image_answer_ratio,
+                             seed=args.seed)
+    base_url = await fake_openai.start()
+
+    #   Einstellungen müssen vor dem Import der Bots gesetzt sein (load_dotenv überschreibt sie nicht)
+    db_path = os.path.join(workdir, "loadtest.db")
+    os.environ.update({
+        "OPENAI_API_KEY": "lasttest",
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "PERSISTENCE": "on",
+        "CONVERSATION_DB": db_path,
+        "IMAGE_CACHE_DIR": os.path.join(workdir, "image_cache")
+    })
+    for item in args.env:
+        key, _, value = item.partition("=")
+        os.environ[key.strip()] = value.strip()
+
+    channel_ids = [FIRST_SNOWFLAKE - 1000 + i for i in range(args.channels)]
+    gateway = FakeGateway(channel_ids, base_url, parse_distribution(args.discord_latency, rng))
+    FakeClient.gateway = gateway
+    discord.Client = FakeClient
+
+    import orchestrator
+    from characterbots import goten, leonardo, hermine
+    from shared.image_fetcher import image_fetcher
+    from shared.persistence import conversation_store
+    from loop_monitor import monitor
+    monitor.start()
+    FakeClient.names = {os.getenv(f"{bot}_token"): bot for bot in BOT_NAMES}
+    FakeClient.names[orchestrator.DISCORD_BOT_TOKEN] = "orchestrator"
+    orchestrator.ALLOWED_CHANNELS[:] = channel_ids
+
+    bots = [asyncio.create_task(coro) for coro in
+            (orchestrator.run_bot(), goten.run_bot(), leonardo.run_bot(), hermine.run_bot())]
+    start = time.monotonic()
+    think_time = parse_distribution(args.think_time, rng)
+    visitors = [visitor(gateway, channel_id, number, args, rng, think_time)
+                for channel_id in channel_ids for number in range(args.visitors)]
+    try:
+        await asyncio.wait_for(asyncio.gather(*visitors), timeout=args.max_duration)
+        await wait_until_idle(gateway, fake_openai, args.settle, max(args.max_duration - (time.monotonic() - start), 0))
+    except asyncio.TimeoutError:
+        print("[Lasttest] Maximale Testdauer erreicht", file=sys.__stdout__)
+    duration = gateway.last_activity - start
+
+    gateway.closed.set()
+    for task in list(gateway.handler_tasks) + bots:
+        task.cancel()
+    await asyncio.gather(*gateway.handler_tasks, *bots, return_exceptions=True)
+    await image_fetcher.close()
+    await fake_openai.stop()
+    if conversation_store:
+        conversation_store.close()
+
+    report = build_report(gateway, fake_openai, db_path, duration)
+    report["scheduler"] = orchestrator.scheduler.stats()
+    report["hedging"] = orchestrator.hedger.stats()
+    report["conversation_store"] = conversation_store.stats() if conversation_store else None
+    from shared.image_preprocessing import image_preprocessor
+    report["image_preprocessing"] = image_preprocessor.stats()
+    #   Durchschnittliche Dauer der Verarbeitungsstufen (siehe metrics.py)
+    from metrics import stage_seconds
+    report["stages_ms"] = {"/".join(part for part in key if part): {"count": data[-1], "avg": round(data[-2] / data[-1] * 1000, 1)}
+                           for key, data in sorted(stage_seconds.values.items()) if data[-1]}
+    #   Verzögerung des Event-Loops, Rechenzeit pro Funktion (mit --env LOOP_PROFILER=on) und Lock-Wartezeiten
+    snapshot = monitor.snapshot()
+    snapshot.pop("tasks", None)
+    report["event_loop"] = snapshot
+    return report
+
+def main(argv=None):
+    args = parse_args(argv)
+    log = open(args.log, "w", encoding="utf-8") if args.log else io.StringIO()
+    with tempfile.TemporaryDirectory(prefix="lasttest-") as workdir:
+        #   Bildzwischenspeicher und Datenbank landen im temporären Verzeichnis
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+                report = asyncio.run(run(args, workdir))
+        finally:
+            os.chdir(cwd)
+            log.close()
+    ok = print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter, deque
+from dotenv import load_dotenv
+from metrics import registry
+
+#   Lädt Variablen aus der .env-Datei
+load_dotenv()
+
+#   Überwachung des Event-Loops an/aus (aus der .env-Datei, Standard: "on")
+LOOP_MONITOR = os.getenv("LOOP_MONITOR", "on").lower() == "on"
+#   Ab dieser Verzögerung in Sekunden wird ein blockierter Event-Loop gemeldet
+LOOP_LAG_WARNING = float(os.getenv("LOOP_LAG_WARNING", 0.25))
+#   Stichproben-Profiler an/aus (Standard: "off", kostet etwas Rechenzeit)
+LOOP_PROFILER = os.getenv("LOOP_PROFILER", "off").lower() == "on"
+#   Verzeichnis für Diagnosedateien (kill -USR1 <pid> oder python loop_monitor.py <pid>)
+LOOP_DUMP_DIR = os.getenv("LOOP_DUMP_DIR", ".")
+#   Abstand der Messungen der Verzögerung bzw. der Stichproben in Sekunden
+LAG_INTERVAL = 0.25
+SAMPLE_INTERVAL = 0.005
+#   Ab dieser Wartezeit in Sekunden wird eine Wartezeit auf ein Lock mit Aufrufer festgehalten
+LOCK_WAIT_WARNING = 0.1
+#   Anzahl der Einträge in der Diagnosedatei
+DUMP_TOP = 30
+
+#   Quelltextverzeichnisse der Bots und der gemeinsamen Module, nur diese Funktionen werden als Verursacher angezeigt
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIRS = (SOURCE_DIR, os.path.join(os.path.dirname(SOURCE_DIR), "shared"))
+
+lag_histogram = registry.histogram("event_loop_lag_seconds", "Verzögerung des Event-Loops in Sekunden",
+                                   buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+blocked_seconds = registry.counter("event_loop_busy_seconds_total",
+                                   "Geschätzte Rechenzeit im Event-Loop pro Funktion (nur mit Profiler)", ("function",))
+lock_wait_seconds = registry.histogram("lock_wait_seconds", "Wartezeit auf ein Lock in Sekunden", ("lock",))
+lock_hold_seconds = registry.histogram("lock_hold_seconds", "Haltezeit eines Locks in Sekunden", ("lock",))
+
+#   Name einer Funktion im Quelltext der Bots, z.B. "orchestrator.handle_message:233"
+def _describe(frame):
+    module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+    return f"{module}.{frame.f_code.co_name}:{frame.f_lineno}"
+
+def _is_own_code(frame):
+    return frame.f_code.co_filename.startswith(SOURCE_DIRS) and not frame.f_code.co_filename.endswith("loop_monitor.py")
+
+#   Wartet der Event-Loop gerade auf neue Ereignisse (Leerlauf)?
+def _is_idle(frame):
+    name = frame.f_code.co_name
+    filename = os.path.basename(frame.f_code.co_filename)
+    return name in ("select", "poll", "_poll") and filename in ("selectors.py", "windows_events.py")
+
+#   Überwacht den gemeinsamen Event-Loop aller Bots
+#   - Verzögerung: eine Aufgabe schläft LAG_INTERVAL Sekunden und misst, wie viel später sie geweckt wird
+#   - Profiler (optional): ein eigener Thread nimmt alle SAMPLE_INTERVAL Sekunden den Aufrufstapel des Event-Loops auf
+#     und ordnet die Rechenzeit den Funktionen der Bots zu (z.B. json.dumps in generateAnswer)
+#   - Locks: Wartezeiten auf die Locks der Kanäle (siehe TimedLock)
+class LoopMonitor:
+    def __init__(self, lag_warning=LOOP_LAG_WARNING, profile=LOOP_PROFILER, dump_dir=LOOP_DUMP_DIR):
+        self.lag_warning = lag_warning
+        self.profile = profile
+        self.dump_dir = dump_dir
+        self.loop = None
+        self.thread_id = None
+        self.lag_task = None
+        self.lags = deque(maxlen=1200)  #   letzte Verzögerungen (Sekunden)
+        self.max_lag = 0.0
+        self.slow_ticks = 0
+        self.samples = 0    #   alle Stichproben
+        self.busy_samples = Counter()   #   (Aufrufkette, Blattfunktion) -> Stichproben
+        self.recent_busy = Counter()    #   Aufrufketten seit der letzten Messung der Verzögerung
+        self.sample_lock = threading.Lock()     #   Stichproben werden vom Profiler-Thread geschrieben
+        self.lock_stats = {}    #   Lock -> {"count", "total", "max"}
+        self.slow_lock_waits = {}   #   (Lock, Aufrufer) -> {"count", "max"}
+
+    #   Startet die Überwachung im laufenden Event-Loop
+    def start(self):
+        if self.lag_task is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        self.lag_task = asyncio.create_task(self._watch_lag())
+        if self.profile:
+            threading.Thread(target=self._sample, name="loop-profiler", daemon=True).start()
+        #   kill -USR1 <pid> schreibt eine Diagnosedatei (nicht unter Windows)
+        try:
+            self.loop.add_signal_handler(signal.SIGUSR1, self.dump)
+        except (AttributeError, NotImplementedError, RuntimeError):
+            pass
+        print(f"[Loop] Überwachung gestartet (Profiler: {'an' if self.profile else 'aus'})")
+
+    async def _watch_lag(self):
+        while True:
+            start = self.loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            lag = max(self.loop.time() - start - LAG_INTERVAL, 0.0)
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            lag_histogram.observe(lag)
+            if lag >= self.lag_warning:
+                self.slow_ticks += 1
+                culprit = ""
+                with self.sample_lock:
+                    top = self.recent_busy.most_common(1)
+                if top:
+                    (chain, leaf), _ = top[0]
+                    culprit = f", vermutlich {chain} ({leaf})"
+                print(f"[Loop] Event-Loop {lag * 1000:.0f} ms blockiert{culprit}")
+            with self.sample_lock:
+                self.recent_busy.clear()
+
+    #   Stichproben-Thread: Aufrufstapel des Event-Loop-Threads, Leerlauf wird nicht gezählt
+    def _sample(self):
+        while True:
+            time.sleep(SAMPLE_INTERVAL)
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            with self.sample_lock:
+                self.samples += 1
+            if _is_idle(frame):
+                continue
+            leaf = frame.f_code.co_name
+            own = []
+            while frame is not None:
+                if _is_own_code(frame) and frame.f_code.co_name != "<module>":
+                    own.append(_describe(frame))
+                frame = frame.f_back
+            #   Aufrufkette der eigenen Funktionen von außen nach innen:
+            #   äußerste Funktion (Ereignis bzw. Aufgabe, z.B. on_message oder message_loop) und die innersten drei
+            if len(own) > 4:
+                own = own[:3] + ["…", own[-1]]
+            chain = " > ".join(reversed(own)) if own else "(asyncio/discord)"
+            key = (chain, leaf)
+            with self.sample_lock:
+                self.busy_samples[key] += 1
+                self.recent_busy[key] += 1
+            blocked_seconds.inc(SAMPLE_INTERVAL, function=own[0].rsplit(":", 1)[0] if own else "(asyncio/discord)")
+
+    #   Wartezeit auf ein Lock (von TimedLock gemeldet)
+    def record_lock_wait(self, name, wait, caller):
+        lock_wait_seconds.observe(wait, lock=name)
+        stats = self.lock_stats.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        stats["count"] += 1
+        stats["total"] += wait
+        stats["max"] = max(stats["max"], wait)
+        if wait >= LOCK_WAIT_WARNING:
+            slow = self.slow_lock_waits.setdefault((name, caller), {"count": 0, "max": 0.0})
+            slow["count"] += 1
+            slow["max"] = max(slow["max"], wait)
+
+    #   Momentaufnahme für die Fehlersuche: Verzögerung, Rechenzeit pro Funktion, Lock-Wartezeiten, laufende Aufgaben
+    def snapshot(self):
+        lags = sorted(self.lags)
+        with self.sample_lock:
+            busy_samples = Counter(self.busy_samples)
+            samples = self.samples
+        busy = sum(busy_samples.values())
+        snapshot = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "lag_ms": {
+                "last": round(self.lags[-1] * 1000, 1) if self.lags else None,
+                "p50": round(lags[len(lags) // 2] * 1000, 1) if lags else None,
+                "p99": round(lags[min(int(len(lags) * 0.99), len(lags) - 1)] * 1000, 1) if lags else None,
+                "max": round(self.max_lag * 1000, 1),
+                "slow_ticks": self.slow_ticks
+            },
+            "profiler": {
+                "enabled": self.profile,
+                "busy_ratio": round(busy / samples, 3) if samples else None,
+                "top": [{"chain": chain, "leaf": leaf, "seconds": round(count * SAMPLE_INTERVAL, 3)}
+                        for (chain, leaf), count in busy_samples.most_common(DUMP_TOP)]
+            },
+            "locks": {
+                name: {"count": stats["count"], "avg_ms": round(stats["total"] / stats["count"] * 1000, 2),
+                       "max_ms": round(stats["max"] * 1000, 1)}
+                for name, stats in self.lock_stats.items()
+            },
+            "slow_lock_waits": [
+                {"lock": name, "caller": caller, "count": stats["count"], "max_ms": round(stats["max"] * 1000, 1)}
+                for (name, caller), stats in sorted(self.slow_lock_waits.items(), key=lambda item: -item[1]["max"])
+            ][:DUMP_TOP]
+        }
+        if self.loop is not None and threading.get_ident() == self.thread_id:
+            tasks = []
+            for task in asyncio.all_tasks(self.loop):
+                stack = task.get_stack(limit=8)
+                tasks.append({"name": task.get_name(), "coro": getattr(task.get_coro(), "__qualname__", str(task.get_coro())),
+                              "stack": [_describe(frame) for frame in stack]})
+            snapshot["tasks"] = tasks
+        return snapshot
+
+    #   Schreibt eine Diagnosedatei (JSON) in dump_dir, das Schreiben läuft außerhalb des Event-Loops
+    def dump(self):
+        snapshot = self.snapshot()
+        path = os.path.join(self.dump_dir, f"loop-dump-{time.strftime('%Y%m%d-%H%M%S')}.json")
+
+        def write():
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, indent=2, ensure_ascii=False)
+            print(f"[Loop] Diagnosedatei geschrieben: {path}")
+
+        if self.loop is not None and self.loop.is_running():
+            self.loop.run_in_executor(None, write)
+        else:
+            write()
+        return path
+
+#   Gemeinsame Instanz
+monitor = LoopMonitor()
+
+#   asyncio.Lock, das Warte- und Haltezeiten erfasst
+#   Lange Wartezeiten werden mit der aufrufenden Funktion festgehalten (z.B. message_storage.get_all_data)
+class TimedLock(asyncio.Lock):
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+        self.acquired_at = None
+
+    async def acquire(self):
+        start = time.perf_counter()
+        await super().acquire()
+        now = time.perf_counter()
+        self.acquired_at = now
+        wait = now - start
+        caller = ""
+        if wait >= LOCK_WAIT_WARNING:
+            frame = sys._getframe(1)
+            while frame is not None and not _is_own_code(frame):
+                frame = frame.f_back
+            caller = _describe(frame) if frame is not None else ""
+        monitor.record_lock_wait(self.name, wait, caller)
+        return True
+
+    def release(self):
+        if self.acquired_at is not None:
+            lock_hold_seconds.observe(time.perf_counter() - self.acquired_at, lock=self.name)
+            self.acquired_at = None
+        super().release()
+
+#   Zusammenfassung einer Diagnosedatei bzw. Auslösen einer Diagnosedatei im laufenden Bot
+#   python loop_monitor.py <pid>            schickt SIGUSR1, der Bot schreibt loop-dump-*.json
+#   python loop_monitor.py <loop-dump.json> zeigt die wichtigsten Einträge
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Aufruf: python loop_monitor.py <pid> | <loop-dump.json>")
+        sys.exit(2)
+    target = sys.argv[1]
+    if target.isdigit():
+        os.kill(int(target), signal.SIGUSR1)
+        print(f"Diagnosedatei angefordert (Prozess {target}, Verzeichnis LOOP_DUMP_DIR)")
+        sys.exit(0)
+    with open(target, encoding="utf-8") as f:
+        data = json.load(f)
+    print(f"Zeitpunkt: {data['time']}")
+    print(f"Verzögerung (ms): {data['lag_ms']}")
+    print(f"Profiler: {'an' if data['profiler']['enabled'] else 'aus'}, Anteil Rechenzeit: {data['profiler']['busy_ratio']}")
+    for entry in data["profiler"]["top"][:10]:
+        print(f"  {entry['seconds']:8.3f} s  {entry['chain']}  ({entry['leaf']})")
+    print(f"Locks: {data['locks']}")
+    for entry in data["slow_lock_waits"][:10]:
+        print(f"  {entry['lock']}: {entry['count']}x, max. {entry['max_ms']} ms, {entry['caller']}")
+    print(f"Laufende Aufgaben: {len(data.get('tasks', []))}")
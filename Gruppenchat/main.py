@@ -1,16 +1,88 @@
 import asyncio
+import os
+import sys
+from dotenv import load_dotenv
+
+#   .env laden, bevor die gemeinsamen Module ihre Einstellungen beim Import lesen
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+#   Gemeinsame Module von Einzel- und Gruppenchat liegen im Paket shared im Projektverzeichnis
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from characterbots import goten, leonardo, hermine
 import orchestrator
+from shared.image_fetcher import image_fetcher
+from message_storage import storage
+from shared.openai_scheduler import scheduler
+from bot_instructions import outboxes
+from shared.persistence import conversation_store
+from shared.answer_cache import answer_cache
+from shared.image_cache import image_cache
+from hedging import hedger
+import metrics
+from loop_monitor import monitor, LOOP_MONITOR
+
+#   Momentanwerte für den Kennzahlen-Endpunkt (werden erst beim Abruf ermittelt)
+metrics.registry.gauge("openai_queued_requests", "Wartende OpenAI-Anfragen pro Priorität",
+                       lambda: scheduler.stats()["queued"], label="priority")
+metrics.registry.gauge("openai_in_flight_requests", "Laufende OpenAI-Anfragen", lambda: scheduler.in_flight)
+metrics.registry.gauge("bot_dispatch_queue_depth", "Wartende Aufträge pro Charakterbot", storage.queue_depths, label="bot")
+metrics.registry.gauge("discord_send_queue_depth", "Wartende Discord-Nachrichten pro Charakterbot",
+                       lambda: {bot: sum(outbox.stats()["queued"].values()) for bot, outbox in outboxes.items()},
+                       label="bot")
+metrics.registry.gauge("active_channel_sessions", "Kanäle im Arbeitsspeicher", lambda: len(storage.sessions))
+if conversation_store:
+    metrics.registry.gauge("conversation_store_pending_writes", "Noch nicht gespeicherte Einträge",
+                           lambda: conversation_store.stats()["pending"])
+
+#   Absicherung langsamer Anfragen pro Anfrageart (persona, selector)
+for field, help_text in (("requests", "Anfragen mit Absicherung durch eine zweite Anfrage"),
+                         ("hedged", "Anfragen, für die eine zweite Anfrage gestartet wurde"),
+                         ("hedge_wins", "Anfragen, bei denen die zweite Anfrage schneller war"),
+                         ("deadline_exceeded", "Anfragen, die die Frist der Runde überschritten haben")):
+    metrics.registry.gauge(f"hedge_{field}_total", help_text,
+                           lambda field=field: {key: stats[field] for key, stats in hedger.stats().items()},
+                           label="request", kind="counter")
+metrics.registry.gauge("hedge_delay_seconds", "Aktuelle Wartezeit bis zur zweiten Anfrage",
+                       lambda: {key: stats["hedge_delay"] for key, stats in hedger.stats().items()
+                                if stats["hedge_delay"] is not None}, label="request")
+
+#   Zwischenspeicher für Antworten (nur mit ANSWER_CACHE=on) und generierte Bilder
+def cache_stats():
+    caches = {"image": image_cache.stats()}
+    if answer_cache:
+        caches["answer"] = answer_cache.stats()
+    return caches
+
+metrics.registry.gauge("cache_hits_total", "Treffer im Zwischenspeicher",
+                       lambda: {cache: stats["hits"] for cache, stats in cache_stats().items()},
+                       label="cache", kind="counter")
+metrics.registry.gauge("cache_misses_total", "Fehlgriffe im Zwischenspeicher",
+                       lambda: {cache: stats["misses"] for cache, stats in cache_stats().items()},
+                       label="cache", kind="counter")
+metrics.registry.gauge("cache_entries", "Einträge im Zwischenspeicher",
+                       lambda: {cache: stats["entries"] for cache, stats in cache_stats().items()}, label="cache")
+metrics.registry.gauge("image_cache_bytes", "Größe der gespeicherten Bilder in Bytes", lambda: image_cache.stats()["bytes"])
 
 #   Hauptfunktion zur gleichzeitigen Ausführung aller Bots
 async def main():
-    await asyncio.gather(
-        orchestrator.run_bot(),
-        goten.run_bot(),
-        leonardo.run_bot(),
-        hermine.run_bot()
-    )
+    #   Überwachung des gemeinsamen Event-Loops (Verzögerung, Locks, optional Profiler)
+    if LOOP_MONITOR:
+        monitor.start()
+    #   Lokaler Kennzahlen-Endpunkt (nur wenn METRICS_PORT gesetzt ist), Momentaufnahme des Event-Loops unter /debug/loop
+    metrics_server = await metrics.start_server(routes={"/debug/loop": monitor.snapshot})
+    try:
+        await asyncio.gather(
+            orchestrator.run_bot(),
+            goten.run_bot(),
+            leonardo.run_bot(),
+            hermine.run_bot()
+        )
+    finally:
+        #   Gemeinsame HTTP-Sitzung für Bilddownloads schließen
+        await image_fetcher.close()
+        if metrics_server:
+            await metrics_server.cleanup()
 
 #   Startpunkt des Programms
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -1,26 +1,44 @@
 import asyncio
+import time
 from typing import Dict, List, Any
+from shared.memory import ConversationMemory
+from shared.persistence import conversation_store
+from loop_monitor import TimedLock
 
-#   Klasse zur Verwaltung aller Nachrichten = Zentralspeicher
+#   Zeit in Sekunden, nach der ein inaktiver Kanal aus dem Speicher entfernt wird
+SESSION_IDLE_TIMEOUT = 30 * 60
+#   Abstand in Sekunden zwischen zwei Prüfungen auf inaktive Kanäle
+EVICTION_INTERVAL = 60
+#   Obergrenzen für gespeicherte Nutzeranfragen und Botnachrichten pro Kanal
+MAX_USER_HISTORY = 50
+MAX_BOT_MESSAGES = 500
+#   Maximale Wartezeit in Sekunden, bis eine empfangene Botnachricht im Index der Antwortketten steht
+INDEX_WAIT_TIMEOUT = 2.0
+
+#   Klasse zur Verwaltung aller Nachrichten eines Kanals
+#   Jeder Kanal hat eigene Daten, ein eigenes Lock und eigene Events
 #   Wird vom Mediatorbot und den Charakterbots gemeinsam genutzt
 #   Für eine koordinierte Zusammenarbeit
-class MessageStorage:
-    def __init__(self):
+class ChannelSession:
+    def __init__(self, channel_id, dispatch, summarizer=None, persistence=None):
         #   Alle wichtigen Daten werden hier initialisiert
         self.store = {
             "participant_message": None,   #   Nachricht (vom Nutzer oder den Charakterbots)
-            "channel_id": None,     #   Channel-ID, indem die Nutzeranfrage geschickt wurde
+            "channel_id": channel_id,     #   Channel-ID, indem die Nutzeranfrage geschickt wurde
             "image_url": None,      #   Bild-URL
             "allowed_bots": [],     #   Bots, die antworten dürfen
-            "conversation_history": [],     #   Bisherige Nachrichten
+            "conversation_history": ConversationMemory(summarizer=summarizer, persistence=persistence, key=channel_id),     #   Bisherige Nachrichten (begrenzt, ältere werden zusammengefasst)
             "user_history": [],     #   Alle Nutzeranfragen
             "message_id": 0,        #   ID der Nachricht
             "message_count": 0,     #   Zähler für die Antwortanzahl
             "bot_messages": []      #   Alle versendeten Botnachrichten
         }
-        self.lock = asyncio.Lock()    #   exklusive Speicherzugriffe
+        self.lock = TimedLock("storage")    #   exklusive Speicherzugriffe
         self.response_events = {bot: asyncio.Event() for bot in ["leonardo", "goten", "hermine"]}   #   Signal für die Beantwortung von Nachrichten
-        self.send_message_events = asyncio.Event()  #   Signal zum Nachrichtenversand
+        self.dispatch = dispatch    #   Übergibt einen Auftrag an die Warteschlange des gewählten Bots
+        self.send_lock = TimedLock("send")     #   Antworten in diesem Kanal werden nacheinander versendet
+        self.last_active = time.monotonic()     #   Zeitpunkt des letzten Zugriffs
+        self.rehydrated = None  #   Wiederherstellung aus dem dauerhaften Speicher (Future, siehe MessageStorage.session)
         self.answers: Dict[str, str] = {}   #   Antworttexte
         self.chosen_bot: None | str = None  #   ausgewählter Bot zum Antworten
         self.last_chosen_bots = []  #   zuletzt gewählter Charakterbot
@@ -31,6 +49,45 @@ class MessageStorage:
             "hermine": [],
             "goten": []
         }   #   Alle finalen Botnachrichten
+        #   Index der Antwortketten, wird mit jeder Botnachricht aktualisiert (siehe store_bot_messages)
+        self.reply_index = {
+            "received_by_sent": {},    #   Gesendete Nachricht -> Nachricht, auf die geantwortet wurde
+            "depth": {},    #   Länge der Antwortkette bis zur Nachricht (alle Botnachrichten)
+            "text_depth": {},   #   Länge der Antwortkette bis zur Nachricht (nur Textnachrichten)
+            "root": {},     #   Gesendete Nachricht -> ursprüngliche Nutzeranfrage
+            "root_counts": {}   #   Nutzeranfrage -> Anzahl der Text- und Bildantworten
+        }
+        self.image_texts = set()    #   Texte aller Bildnachrichten der Bots
+        self.index_waiters = {}     #   Gesendete Nachricht -> Future, erfüllt sobald sie im Index steht
+        self.current_turn = None    #   ID der neuesten Nutzeranfrage in diesem Kanal
+        self.turn_tasks = {}    #   Nutzeranfrage -> laufende Aufgaben (Generierung, Auswahl, Versand)
+        self.turn_ended = False     #   Der Nutzer schreibt weiter, die neue Runde hat noch nicht begonnen
+        self.speculation = None     #   Vorab gestartete Generierung der nächsten Runde {"text", "task"}
+        self.queued_jobs = 0    #   Aufträge dieses Kanals, die noch in der Warteschlange eines Bots liegen
+        self.persistence = persistence  #   Dauerhafter Speicher (ConversationStore) oder None
+
+    #   Stellt die Daten des Kanals aus dem dauerhaften Speicher wieder her (beim ersten Zugriff nach einem Neustart)
+    #   Nutzeranfragen, Botnachrichten samt Index der Antwortketten und Gesprächsverlauf
+    async def rehydrate(self):
+        if not self.persistence:
+            return
+        channel_id = self.store["channel_id"]
+        try:
+            user_history = await self.persistence.load_user_history(channel_id, MAX_USER_HISTORY)
+            bot_messages = await self.persistence.load_bot_messages(channel_id, MAX_BOT_MESSAGES)
+            await self.store["conversation_history"].rehydrate()
+        except Exception as e:
+            print(f"[Storage] Wiederherstellung von Kanal {channel_id} fehlgeschlagen: {e}")
+            return
+        self.store["user_history"] = user_history
+        for msg in bot_messages:
+            root_message_id = msg.pop("root_message_id")
+            self.store["bot_messages"].append(msg)
+            self._index_bot_message(msg["message_text"], msg["received_message_id"], msg["sent_message_id"],
+                                    msg["is_image"], root_message_id)
+        if self.store["user_history"] or self.store["bot_messages"]:
+            print(f"[Storage] Kanal {channel_id} wiederhergestellt: {len(self.store['user_history'])} Nutzeranfragen, "
+                  f"{len(self.store['bot_messages'])} Botnachrichten")
 
     #   Antworten der Bots werden als Botnachrichten gespeichert
     #   Um zwischen Nutzeranfragen und Botnachrichten zu unterscheiden
@@ -44,52 +101,102 @@ class MessageStorage:
                 "is_image": is_image,
                 "bot_name": bot_name
             })
+            self._index_bot_message(message_text, received_message_id, sent_message_id, is_image)
+            #   Wartet der Orchestrator bereits auf diese Nachricht (siehe wait_until_indexed)?
+            waiter = self.index_waiters.pop(sent_message_id, None)
+            if waiter and not waiter.done():
+                waiter.set_result(True)
+            #   Dauerhaft speichern (nur Warteschlange, geschrieben wird im Hintergrund)
+            if self.persistence:
+                self.persistence.record_bot_message(self.store["channel_id"], sent_message_id, received_message_id,
+                                                    self.reply_index["root"][sent_message_id], bot_name, is_image,
+                                                    message_text)
+            #   Älteste Botnachrichten werden samt Index entfernt (Antwortketten sind höchstens 5 Nachrichten lang)
+            while len(self.store["bot_messages"]) > MAX_BOT_MESSAGES:
+                self._unindex_bot_message(self.store["bot_messages"].pop(0))
+
+    #   Aktualisiert den Index der Antwortketten um eine neue Botnachricht
+    #   Die Tiefe einer Nachricht ist die Tiefe der Nachricht, auf die sie antwortet, plus eins
+    #   Dadurch muss die Kette später nicht mehr rückwärts durchlaufen werden
+    #   root_message_id: bekannte Nutzeranfrage der Kette (bei der Wiederherstellung aus dem dauerhaften Speicher)
+    def _index_bot_message(self, message_text, received_message_id, sent_message_id, is_image, root_message_id=None):
+        index = self.reply_index
+        index["received_by_sent"][sent_message_id] = received_message_id
+        index["depth"][sent_message_id] = index["depth"].get(received_message_id, 0) + 1
+        #   Bildnachrichten zählen nicht zur Antwortanzahl und unterbrechen die Kette der Textnachrichten
+        if is_image:
+            self.image_texts.add(message_text)
+        else:
+            index["text_depth"][sent_message_id] = index["text_depth"].get(received_message_id, 0) + 1
+        #   Ursprüngliche Nutzeranfrage der Kette
+        root = root_message_id or index["root"].get(received_message_id, received_message_id)
+        index["root"][sent_message_id] = root
+        counts = index["root_counts"].setdefault(root, {"text": 0, "image": 0})
+        counts["image" if is_image else "text"] += 1
+
+    #   Entfernt eine alte Botnachricht aus dem Index der Antwortketten
+    def _unindex_bot_message(self, msg):
+        index = self.reply_index
+        sent_message_id = msg["sent_message_id"]
+        for key in ("received_by_sent", "depth", "text_depth", "root"):
+            index[key].pop(sent_message_id, None)
+        if msg["is_image"]:
+            self.image_texts.discard(msg["message_text"])
+        #   Zähler der ältesten Nutzeranfragen werden ebenfalls begrenzt
+        while len(index["root_counts"]) > MAX_BOT_MESSAGES:
+            index["root_counts"].pop(next(iter(index["root_counts"])))
+
+    #   Wartet, bis eine Botnachricht im Index der Antwortketten steht
+    #   Discord kann die Nachricht an den Orchestrator zustellen, bevor der sendende Bot sie gespeichert hat
+    #   Gibt False zurück, wenn sie nach timeout Sekunden noch fehlt (z.B. Fehlermeldungen, die nicht gespeichert werden)
+    async def wait_until_indexed(self, message_id, timeout=INDEX_WAIT_TIMEOUT):
+        if message_id in self.reply_index["root"]:
+            return True
+        waiter = self.index_waiters.get(message_id)
+        if waiter is None:
+            waiter = asyncio.get_running_loop().create_future()
+            self.index_waiters[message_id] = waiter
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.index_waiters.pop(message_id, None)
+            return False
 
     #   Prüfen, ob die maximale Antwortgrenze von 5 Nachrichten pro Nutzeranfrage erreicht wurde
+    #   Die Länge der Antwortkette wird direkt aus dem Index gelesen
     async def can_bot_reply(self, last_received_id):
         async with self.lock:
-            max_depth=5 #   Maximal erlaubte Antwortzahl
-            depth = 0   #   Initialer Zähler für die aktuelle Antwortzahl
-            current_id = last_received_id   #   Startpunkt für die Zählung ist die ID der zuletzt zugestellten Nachricht
-            #   Welcher Bot hat auf welche Nachricht geantwortet?
-            id_lookup = {
-                #   Jeder gesendeten Nachricht, wird die ID der Nachricht zugeordnet, auf die sie geantwortet hat
-                msg["sent_message_id"]: msg["received_message_id"]
-                for msg in self.store["bot_messages"]
-            }  #   Jede Botnachricht durchläuft das
-            #   Die Kette der Antworten wird rückwärts verfolgt
-            while current_id in id_lookup:
-                #   Bei jedem Schleifendurchlauf wird die Antworttiefe um eins erhöht
-                #   Für jede Antwort auf eine Antwort, wird die Tiefe also erhöht
-                depth += 1
-                #   Wenn die maximale Tiefe erreicht wird, darf nicht mehr geantwortet werden
-                if depth >= max_depth:
-                    return False
-                #   Auf welche Nachricht hat die ID der letzten Nachricht geantwortet?
-                #   Tiefe der Kette wird zurückverfolgt
-                current_id = id_lookup[current_id]
-            return True  #  Max Tiefe noch nicht erreicht, also darf geantwortet werden
+            max_depth = 5   #   Maximal erlaubte Antwortzahl
+            return self.reply_index["depth"].get(last_received_id, 0) < max_depth
 
     #   Zählt die Antworten pro Nutzeranfrage
+    #   Nur Nachrichten OHNE Bildgenerierung werden berücksichtigt
     async def get_reply_count(self, last_received_id):
         async with self.lock:
-            depth = 0   #   Initialer Zähler für die aktuelle Antwortzahl
-            current_id = last_received_id   #   Startpunkt für die Zählung ist die ID der zuletzt zugestellten Nachricht (Anfang: Nutzeranfrage)
-            #   Jeder gesendeten Nachricht, wird die ID der Nachricht zugeordnet, auf die sie geantwortet hat
-            id_lookup = {
-                msg["sent_message_id"]: msg["received_message_id"]
-                for msg in self.store["bot_messages"]
-                if not msg.get("is_image")  #   Nur Nachrichten OHNE Bildgenerierung werden berücksichtigt
-            }
-            #   Die Kette der Antworten wird rückwärts verfolgt
-            #   Bis die ursprüngliche Nachricht erreicht wurde, und es keine Nachricht gibt, auf die sie sich bezieht
-            while current_id in id_lookup:
-                depth += 1  #   Bei jedem Schleifendurchlauf wird die Antworttiefe um eins erhöht
-                current_id = id_lookup[current_id]  #   Springe zur vorherigen Nachricht in der Kette
-                #   Falls eine Nachricht ohne vorherige Nachricht gefunden wird, wird abgebrochen
-                if current_id is None:
-                    return depth
-            return depth    #   Gibt die Tiefe der Kette zurück
+            return self.reply_index["text_depth"].get(last_received_id, 0)
+
+    #   Bildnachricht oder Fehlermeldung zur Bildgenerierung eines Bots (zählt nicht zur Antwortgrenze)
+    def is_image_message(self, sent_message_id):
+        index = self.reply_index
+        return sent_message_id in index["received_by_sent"] and sent_message_id not in index["text_depth"]
+
+    #   Text einer gesendeten Botnachricht, wie er gespeichert wurde (None, falls unbekannt)
+    def sent_text(self, sent_message_id):
+        for msg in reversed(self.store["bot_messages"]):
+            if msg["sent_message_id"] == sent_message_id:
+                return msg["message_text"]
+        return None
+
+    #   Gibt die ursprüngliche Nutzeranfrage zu einer Nachricht zurück
+    async def get_root_message_id(self, message_id):
+        async with self.lock:
+            return self.reply_index["root"].get(message_id, message_id)
+
+    #   Anzahl der Text- und Bildantworten zu einer Nutzeranfrage
+    async def get_root_reply_counts(self, root_message_id):
+        async with self.lock:
+            return dict(self.reply_index["root_counts"].get(root_message_id, {"text": 0, "image": 0}))
 
     #   Nachrichten der Bots oder des Nutzers speichern
     async def store_participant_message(self, participant_message: str, channel_id: str, message_id: int, image_url: str = None):
@@ -118,17 +225,94 @@ class MessageStorage:
         await self.reset_meta_selection_task()
 
     #   Mediator speichert Antworten und signalisiert Freigabe für den ausgewählten Bot
-    #   Event: Signal zur Freigabe der Antwort
-    async def set_messages_and_notify(self, answers, chosen_bot):
+    #   Der gewählte Bot erhält einen vollständigen Auftrag (Antwort, Kanal, Nachricht) in seiner Warteschlange
+    #   message_id: Nachricht, auf die geantwortet wird (Standard: zuletzt gespeicherte Nachricht)
+    #   done: optionales Future, das der Bot nach dem Versand mit der ID seiner letzten Nachricht erfüllt
+    #   root_message_id: ursprüngliche Nutzeranfrage (Standard: aus dem Index der Antwortketten)
+    async def set_messages_and_notify(self, answers, chosen_bot, message_id=None, done=None, root_message_id=None):
         self.chosen_bot = chosen_bot    #   Speichern, welcher Bot antworten darf
         self.answers = answers  #   Speichern der generierten Antworten
-        if chosen_bot:
-            self.last_chosen_bots.append(chosen_bot)    #   Liste der Bots, die zuletzt geantwortet haben aktualisieren
-            # Nur den letzten erlaubten Bot merken
-            self.last_chosen_bots = self.last_chosen_bots[-1:]
+        #   Nur gültige Namen werden als zuletzt gewählter Bot gemerkt
+        if chosen_bot not in answers:
+            print(f"[Storage] Keine Antwort für ausgewählten Bot '{chosen_bot}' vorhanden.")
+            return False
+
+        self.last_chosen_bots.append(chosen_bot)    #   Liste der Bots, die zuletzt geantwortet haben aktualisieren
+        # Nur den letzten erlaubten Bot merken
+        self.last_chosen_bots = self.last_chosen_bots[-1:]
+
+        if message_id is None:
+            message_id = self.store["message_id"]
+        #   Auftrag enthält alle Daten, die der Bot zum Versenden braucht
+        job = {
+            "bot_name": chosen_bot,
+            "answer": answers[chosen_bot],
+            "channel_id": self.store["channel_id"],
+            "message_id": message_id,
+            "root_message_id": root_message_id or self.reply_index["root"].get(message_id, message_id),
+            "queued_at": time.monotonic()   #   Für die Wartezeit bis zum Versand (Kennzahlen)
+        }
+        if done is not None:
+            job["done"] = done
+        #   Signal an ausgewählten Bot, dass er antworten darf
+        if not self.dispatch(job):
+            return False
+        self.queued_jobs += 1   #   Der Bot zählt den Auftrag bei der Übernahme wieder herunter (siehe take_job)
+        return True
+
+    #   Ein Bot übernimmt einen Auftrag aus seiner Warteschlange
+    def take_job(self):
+        self.queued_jobs = max(self.queued_jobs - 1, 0)
+
+    #   Neue Nutzeranfrage: alle noch laufenden Aufgaben älterer Nutzeranfragen werden abgebrochen
+    #   (OpenAI-Aufrufe, Bildgenerierungen und noch nicht versendete Antworten)
+    def start_turn(self, root_message_id):
+        self.current_turn = root_message_id
+        self.turn_ended = False
+        self._cancel_turn_tasks(keep=root_message_id)
+
+    #   Der Nutzer schreibt (wieder): die Arbeiten der bisherigen Runde werden sofort abgebrochen,
+    #   bis zur nächsten start_turn gelten alle Nutzeranfragen als veraltet
+    def end_turn(self):
+        self.turn_ended = True
+        self._cancel_turn_tasks()
+
+    def _cancel_turn_tasks(self, keep=None):
+        for root, tasks in list(self.turn_tasks.items()):
+            if root != keep:
+                for task in tasks:
+                    task.cancel()
+                del self.turn_tasks[root]
+
+    #   Kanäle mit laufender Arbeit werden nie entfernt: Speicherzugriffe, Versand, Aufgaben einer Nutzeranfrage,
+    #   eine laufende Vorabgenerierung oder Aufträge, die noch in der Warteschlange eines Bots liegen
+    def in_use(self):
+        speculating = self.speculation is not None and not self.speculation["task"].done()
+        return (self.lock.locked() or self.send_lock.locked() or bool(self.turn_tasks)
+                or speculating or self.queued_jobs > 0)
+
+    #   Gehört die Nutzeranfrage nicht mehr zur aktuellen Runde?
+    def is_stale(self, root_message_id):
+        if self.turn_ended:
+            return True
+        return self.current_turn is not None and root_message_id != self.current_turn
+
+    #   Ordnet eine Aufgabe einer Nutzeranfrage zu, damit sie bei einer neueren Anfrage abgebrochen werden kann
+    #   Gibt False zurück, wenn die Nutzeranfrage bereits veraltet ist
+    def track(self, root_message_id, task):
+        if self.is_stale(root_message_id):
+            return False
+        tasks = self.turn_tasks.setdefault(root_message_id, set())
+        tasks.add(task)
+        task.add_done_callback(lambda done_task: self._untrack(root_message_id, done_task))
+        return True
 
-        self.send_message_events.set()  #   Signal an ausgewählten Bot, dass er antworten darf
-        self.send_message_events.clear()    #   Event wird für die nächste Antwort zurückgesetzt
+    def _untrack(self, root_message_id, task):
+        tasks = self.turn_tasks.get(root_message_id)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self.turn_tasks[root_message_id]
 
     #   Prüft, ob man der Bot ist, der seine Antwort veröffentlichen darf
     async def wasIChosen(self, bot_name):
@@ -138,10 +322,6 @@ class MessageStorage:
     async def getMyAnswer(self, bot_name):
         return self.answers[bot_name]
 
-    #   Signal, ob Antwort veröffentlicht werden darf & man der ausgewählte Bot ist
-    async def wait_for_send_message_event(self):
-        await self.send_message_events.wait()
-
     #   Historie aller Nutzeranfragen
     async def store_user_history(self, participant_message: str, message_id: int, image_url: str = None):
         async with self.lock:
@@ -154,6 +334,10 @@ class MessageStorage:
                 "image_url": image_url,
                 "message_id": message_id
             })
+            #   Nur die neuesten MAX_USER_HISTORY Nutzeranfragen bleiben erhalten
+            del self.store["user_history"][:-MAX_USER_HISTORY]
+            if self.persistence:
+                self.persistence.record_user_message(self.store["channel_id"], message_id, participant_message, image_url)
             #   Liste des zuletzt gewählten Bots wird mit jeder neuen Nutzeranfrage zurückgesetzt
             self.last_chosen_bots = []
 
@@ -169,7 +353,7 @@ class MessageStorage:
                 "participant_message": self.store["participant_message"],
                 "allowed_bots": list(self.store["allowed_bots"] or []),
                 "message_id": self.store["message_id"],
-                "conversation_history": list(self.store["conversation_history"]),
+                "conversation_history": self.store["conversation_history"].messages(),
                 "channel_id": self.store["channel_id"],
                 "image_url": self.store["image_url"]
             }
@@ -178,22 +362,79 @@ class MessageStorage:
     async def add_to_conversation(self, role: str, content: str):
         async with self.lock:
             if role in ["leonardo", "goten", "hermine"]:
-                if any(
-                        msg["message_text"] == content and msg.get("is_image")
-                        for msg in self.store["bot_messages"]
-                ):
+                if content in self.image_texts:
                     return
-            self.store["conversation_history"].append({"role": role, "content": content})
+            memory = self.store["conversation_history"]
+            memory.add({"role": role, "content": content})
+            #   Ältere Nachrichten werden im Hintergrund zusammengefasst
+            memory.schedule_compaction()
 
     #   Liste des bisherigen Gesprächsverlaufs
+    #   Zusammenfassung älterer Nachrichten + neueste Nachrichten innerhalb des Tokenbudgets
     async def get_conversation_history(self):
         async with self.lock:
-            return list(self.store["conversation_history"])
+            return self.store["conversation_history"].messages()
 
     #   Neue Nutzeranfrage: Reset vom globalen Auswahl-Event
     async def reset_meta_selection_task(self):
         async with self.lock:
             self.meta_selection_done.clear()
 
+#   Zentralspeicher: Verwaltung der Kanäle
+#   Für jeden Kanal wird beim ersten Zugriff eine eigene ChannelSession erstellt
+#   Inaktive Kanäle werden nach SESSION_IDLE_TIMEOUT entfernt
+#   Mit dauerhaftem Speicher werden Kanäle beim ersten Zugriff wiederhergestellt
+class MessageStorage:
+    def __init__(self, idle_timeout=SESSION_IDLE_TIMEOUT, persistence=conversation_store):
+        self.sessions: Dict[int, ChannelSession] = {}   #   Kanal-ID -> Daten des Kanals
+        self.idle_timeout = idle_timeout
+        self.last_eviction = time.monotonic()
+        #   Eine Warteschlange pro Charakterbot, nur der gewählte Bot wird geweckt
+        self.dispatch_queues: Dict[str, asyncio.Queue] = {bot: asyncio.Queue() for bot in ["leonardo", "goten", "hermine"]}
+        self.summarizer = None  #   Zusammenfassungsfunktion für ältere Nachrichten (wird vom Orchestrator gesetzt)
+        self.persistence = persistence  #   Dauerhafter Speicher (ConversationStore) oder None
+
+    #   Gibt die Daten eines Kanals zurück und erstellt sie bei Bedarf
+    #   Gleichzeitige Zugriffe auf einen neuen Kanal warten auf dieselbe Wiederherstellung
+    async def session(self, channel_id) -> ChannelSession:
+        now = time.monotonic()
+        if now - self.last_eviction > EVICTION_INTERVAL:
+            self.evict_idle(now)
+        session = self.sessions.get(channel_id)
+        if session is None:
+            session = ChannelSession(channel_id, self.dispatch, summarizer=self.summarizer, persistence=self.persistence)
+            session.rehydrated = asyncio.ensure_future(session.rehydrate())
+            self.sessions[channel_id] = session
+        session.last_active = now
+        await session.rehydrated
+        return session
+
+    #   Entfernt Kanäle, die länger als idle_timeout nicht genutzt wurden
+    #   Kanäle mit laufender Arbeit bleiben erhalten (siehe ChannelSession.in_use)
+    def evict_idle(self, now=None):
+        now = now or time.monotonic()
+        self.last_eviction = now
+        for channel_id, session in list(self.sessions.items()):
+            if now - session.last_active > self.idle_timeout and not session.in_use():
+                del self.sessions[channel_id]
+                print(f"[Storage] Inaktiver Kanal {channel_id} entfernt")
+
+    #   Legt einen Auftrag in die Warteschlange des gewählten Bots
+    def dispatch(self, job):
+        queue = self.dispatch_queues.get(job["bot_name"])
+        if queue is None:
+            print(f"[Storage] Unbekannter Bot: {job['bot_name']}")
+            return False
+        queue.put_nowait(job)
+        return True
+
+    #   Wartet auf den nächsten Auftrag für den Bot
+    async def next_job(self, bot_name):
+        return await self.dispatch_queues[bot_name].get()
+
+    #   Anzahl der wartenden Aufträge pro Bot
+    def queue_depths(self):
+        return {bot: queue.qsize() for bot, queue in self.dispatch_queues.items()}
+
 #   Instanz des Nachrichtenspeichers
 storage = MessageStorage()
\ No newline at end of file
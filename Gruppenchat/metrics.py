@@ -0,0 +1,266 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
+from aiohttp import web
+from dotenv import load_dotenv
+
+#   Lädt Variablen aus der .env-Datei
+load_dotenv()
+
+#   Port des lokalen Kennzahlen-Endpunkts (0 = aus) und Adresse (Standard: nur lokal erreichbar)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+#   Protokollstufe (DEBUG zeigt zusätzlich Verläufe und alle Antworten jeder Runde)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+#   Obergrenzen der Histogramm-Klassen in Sekunden (Download, Modellaufrufe, Versand, Bildgenerierung)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60)
+#   Klassen für Modellaufrufe bzw. Tokens pro Nutzeranfrage
+CALL_BUCKETS = (1, 2, 4, 8, 12, 16, 24, 32, 48, 64)
+TOKEN_BUCKETS = (500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+#   Anzahl gleichzeitig offener Nutzeranfragen, für die Modellaufrufe gezählt werden
+MAX_OPEN_TURNS = 1000
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+#   Zähler, der nur steigt (z.B. Anzahl der Modellaufrufe)
+#   Kennzahlen werden auch aus anderen Threads aktualisiert (z.B. vom Profiler in loop_monitor),
+#   daher sind Änderungen und die Momentaufnahme für die Ausgabe durch ein Lock geschützt
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}    #   Label-Werte -> Wert
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(label, "") for label in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self.lock:
+            values = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in values]
+
+#   Histogramm mit festen Klassen (z.B. Dauer einer Verarbeitungsstufe)
+#   Pro Beobachtung wird nur ein Zähler erhöht, die kumulierten Werte werden erst bei der Ausgabe berechnet
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}    #   Label-Werte -> [Anzahl pro Klasse..., Anzahl über der letzten Klasse, Summe, Anzahl]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, "") for label in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            data = self.values.get(key)
+            if data is None:
+                data = [0] * (len(self.buckets) + 1) + [0.0, 0]
+                self.values[key] = data
+            data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def render(self):
+        with self.lock:
+            values = [(key, list(data)) for key, data in self.values.items()]
+        lines = []
+        for key, data in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {data[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {round(data[-2], 6)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {data[-1]}")
+        return lines
+
+#   Momentanwert, der erst beim Abruf ermittelt wird (z.B. Länge einer Warteschlange)
+#   collect() gibt eine Zahl oder ein Dictionary Label-Wert -> Zahl zurück (nur ein Label)
+#   kind="counter" für Zählerstände, die ein anderes Modul führt (z.B. Treffer eines Zwischenspeichers)
+class Gauge:
+    def __init__(self, name, help_text, collect, label=None, kind="gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.collect = collect
+        self.label = label
+        self.kind = kind
+
+    def render(self):
+        try:
+            value = self.collect()
+        except Exception as e:
+            return [f"# {self.name} nicht verfügbar: {_escape(e)}"]
+        if isinstance(value, dict):
+            return [f"{self.name}{_format_labels((self.label,), (key,))} {number}" for key, number in value.items()]
+        return [f"{self.name} {value}"]
+
+#   Sammlung aller Kennzahlen, Ausgabe im Textformat von Prometheus
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.metrics.get(name) or self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.metrics.get(name) or self._register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, collect, label=None, kind="gauge"):
+        return self._register(Gauge(name, help_text, collect, label, kind))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+#   Gemeinsame Instanz
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram("bot_stage_seconds", "Dauer der Verarbeitungsstufen in Sekunden", ("stage", "bot"))
+stage_errors = registry.counter("bot_stage_errors_total", "Abgebrochene oder fehlgeschlagene Verarbeitungsstufen",
+                                ("stage", "bot", "error"))
+openai_calls = registry.counter("openai_calls_total", "Modellaufrufe", ("model", "priority", "outcome"))
+openai_tokens = registry.counter("openai_tokens_total", "Verbrauchte Tokens", ("model", "priority"))
+openai_seconds = registry.histogram("openai_call_seconds", "Dauer der Modellaufrufe in Sekunden", ("model",))
+turn_calls = registry.histogram("turn_model_calls", "Modellaufrufe pro Nutzeranfrage", buckets=CALL_BUCKETS)
+turn_tokens = registry.histogram("turn_tokens", "Tokens pro Nutzeranfrage", buckets=TOKEN_BUCKETS)
+
+#   Misst die Dauer einer Verarbeitungsstufe (with stage("selector"): ...)
+#   Fehler und Abbrüche werden zusätzlich nach Art gezählt
+class stage:
+    __slots__ = ("name", "bot", "start")
+
+    def __init__(self, name, bot=""):
+        self.name = name
+        self.bot = bot
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        stage_seconds.observe(time.perf_counter() - self.start, stage=self.name, bot=self.bot)
+        if exc_type is not None:
+            stage_errors.inc(stage=self.name, bot=self.bot, error=exc_type.__name__)
+        return False
+
+#   Beobachtet eine bereits gemessene Dauer (z.B. Wartezeit eines Auftrags)
+def observe_stage(name, seconds, bot=""):
+    stage_seconds.observe(seconds, stage=name, bot=bot)
+
+#   Modellaufrufe und Tokens pro Nutzeranfrage
+#   Die Nutzeranfrage der laufenden Aufgabe steht in einer Kontextvariablen, neue Aufgaben übernehmen sie
+current_turn_usage = contextvars.ContextVar("current_turn_usage", default=None)
+open_turns = OrderedDict()  #   Nutzeranfrage -> {"calls", "tokens"}
+
+#   Ordnet alle folgenden Modellaufrufe der aktuellen Aufgabe der Nutzeranfrage zu
+def enter_turn(turn_id):
+    usage = open_turns.get(turn_id)
+    if usage is None:
+        usage = {"calls": 0, "tokens": 0}
+        open_turns[turn_id] = usage
+        while len(open_turns) > MAX_OPEN_TURNS:
+            finish_turn(next(iter(open_turns)))
+    current_turn_usage.set(usage)
+    return usage
+
+#   Schließt eine Nutzeranfrage ab (z.B. wenn im Kanal eine neue eintrifft) und erfasst ihre Summen
+def finish_turn(turn_id):
+    usage = open_turns.pop(turn_id, None)
+    if usage and usage["calls"]:
+        turn_calls.observe(usage["calls"])
+        turn_tokens.observe(usage["tokens"])
+
+#   Wird vom OpenAI-Scheduler nach jedem Aufruf aufgerufen (siehe OpenAIScheduler.add_listener)
+def observe_openai_call(model, priority, seconds, tokens, outcome):
+    openai_calls.inc(model=model, priority=priority, outcome=outcome)
+    openai_seconds.observe(seconds, model=model)
+    if tokens:
+        openai_tokens.inc(tokens, model=model, priority=priority)
+    usage = current_turn_usage.get()
+    if usage is not None:
+        usage["calls"] += 1
+        usage["tokens"] += tokens or 0
+
+#   Lokaler HTTP-Endpunkt /metrics (Textformat von Prometheus)
+#   routes: weitere Pfade -> Funktion, deren Ergebnis als JSON ausgegeben wird (z.B. /debug/loop)
+#   Gibt den laufenden Server zurück (None, wenn METRICS_PORT 0 ist)
+async def start_server(host=METRICS_HOST, port=METRICS_PORT, routes=None):
+    if not port:
+        return None
+
+    async def handle(request):
+        return web.Response(body=registry.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    def json_handler(collect):
+        async def handle_json(request):
+            return web.Response(text=json.dumps(collect(), indent=2, ensure_ascii=False, default=str),
+                                content_type="application/json")
+        return handle_json
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    for path, collect in (routes or {}).items():
+        app.router.add_get(path, json_handler(collect))
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"[Metrics] Kennzahlen unter http://{host}:{port}/metrics")
+    return runner
+
+#   Protokollierung über eine Warteschlange: der Event-Loop legt Einträge nur ab,
+#   ein eigener Thread schreibt sie auf die Konsole
+_listener = None
+
+def setup_logging(level=LOG_LEVEL):
+    global _listener
+    if _listener is not None:
+        return
+    log_queue = queue.SimpleQueue()
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    _listener = QueueListener(log_queue, console, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(level)
+    #   Einzelne HTTP-Anfragen nur bei DEBUG protokollieren
+    if root.level > logging.DEBUG:
+        logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -1,17 +1,25 @@
-import base64
+import asyncio
 import json
 import discord
 import logging  # Skriptfehler identifizieren
 import os
-import aiohttp
-import random
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
 from message_storage import storage
+from shared.openai_scheduler import scheduler, PRIORITY_ANSWER, PRIORITY_SELECTOR, PRIORITY_BACKGROUND
+from shared.image_fetcher import image_fetcher
+from shared.image_preprocessing import to_data_url
+from shared.image_analysis import ImageAnalyzer, analysis_to_text
+from shared.answer_cache import answer_cache
+from shared.memory import fit_to_budget, make_openai_summarizer
+from planner import TurnPlanner
+from debounce import MessageDebouncer
+from selection import LexicalSelector, LLMSelector, HybridSelector, choose_bot
+from hedging import hedger
 from prompts import goten, hermine, leonardo
+from metrics import setup_logging, stage, enter_turn, finish_turn, observe_openai_call
 
-#   Fehler im Terminal protokollieren
-logging.basicConfig(level=logging.INFO)  # Nur Fehler anzeigen
+#   Protokollierung über eine Warteschlange, damit Ausgaben den Event-Loop nicht blockieren
+setup_logging()
 logger = logging.getLogger('discord')
 
 #   Lader der Umgebungsvariablen (aus der .env-Datei)
@@ -29,8 +37,60 @@ if not DISCORD_BOT_TOKEN:
 else:
     print("meta_bot_token geladen.")
 
-#   OpenAI-Client mit API-Schlüssel initialisieren
-openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+#   Umgang mit Bildern (aus der .env-Datei, Standard: "direct")
+#   "direct": jeder Charakterbot bekommt das Bild selbst
+#   "describe_once": das Bild wird einmal analysiert, alle Bots erhalten nur die Bildbeschreibung
+VISION_MODE = os.getenv('VISION_MODE', 'direct')
+
+#   Ablauf der Orchestrierung (aus der .env-Datei, Standard: "select")
+#   "select": alle Bots generieren nach jeder Nachricht eine Antwort, der Orchestrator wählt eine davon aus
+#   "plan": der Orchestrator plant alle Beiträge zu einer Nutzeranfrage in einem Aufruf und gibt sie nacheinander frei
+ORCHESTRATION_MODE = os.getenv('ORCHESTRATION_MODE', 'select')
+#   Pause in Sekunden zwischen zwei geplanten Beiträgen (zusätzlich zur Lesezeit, siehe turn_delay)
+PLAN_TURN_DELAY = float(os.getenv('PLAN_TURN_DELAY', 1.5))
+#   Maximale Wartezeit in Sekunden auf den Versand eines geplanten Beitrags (inkl. Bildgenerierung)
+PLAN_TURN_TIMEOUT = 90
+
+#   Spekulative Vorgenerierung (aus der .env-Datei, Standard: "off")
+#   Sobald eine Antwort ausgewählt wurde, generieren die Bots bereits ihre Antworten auf diese Antwort,
+#   während sie noch versendet wird
+#   Kostet bei abgebrochenen oder nicht übernommenen Runden zusätzliche Modellaufrufe
+SPECULATIVE_GENERATION = os.getenv('SPECULATIVE_GENERATION', 'off').lower() == 'on'
+
+#   Auswahl der besten Antwort (aus der .env-Datei, Standard: "hybrid")
+#   "llm": das Sprachmodell wählt immer aus (bisheriges Verfahren)
+#   "local": lokale Bewertung ohne Modellaufruf
+#   "hybrid": lokale Bewertung, das Sprachmodell entscheidet nur bei knappem Ergebnis (Abstand < SELECTION_MARGIN)
+SELECTION_STRATEGY = os.getenv('SELECTION_STRATEGY', 'hybrid')
+SELECTION_MARGIN = float(os.getenv('SELECTION_MARGIN', 0.1))
+
+#   Wartezeit in Sekunden auf die Antworten der Bots bei Textanfragen und bei Bildanfragen (timeout_duration)
+TEXT_ANSWER_TIMEOUT = 10
+IMAGE_ANSWER_TIMEOUT = 40
+#   Gesamtfrist einer Runde (Generierung und Auswahl) als Vielfaches von timeout_duration
+TURN_DEADLINE_FACTOR = 1.5
+
+#   Zeitfenster in Sekunden, in dem aufeinanderfolgende Nutzernachrichten zu einer Anfrage zusammengefasst werden
+#   (aus der .env-Datei, 0 = jede Nachricht wird sofort beantwortet)
+DEBOUNCE_WINDOW = float(os.getenv('DEBOUNCE_WINDOW', 0.5))
+#   Maximale Wartezeit in Sekunden ab der ersten Nachricht, auch wenn der Nutzer weiterschreibt
+DEBOUNCE_MAX_WAIT = float(os.getenv('DEBOUNCE_MAX_WAIT', 6))
+
+#   Alle OpenAI-Anfragen laufen über den gemeinsamen Scheduler (Ratenbegrenzung, Prioritäten, Wiederholungen)
+#   Antworten der Charakterbots haben Vorrang vor der Auswahl, Zusammenfassungen laufen im Hintergrund
+openai_client = scheduler.client(PRIORITY_ANSWER)
+
+#   Einmalige Bildanalyse für alle Charakterbots
+image_analyzer = ImageAnalyzer(openai_client)
+
+#   Jeder Modellaufruf wird gezählt (Aufrufe, Tokens und Dauer pro Modell und pro Nutzeranfrage)
+scheduler.add_listener(observe_openai_call)
+
+#   Ältere Nachrichten im Gesprächsverlauf werden mit einem kleinen Modell zusammengefasst
+storage.summarizer = make_openai_summarizer(scheduler.client(PRIORITY_BACKGROUND))
+
+#   Maximale Anzahl an Tokens für die Liste der bisherigen Nutzeranfragen im Prompt
+USER_HISTORY_TOKEN_BUDGET = 500
 
 #   Discord-Client initialisieren
 intents = discord.Intents.default()
@@ -40,55 +100,97 @@ client = discord.Client(intents=intents)
 #   Liste der erlaubten Textkanäle, in denen der Bot aktiv sein darf (durch Platzhalter ersetzt)
 ALLOWED_CHANNELS = [1234567890987654321]
 
+#   Maximale Anzahl gleichzeitig laufender Antwortgenerierungen der Charakterbots
+MAX_PARALLEL_GENERATIONS = 3
+generation_semaphore = asyncio.Semaphore(MAX_PARALLEL_GENERATIONS)
+
+#   Prompts der Charakterbots
+PROMPTS = {"hermine": hermine, "leonardo": leonardo, "goten": goten}
+
+#   Planung aller Beiträge einer Nutzeranfrage (Modus "plan")
+turn_planner = TurnPlanner(openai_client, PROMPTS)
+
+#   Auswahlstrategie für den Modus "select"
+if SELECTION_STRATEGY == "llm":
+    selection_strategy = LLMSelector(scheduler.client(PRIORITY_SELECTOR), hedger=hedger)
+elif SELECTION_STRATEGY == "local":
+    selection_strategy = LexicalSelector()
+else:
+    selection_strategy = HybridSelector(LexicalSelector(), LLMSelector(scheduler.client(PRIORITY_SELECTOR), hedger=hedger),
+                                        min_margin=SELECTION_MARGIN)
 
-#   Funktion zum Herunterladen von Bildern
-#   Lädt ein Bild von einer angegebenen url herunter
-async def download_image(url):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            if resp.status == 200:
-                return await resp.read()
-    return None
 
 #   Event: Mediatorbot wird gestartet
 @client.event
 async def on_ready():
-    print("Mediator-Bot ist online.")
+    logger.info("Mediator-Bot ist online.")
 
 #   Event: Nachrichten empfangen
-#   Jede Nachricht wird einzeln behandelt
+#   Botnachrichten werden sofort behandelt
+#   Nutzernachrichten werden kurz gesammelt: schreibt der Nutzer in Teilen ("Hallo" / "wer hat das gemalt?" / Foto),
+#   werden alle Teile als eine Anfrage beantwortet
 @client.event
 async def on_message(message):
+    #   Prüfe, ob Nachricht aus einem zugelassenen Kanal kommt
+    if message.channel.id not in ALLOWED_CHANNELS:
+        return  # Ignoriere Nachricht, wenn nicht aus einem zugelassenen Kanal
+
+    if message.author.bot:
+        await handle_message(message)
+    else:
+        #   Laufende Arbeiten zur vorherigen Anfrage werden sofort abgebrochen, der Nutzer schreibt weiter
+        #   Die neue Runde beginnt erst mit der zusammengefassten Anfrage in handle_message
+        session = await storage.session(message.channel.id)
+        session.end_turn()
+        cancel_speculation(session)
+        await debouncer.add(message)
+
+#   Bearbeitung einer Nachricht (Botnachricht oder zusammengefasste Nutzernachrichten)
+async def handle_message(message):
+    #   Jeder Kanal hat einen eigenen Speicher (Verlauf, Antwortketten, Auswahl)
+    session = await storage.session(message.channel.id)
+
     #   Unterscheide zwischen Bot-Nachrichten und Nutzeranfragen
     if message.author.bot:
-        print(f"Orchestrator hat nachricht bekommen {message.id}: {message.content}")
+        logger.debug(f"Orchestrator hat nachricht bekommen {message.id}: {message.content}")
+        #   Antwortgrenze und Nutzeranfrage erst prüfen, wenn der sendende Bot die Nachricht gespeichert hat
+        if message.author != client.user and not await session.wait_until_indexed(message.id):
+            logger.warning(f"[Orchestrator] Botnachricht {message.id} ist nicht im Index der Antwortketten")
         #   Falls Bot-Nachricht ein Bild enthält, wird die Bild-URL gespeichert
         #   Wenn Bots Textnachrichten inklusive Bilder schicken, werden diese als 2 Nachrichten versendet
         for embed in message.embeds:
             if embed.image and embed.image.url:
                 image_url = embed.image.url
                 user_text = image_url   #   Setze die Bild-URL als Textinhalt
-                print(f"[Orchestrator] Bot-Bildnachricht erkannt: {image_url}")
+                logger.info(f"[Orchestrator] Bot-Bildnachricht erkannt: {image_url}")
                 #   Nachricht im Teilnehmerverlauf speichern
-                await storage.store_participant_message(user_text, message.channel.id, message.id, image_url=image_url)
-                # await storage.store_bot_messages(message.content, received_message_id=None, sent_message_id=message.id)
+                await session.store_participant_message(user_text, message.channel.id, message.id, image_url=image_url)
+                # await session.store_bot_messages(message.content, received_message_id=None, sent_message_id=message.id)
+        #   Bildnachrichten und Fehlermeldungen zur Bildgenerierung lösen keine neue Runde aus
+        if session.is_image_message(message.id):
+            return
 
     #   (Erste) Nutzeranfrage wird als (erste) Nachricht gespeichert
     else:
-        await storage.add_to_conversation("user", message.content)
-
-    #   Prüfe, ob Nachricht aus einem zugelassenen Kanal kommt
-    if message.channel.id not in ALLOWED_CHANNELS:
-        return  # Ignoriere Nachricht, wenn nicht aus einem zugelassenen Kanal
+        #   Der Nutzer hat sich eingeschaltet: alle noch laufenden Arbeiten älterer Anfragen werden abgebrochen,
+        #   vorab generierte Antworten passen nicht mehr
+        if session.current_turn is not None:
+            finish_turn(session.current_turn)
+        session.start_turn(message.id)
+        cancel_speculation(session)
+        await session.add_to_conversation("user", message.content)
 
     #   Variable für Bild-URL wird initialisiert
     image_url = None
+    image_key = None
 
     #   Nutzertext ohne überflüssige Leerzeichen
     user_text = message.content.strip()
 
     #   Falls ein Bild gesendet wird
-    if message.attachments:
+    #   Nur bei Nutzeranfragen: generierte Bilder der Bots werden als Anhang hochgeladen
+    #   und würden sonst als neue Bildanfrage eine weitere Runde starten
+    if message.attachments and not message.author.bot:
         for attachment in message.attachments:
             filename = attachment.filename.lower()
             if (
@@ -96,14 +198,15 @@ async def on_message(message):
                     or filename.endswith((".png", ".jpg", ".jpeg", ".gif", ".webp"))
             ):
                 image_url = attachment.url
+                image_key = attachment.id
                 if not user_text:
                     user_text = image_url   #   Wenn kein Text vorhanden ist, wird die Bild-URL als Textinhalt gespeichert
-                print(f"[Orchestrator] Bild gefunden: {image_url}")
+                logger.info(f"[Orchestrator] Bild gefunden: {image_url}")
                 break
 
     #   Leere Nachrichten werden nicht beantwortet
     if not user_text and not image_url:
-        print("[Orchestrator] Leere Nachricht ohne Bild – keine Antwort wird generiert.")
+        logger.info("[Orchestrator] Leere Nachricht ohne Bild – keine Antwort wird generiert.")
         return
 
     #   Ohne Text wird die image_url zum Textinhalt
@@ -113,24 +216,68 @@ async def on_message(message):
 
     if not message.author.bot:
         #   Nur echte Nutzeranfragen im Nutzerverlauf speichern
-        await storage.store_user_history(user_text, message.id, image_url=image_url)
+        await session.store_user_history(user_text, message.id, image_url=image_url)
         #   Nutzeranfrage im Teilnehmerverlauf speichern
-        await storage.store_participant_message(user_text, message.channel.id, message.id, image_url=image_url)
+        await session.store_participant_message(user_text, message.channel.id, message.id, image_url=image_url)
     elif not image_url:
             #   Falls Bot-Nachricht ohne Bild
             #   Ebenfalls im Teilnehmerverlauf speichern
-            await storage.store_participant_message(user_text, message.channel.id, message.id, image_url=image_url)
-    print(f"User-Message wurde gespeichert: {user_text}")
+            await session.store_participant_message(user_text, message.channel.id, message.id, image_url=image_url)
+    logger.debug(f"User-Message wurde gespeichert: {user_text}")
+
+    #   Alle Arbeiten zu dieser Nachricht gehören zur ursprünglichen Nutzeranfrage (turn_id)
+    #   und werden abgebrochen, sobald im Kanal eine neuere Nutzeranfrage eintrifft
+    turn_id = message.id
+    if message.author.bot:
+        turn_id = await session.get_root_message_id(message.id)
+        #   Noch nicht im Index (Nachricht wurde gerade erst gesendet): gehört zur aktuellen Nutzeranfrage
+        if turn_id == message.id:
+            turn_id = session.current_turn
+    if not session.track(turn_id, asyncio.current_task()):
+        logger.info("[Orchestrator] Nachricht gehört zu einer älteren Nutzeranfrage, keine Antwort.")
+        return
+    #   Alle Modellaufrufe dieser Aufgabe (und der daraus gestarteten) zählen zur Nutzeranfrage
+    enter_turn(turn_id)
+
+    #   Im Planungsmodus stehen alle Beiträge schon fest, Botnachrichten lösen keine neue Generierung aus
+    if ORCHESTRATION_MODE == "plan" and message.author.bot:
+        return
+
+    #   Das Bild wird für diese Anfrage einmalig heruntergeladen und mit allen Bots geteilt
+    if image_url:
+        with stage("download"):
+            image = await image_fetcher.fetch(image_url, key=image_key)
+        if not image:
+            await message.channel.send(content="Bild konnte nicht gelesen werden.")
+            return
 
     #   Bei Bildanfragen werden 40Sekunden auf Antworten der Bots gewartet
     #   Bei Textanfragen werden 10Sekunden auf Antworten der Bots gewartet
-    timeout_duration = 40 if image_url else 10
+    timeout_duration = IMAGE_ANSWER_TIMEOUT if image_url else TEXT_ANSWER_TIMEOUT
+    #   Feste Frist für die gesamte Runde, danach wird keine weitere Anfrage mehr abgewartet
+    turn_deadline = asyncio.get_running_loop().time() + timeout_duration * TURN_DEADLINE_FACTOR
+
+    #   Im Modus "describe_once" wird das Bild nur einmal analysiert
+    #   Schlägt die Analyse fehl, bekommen die Bots wie bisher das Bild selbst
+    image_description = None
+    if image_url and VISION_MODE == "describe_once":
+        try:
+            with stage("analysis"):
+                analysis = await asyncio.wait_for(
+                    image_analyzer.analyze(image_key or image_url, image["b64"], image["mime_type"]),
+                    timeout=timeout_duration
+                )
+            image_description = analysis_to_text(analysis)
+            logger.info(f"[Orchestrator] Bildanalyse: {image_description}")
+        except Exception as e:
+            logger.warning(f"[Orchestrator] Bildanalyse fehlgeschlagen, Bild wird direkt weitergegeben: {e}")
 
     #   Nutzerverlauf laden
-    user_history = await storage.get_user_history()
-    all_user_history = "\n".join(f"- {r['message']}" for r in user_history)
-    print("Alle bisherigen Nutzeranfragen:")
-    print(all_user_history)
+    user_history = await session.get_user_history()
+    #   Nur die neuesten Nutzeranfragen, die in das Tokenbudget passen (ältere stehen in der Zusammenfassung)
+    recent_user_messages = fit_to_budget([r['message'] for r in user_history], USER_HISTORY_TOKEN_BUDGET)
+    all_user_history = "\n".join(f"- {m}" for m in recent_user_messages)
+    logger.debug(f"Alle bisherigen Nutzeranfragen:\n{all_user_history}")
 
     #   Letzte Nutzeranfrage extrahieren
     last_user_message = all_user_history.split("\n")[-1] if all_user_history else ""
@@ -138,15 +285,13 @@ async def on_message(message):
     #   Chatbots definieren
     bots = ["hermine", "leonardo", "goten"]
     #   Prompts definieren
-    prompts = {"hermine": hermine, "leonardo": leonardo, "goten": goten}
-
-    answers = {}
+    prompts = PROMPTS
 
     #   Antwortenzähler laden
-    reply_count = await storage.get_reply_count(message.id)
+    reply_count = await session.get_reply_count(message.id)
     #   Antwortenanzahl pro Nutzeranfrage auf maximal 5 setzen
     if reply_count >= 5:
-        print(f"[Orchestrator] Max. Antworten erreicht ({reply_count}). Keine weitere Auswahl oder Generierung nötig.")
+        logger.info(f"[Orchestrator] Max. Antworten erreicht ({reply_count}). Keine weitere Auswahl oder Generierung nötig.")
         return
 
     #   Antwortenanzahl auf bis zu 5 Antworten pro Nutzeranfrage reduzieren
@@ -158,90 +303,243 @@ async def on_message(message):
 #            print(f"[Orchestrator] Zufällig gestoppt bei {reply_count}")
 #            return
 
+    #   Planungsmodus: ein Aufruf plant alle Beiträge, die Bots erhalten sie nacheinander
+    if ORCHESTRATION_MODE == "plan":
+        await plan_turns(session, message, image_url, all_user_history, last_user_message, timeout_duration,
+                         image_description=image_description, image_key=image_key)
+        return
 
-    for bot in bots:
-        #   generateAnswer wird aufgerufen und jeder Bot generiert eine Antwort
-        answer = await generateAnswer(message.content, image_url, message.channel, prompts[bot], all_user_history, last_user_message)
-        answers[bot] = answer
+    #   Alle Charakterbots generieren ihre Antworten gleichzeitig
+    #   Bots, die nicht rechtzeitig fertig werden, werden bei der Auswahl nicht berücksichtigt
+    #   Wurden die Antworten auf diese Botnachricht bereits vorab generiert, werden sie übernommen
+    speculation = take_speculation(session, message) if message.author.bot and not image_url else None
+    if speculation:
+        logger.info("[Orchestrator] Vorab generierte Antworten werden verwendet.")
+        answers = await speculation
+    else:
+        answers = await generate_all_answers(bots, prompts, message.content, image_url, message.channel,
+                                             all_user_history, last_user_message, timeout_duration,
+                                             image_description=image_description, turn_deadline=turn_deadline,
+                                             image_key=image_key)
+    if not answers:
+        logger.warning("[Orchestrator] Kein Bot hat rechtzeitig geantwortet.")
+        return
 
     #   Prüfe, ob weitere Antworten überhaupt noch erlaubt sind
-    can_reply = await storage.can_bot_reply(message.id)
+    can_reply = await session.can_bot_reply(message.id)
     if not can_reply:
         return
 
     #   bisherige Gesprächshistorie laden
-    history = await storage.get_conversation_history()
+    history = await session.get_conversation_history()
 
-    #   die Liste der relevanten Konversation initialisieren
-    relevant_conversation = []
     #   Prüfe, welcher Bot zuletzt geantwortet hat
     bot_names = ["hermine", "leonardo", "goten"]
-    recent_bots = storage.last_chosen_bots or []
+    recent_bots = session.last_chosen_bots or []
     last_bot = recent_bots[-1] if recent_bots else None
-    print(f"Zuletzt gewählter Bot: {last_bot}")
+    logger.info(f"Zuletzt gewählter Bot: {last_bot}")
 
     #   Der zuletzt antwortende Bot wird für die nächste Auswahl ausgeschlossen
     #   Vorausgesetzt es gab für die Nutzeranfrage bereits eine Antwort
-    bots_to_exclude = last_bot if last_bot else set()
+    bots_to_exclude = {last_bot} if last_bot else set()
     #   Dictionary filtered_answers speichert nur die Antworten der Bots, die noch antworten dürfen
     filtered_answers = {
         bot: answer for bot, answer in answers.items()
         if bot not in bots_to_exclude and bot in bot_names
     }
 
-    print(f"Gefilterte Bots: {list(filtered_answers.keys())}")
-
-
-    print("--------------------------")
-    print(f"Aktuelle Nachricht:\n{message.content}")
-    print(f"Dazugehörige Antworten:\n{answers}")
-    print("--------------------------")
-
-    full_prompt = f"""
-    Du dienst als Orchestrator in einem Gruppenchat und koordinierst, wann welcher Chatbot auf eine Nutzeranfrage antworten darf.
-    Wähle zwischen den verschiedenen Antworten, die beste aus. 
-    Gebe anschließend ******nur*** den Namen des Bots*** zurück, dessen Antwort am besten passt.
-    z.B. "leonardo" oder "goten", "hermine"..
-    Hier ist der bisherige Gesprächsverlauf:
-    {json.dumps(history)}.
-    {history[-1]["role"]} hat folgendes geschrieben:
-    \"\"\"{message.content}\"\"\"
-    Die folgenden Chatbots haben geantwortet (der letzte Bot wurde ausgeschlossen): {filtered_answers}.
-    Die zuletzt gestellte Nutzerfrage: {last_user_message} sollte stets erfolgreich beantwortet werden.
-    Die Unterhaltung soll zielführend, aber vor allem auch unterhaltsam sein.
-    Die passendste Antwort kann auch einfach die unterhaltsamste sein, auch wenn sie inhaltlich nicht perfekt ist.
-    Die letzte Antwort ist von {history[-1]["role"]} gekommen. Wähle Sie/Ihn nicht aus!
-    Es wurden bereits {relevant_conversation} Antworten zu der Nutzeranfrage gesendet. 
-    """
+    logger.info(f"Gefilterte Bots: {list(filtered_answers.keys())}")
+    if not filtered_answers:
+        logger.info("[Orchestrator] Keine auswählbare Antwort vorhanden.")
+        return
+
+
+    logger.debug(f"Aktuelle Nachricht:\n{message.content}\nDazugehörige Antworten:\n{answers}")
+
+    #   Kontext für die Auswahl der besten Antwort
+    selection_context = {
+        "message_text": message.content,
+        "last_user_message": last_user_message,
+        "history": history,
+        "image_description": image_description,
+        "reply_count": reply_count,
+        "deadline": turn_deadline
+    }
 
     # Orchestrator trifft Entscheidung
     try:
-        decision = await openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "user", "content": full_prompt}    #   Übergibt den Prompt zur Koordination des Gesprächs
-            ]
-        )
-        #   Extrahiert die Antwort des Orchestrators:
-        #   (nur der Name des ausgewählten Charakterbots), also {chosen}
-        chosen = decision.choices[0].message.content.strip().lower()
-        print(f"[Orchestrator] GPT-Auswahl-Rohtext: {chosen}")
+        #   Nur ein Name aus filtered_answers wird akzeptiert
+        with stage("selector"):
+            chosen = await choose_bot(selection_strategy, filtered_answers, selection_context)
+        if chosen is None:
+            logger.warning("[Orchestrator] Keine gültige Auswahl getroffen.")
+            return
         #   Übergibt die Auswahl {chosen}, an das Modul, dass die Berechtigung an den ausgewählten Bot weitergibt
-        await storage.set_messages_and_notify(filtered_answers, chosen)
+        notified = await session.set_messages_and_notify(filtered_answers, chosen, message_id=message.id,
+                                                         root_message_id=turn_id)
+        #   Die nächste Runde wird schon gestartet, während der gewählte Bot seine Antwort versendet
+        if notified and SPECULATIVE_GENERATION:
+            await start_speculation(session, filtered_answers[chosen], message.id, turn_id, bots, prompts,
+                                    message.channel, all_user_history, last_user_message)
 
     #   Fehlerbehanldung bei der Botauswahl
     except Exception as e:
-        print(f"Fehler bei der Auswahl: {e}")
+        logger.error(f"Fehler bei der Auswahl: {e}")
         return
 
+#   Sammelt Nutzernachrichten pro Kanal, bevor eine Runde gestartet wird
+debouncer = MessageDebouncer(handle_message, window=DEBOUNCE_WINDOW, max_wait=DEBOUNCE_MAX_WAIT)
+
 #   Startet den Mediatorbot, sodass er live auf Discord ist
 def run_bot():
     return client.start(DISCORD_BOT_TOKEN)
 
+#   Planungsmodus: plant alle Beiträge zu einer Nutzeranfrage und startet ihre Freigabe im Hintergrund
+#   Eine neue Nutzeranfrage im selben Kanal beendet die Freigabe des vorherigen Plans (siehe start_turn)
+async def plan_turns(session, message, image_url, all_user_history, last_user_message, timeout_duration,
+                     image_description=None, image_key=None):
+    history = await session.get_conversation_history()
+    image = await image_fetcher.fetch(image_url, key=image_key) if image_url else None
+    try:
+        with stage("plan"):
+            turns = await asyncio.wait_for(
+                turn_planner.plan(history, message.content, all_user_history, last_user_message,
+                                  image=image, image_description=image_description),
+                timeout=timeout_duration
+            )
+    except Exception as e:
+        logger.warning(f"[Orchestrator] Planung fehlgeschlagen: {e}")
+        return
+    if not turns:
+        logger.warning("[Orchestrator] Kein gültiger Plan erstellt.")
+        return
+    logger.info(f"[Orchestrator] Geplante Beiträge: {turns}")
+
+    task = asyncio.create_task(release_turns(session, turns, message.id))
+    if not session.track(message.id, task):
+        task.cancel()
+
+#   Wartezeit vor dem nächsten Beitrag, damit der Nutzer den vorherigen lesen kann
+def turn_delay(previous_text):
+    return PLAN_TURN_DELAY + min(len(previous_text.split()) * 0.1, 3)
+
+#   Gibt die geplanten Beiträge nacheinander an die Bots weiter
+#   Der nächste Beitrag wird erst freigegeben, wenn der vorherige versendet wurde, und antwortet auf dessen letzte Nachricht
+#   Die Antwortgrenze von 5 Nachrichten pro Nutzeranfrage wird vor jeder Freigabe geprüft
+async def release_turns(session, turns, message_id):
+    reply_to = message_id
+    for i, (bot, text) in enumerate(turns):
+        if i:
+            await asyncio.sleep(turn_delay(turns[i - 1][1]))
+        if not await session.can_bot_reply(reply_to) or await session.get_reply_count(reply_to) >= 5:
+            logger.info("[Orchestrator] Antwortgrenze erreicht, restliche Beiträge werden verworfen.")
+            return
+        done = asyncio.get_running_loop().create_future()
+        if not await session.set_messages_and_notify({bot: text}, bot, message_id=reply_to, done=done,
+                                                     root_message_id=message_id):
+            return
+        try:
+            sent_id = await asyncio.wait_for(done, timeout=PLAN_TURN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"[Orchestrator] {bot} hat den geplanten Beitrag nicht rechtzeitig versendet.")
+            return
+        if sent_id is None:
+            logger.warning(f"[Orchestrator] {bot} konnte den geplanten Beitrag nicht versenden.")
+            return
+        reply_to = sent_id
+
+#   Startet die Generierung der nächsten Runde mit der gewählten Antwort als vermutlich letzter Nachricht
+#   Nur für reine Textantworten, die als eine Nachricht versendet werden und die Antwortgrenze nicht erreichen
+#   Die nächste Runde antwortet auf eine Botnachricht ohne Bild: Wartezeit und Rundenfrist wie bei Textanfragen
+async def start_speculation(session, answer, reply_to, turn_id, bots, prompts, channel, all_user_history, last_user_message):
+    cancel_speculation(session)
+    text = answer.strip()
+    if "[BILD:" in text or not text or len(text) > 2000:
+        return
+    if not await session.can_bot_reply(reply_to) or await session.get_reply_count(reply_to) + 1 >= 5:
+        return
+    timeout_duration = TEXT_ANSWER_TIMEOUT
+    turn_deadline = asyncio.get_running_loop().time() + timeout_duration * TURN_DEADLINE_FACTOR
+    task = asyncio.create_task(generate_all_answers(bots, prompts, text, None, channel, all_user_history,
+                                                    last_user_message, timeout_duration, turn_deadline=turn_deadline))
+    if not session.track(turn_id, task):
+        task.cancel()
+        return
+    session.speculation = {"text": text, "task": task}
+
+#   Gibt die vorab gestartete Generierung zurück, falls die tatsächlich gesendete Nachricht übereinstimmt
+#   Verglichen wird mit dem Text, den der Bot gesendet und gespeichert hat (sonst mit dem Inhalt der Nachricht)
+#   Weicht die Nachricht ab, wird die Vorabgenerierung abgebrochen
+def take_speculation(session, message):
+    speculation = session.speculation
+    if not speculation:
+        return None
+    session.speculation = None
+    sent_text = session.sent_text(message.id)
+    if sent_text is None:
+        sent_text = message.content
+    if speculation["text"] != sent_text.strip():
+        speculation["task"].cancel()
+        return None
+    return speculation["task"]
+
+#   Bricht eine laufende Vorabgenerierung ab
+def cancel_speculation(session):
+    if session.speculation:
+        session.speculation["task"].cancel()
+        session.speculation = None
+
+#   Startet die Antwortgenerierung aller Charakterbots gleichzeitig
+#   Höchstens MAX_PARALLEL_GENERATIONS Aufrufe laufen parallel, jeder Aufruf hat eine eigene Frist (timeout_duration)
+#   turn_deadline: feste Frist der Runde (loop.time()), die kein Aufruf überschreitet
+#   Zurückgegeben werden nur die Antworten, die rechtzeitig und fehlerfrei generiert wurden
+async def generate_all_answers(bots, prompts, _message, image_url, channel, all_user_history, last_user_message, timeout_duration,
+                               image_description=None, turn_deadline=None, image_key=None):
+    loop = asyncio.get_running_loop()
+
+    async def generate_for(bot):
+        async with generation_semaphore:
+            #   Die Frist beginnt erst, wenn ein freier Platz für die Generierung vorhanden ist
+            deadline = loop.time() + timeout_duration
+            if turn_deadline is not None:
+                deadline = min(deadline, turn_deadline)
+            with stage("persona", bot):
+                return await asyncio.wait_for(
+                    generateAnswer(_message, image_url, channel, prompts[bot], all_user_history, last_user_message,
+                                   image_description=image_description, deadline=deadline, image_key=image_key),
+                    timeout=max(deadline - loop.time(), 0)
+                )
+
+    tasks = {bot: asyncio.create_task(generate_for(bot)) for bot in bots}
+    answers = {}
+    try:
+        for bot, task in tasks.items():
+            try:
+                answer = await task
+            #   Zeitüberschreitung: der Bot wird für diese Runde übersprungen
+            except asyncio.TimeoutError:
+                logger.warning(f"[Orchestrator] {bot} hat nicht innerhalb von {timeout_duration}s geantwortet.")
+                continue
+            #   Fehler bei der Generierung: die übrigen Antworten werden trotzdem verwendet
+            except Exception as e:
+                logger.error(f"[Orchestrator] Fehler bei der Antwort von {bot}: {e}")
+                continue
+            if answer:
+                answers[bot] = answer
+    finally:
+        #   Wird die Runde abgebrochen, werden auch alle noch laufenden Generierungen beendet
+        for task in tasks.values():
+            task.cancel()
+    return answers
+
 #   Generierung von Antworten seitens der Charakterbots
-async def generateAnswer(_message, image_url, channel, system_prompt, all_user_history, last_user_message):
+#   image_description: Ergebnis der einmaligen Bildanalyse, ersetzt das Bild im Prompt
+#   deadline: Frist (loop.time()) für den Modellaufruf, langsame Aufrufe werden abgesichert (siehe hedging.py)
+#   image_key: Schlüssel des Bildes im Zwischenspeicher (Anhang-ID), damit es nicht erneut geladen wird
+async def generateAnswer(_message, image_url, channel, system_prompt, all_user_history, last_user_message, image_description=None,
+                         deadline=None, image_key=None):
     #   Bisherige Gesprächshistorie wird geladen
-    conversation = await storage.get_conversation_history()
+    conversation = await (await storage.session(channel.id)).get_conversation_history()
     relevant_conversation = []
     #   Finde die letzte Nutzeranfrage in der Gesprächshistorie
     last_user_index = next((i for i in reversed(range(len(conversation))) if conversation[i]["role"] == "user"),
@@ -252,21 +550,21 @@ async def generateAnswer(_message, image_url, channel, system_prompt, all_user_h
             relevant_conversation.append(msg)
 
     #   Überprüfe, ob in der Nutzeranfrage ein Bild vorhanden ist
-    if image_url:
-        #   Bild herunterladen
-        image_bytes = await download_image(image_url)
-        if not image_bytes:
+    #   Liegt bereits eine Bildanalyse vor, wird nur deren Text weitergegeben
+    if image_url and not image_description:
+        #   Bild aus dem gemeinsamen Zwischenspeicher laden (wurde in on_message bereits heruntergeladen)
+        image = await image_fetcher.fetch(image_url, key=image_key)
+        if not image:
             await channel.send(content="Bild konnte nicht gelesen werden.")
             return
 
-        #   Das heruntergeladene Bild wird in Base64 umgewandelt
-        b64_image = base64.b64encode(image_bytes).decode('utf-8')
+        #   Verkleinerte Base64-Darstellung mit passendem Dateityp wird nur einmal pro Bild erzeugt
         #   Nachricht inklusive Bild
         image_block = {
             "role": "user",
             "content": [
                 {"type": "text", "text": _message},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64_image}"}}
+                {"type": "image_url", "image_url": {"url": to_data_url(image)}}
             ]
         }
 
@@ -297,6 +595,10 @@ async def generateAnswer(_message, image_url, channel, system_prompt, all_user_h
             image_block
         ]
     else:
+        #   Nutzeranfrage, ggf. ergänzt um die Bildbeschreibung
+        user_content = _message
+        if image_description:
+            user_content = f"{_message}\n[Bildanalyse des gesendeten Bildes: {image_description}]"
         #   Generierung einer Antwort, wenn kein Bild in der Nutzeranfrage enthalten ist
         messages = [
             {"role": "system", "content": system_prompt},
@@ -321,14 +623,33 @@ async def generateAnswer(_message, image_url, channel, system_prompt, all_user_h
                 "Bei Zeichenwünschen IMMER am Ende eingeben: [BILD: <eine sachliche, passende Beschreibung>]"
                 "Verschicke Bilder immer mit einem weiteren Textinhalt in deinem Stil. Bsp.: Textinhalt [BILD: Bild1]"
             )},
-            {"role": "user", "content": _message}
+            {"role": "user", "content": user_content}
         ]
+    #   Antwortzwischenspeicher (nur bei Anfragen ohne Bild bzw. mit Bildanalyse)
+    #   Die Persona wird über ihren Systemprompt unterschieden
+    cache_key = None
+    if answer_cache and (not image_url or image_description):
+        context = [json.dumps(msg) for msg in relevant_conversation]
+        if image_description:
+            context.append(image_description)
+        cache_key = answer_cache.make_key(system_prompt, _message, context)
+        cached_answer = answer_cache.get(cache_key)
+        if cached_answer is not None:
+            logger.info("[Antwortcache] Treffer")
+            return cached_answer
+
     #   OpenAI API-Aufruf
-    response = await openai_client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages
+    #   Dauert er länger als üblich, wird eine zweite Anfrage gestartet, die schnellere Antwort gewinnt
+    #   Anfragen mit Bild dauern deutlich länger und bekommen eigene Antwortzeiten
+    response = await hedger.run(
+        "persona_bild" if image_url and not image_description else "persona",
+        lambda model: openai_client.chat.completions.create(model=model, messages=messages),
+        "gpt-4o",
+        deadline=deadline
     )
     #   Extrahiere die erste Antwort
     answer = response.choices[0].message.content
+    if cache_key:
+        answer_cache.put(cache_key, answer)
     #   Gebe die Antwort aus
     return answer
@@ -0,0 +1,97 @@
+import json
+from shared.image_preprocessing import to_data_url
+
+#   Maximale Anzahl geplanter Antworten pro Nutzeranfrage (entspricht der Antwortgrenze)
+MAX_PLANNED_TURNS = 5
+
+#   Prompt für die Planung des gesamten Gesprächsablaufs
+#   Statt jede Antwort einzeln von allen Bots generieren und auswählen zu lassen,
+#   legt ein einziger Aufruf fest, welcher Bot in welcher Reihenfolge was sagt
+PLAN_PROMPT = """
+Du planst als Orchestrator den Verlauf eines Gruppenchats mit den Chatbots Leonardo da Vinci (leonardo), Hermine Granger (hermine), Son Goten (goten) und einem Nutzer.
+Plane für die letzte Nutzeranfrage eine kurze Unterhaltung aus 1 bis {max_turns} Beiträgen der Chatbots.
+Regeln:
+- Die zuletzt gestellte Nutzerfrage soll stets erfolgreich beantwortet werden, am besten gleich im ersten Beitrag.
+- Die Unterhaltung soll zielführend, aber vor allem auch unterhaltsam sein. Die Bots dürfen sich gegenseitig ergänzen.
+- Derselbe Bot darf nicht zweimal direkt hintereinander sprechen.
+- Jeder Beitrag ist kurz (max. 20 Wörter) und im Stil der jeweiligen Persona geschrieben.
+- Keine ständigen Gegenfragen! Bei einfachen Anfragen (z.B. "Hallo!") reicht ein Beitrag.
+- Bei Zeichenwünschen IMMER am Ende eines Beitrags eingeben: [BILD: <eine sachliche, passende Beschreibung>], immer mit einem Textinhalt davor.
+Antworte ausschließlich als JSON-Objekt: {{"turns": [{{"bot": "<leonardo|hermine|goten>", "text": "<Beitrag>"}}, ...]}}
+
+Die Personas:
+{personas}
+"""
+
+#   Klasse zur Planung aller Antworten auf eine Nutzeranfrage in einem Aufruf
+#   Ist die Antwort des Modells unbrauchbar, wird höchstens ein weiterer Versuch unternommen
+class TurnPlanner:
+    def __init__(self, openai_client, prompts, model="gpt-4o", max_turns=MAX_PLANNED_TURNS, attempts=2):
+        self.openai_client = openai_client
+        self.prompts = prompts  #   Bot-Name -> Systemprompt der Persona
+        self.model = model
+        self.max_turns = max_turns
+        self.attempts = attempts
+
+    #   Plant die Beiträge, Ergebnis: Liste von (Bot-Name, Text) in Sprechreihenfolge
+    #   image: Bilddaten aus dem ImageFetcher, falls das Bild direkt mitgeschickt werden soll
+    async def plan(self, history, user_message, all_user_history, last_user_message, image=None, image_description=None,
+                   max_turns=None):
+        max_turns = min(max_turns or self.max_turns, self.max_turns)
+        personas = "\n".join(f"{bot}:\n{prompt.strip()}" for bot, prompt in self.prompts.items())
+        system_prompt = PLAN_PROMPT.format(max_turns=max_turns, personas=personas)
+
+        user_text = (
+            f"Bisheriger Gesprächsverlauf: {json.dumps(history)}\n"
+            f"Besonders wichtig ist, was der Nutzer alles gesagt hat: {all_user_history}\n"
+            f"Zuletzt gestellte Nutzerfrage: {last_user_message}\n"
+            f"Aktuelle Nachricht: \"\"\"{user_message}\"\"\""
+        )
+        if image_description:
+            user_text += f"\nDer Nutzer hat ein Bild geschickt. Bildanalyse: {image_description}"
+        user_content = user_text
+        if image and not image_description:
+            user_content = [
+                {"type": "text", "text": user_text},
+                {"type": "image_url", "image_url": {"url": to_data_url(image)}}
+            ]
+
+        for attempt in range(self.attempts):
+            response = await self.openai_client.chat.completions.create(
+                model=self.model,
+                response_format={"type": "json_object"},
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_content}
+                ]
+            )
+            turns = self.parse(response.choices[0].message.content, max_turns)
+            if turns:
+                return turns
+            print(f"[Planer] Unbrauchbarer Plan (Versuch {attempt + 1}/{self.attempts})")
+        return []
+
+    #   Liest die geplanten Beiträge aus der Modellantwort
+    #   Unbekannte Bots, leere Beiträge und direkte Wiederholungen desselben Bots werden verworfen
+    def parse(self, content, max_turns):
+        try:
+            data = json.loads(content)
+        except (TypeError, json.JSONDecodeError):
+            return []
+        raw_turns = data.get("turns") if isinstance(data, dict) else None
+        if not isinstance(raw_turns, list):
+            return []
+        turns = []
+        for turn in raw_turns:
+            if not isinstance(turn, dict):
+                continue
+            bot = str(turn.get("bot", "")).strip().lower()
+            text = str(turn.get("text") or "").strip()
+            if bot not in self.prompts or not text:
+                continue
+            if turns and turns[-1][0] == bot:
+                continue
+            turns.append((bot, text))
+            if len(turns) >= max_turns:
+                break
+        return turns
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import math
+import re
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+
+#   Häufige Wörter, die für die inhaltliche Ähnlichkeit keine Rolle spielen
+STOPWORDS = {
+    "der", "die", "das", "und", "oder", "ist", "sind", "ein", "eine", "einen", "einem", "einer", "den", "dem", "des",
+    "ich", "du", "er", "sie", "es", "wir", "ihr", "mit", "von", "zu", "auf", "für", "im", "in", "an", "am", "wie",
+    "was", "wer", "hat", "habe", "hast", "nicht", "auch", "noch", "so", "aber", "dass", "mir", "mich", "dir", "dich",
+    "the", "and", "is", "are", "a", "an", "of", "to", "it"
+}
+
+#   Wörter, mit denen Nutzer nach einem Bild fragen
+IMAGE_REQUEST_WORDS = ("zeichne", "zeichnen", "zeichnung", "male", "malen", "bild von", "skizze")
+
+#   Ideale Antwortlänge in Wörtern (siehe Anweisungen an die Charakterbots)
+TARGET_WORDS = 20
+
+#   Zerlegt einen Text in Wörter ohne Stoppwörter
+def tokenize(text):
+    return [word for word in re.findall(r"\w+", (text or "").lower()) if len(word) > 2 and word not in STOPWORDS]
+
+#   Kosinus-Ähnlichkeit zweier Wortvektoren (Wort -> Häufigkeit)
+def cosine_similarity(a, b):
+    if not a or not b:
+        return 0.0
+    dot = sum(count * b.get(word, 0) for word, count in a.items())
+    norm = math.sqrt(sum(c * c for c in a.values())) * math.sqrt(sum(c * c for c in b.values()))
+    return dot / norm if norm else 0.0
+
+#   Sucht in einer Modellantwort den Namen eines erlaubten Bots
+#   Gibt None zurück, wenn kein oder kein eindeutiger Name gefunden wurde
+def match_bot_name(raw, candidates):
+    text = (raw or "").strip().lower().strip(" .\"'!")
+    if text in candidates:
+        return text
+    found = [bot for bot in candidates if re.search(rf"\b{re.escape(bot)}\b", text)]
+    return found[0] if len(found) == 1 else None
+
+#   Grundlage aller Auswahlstrategien
+#   select() erhält die Antworten der Bots und den Kontext der Runde und gibt (Bot-Name, Info) zurück
+#   context: {"message_text", "last_user_message", "history", "image_description", "reply_count", "deadline"}
+class SelectionStrategy(ABC):
+    name = "base"
+
+    @abstractmethod
+    async def select(self, answers, context):
+        ...
+
+#   Lokale Auswahl ohne Modellaufruf
+#   Bewertet jede Antwort nach inhaltlicher Nähe zur Nutzerfrage und Antwortlänge
+#   Die Abwechslung der Sprecher regelt der Orchestrator: der zuletzt gewählte Bot steht gar nicht erst zur Auswahl
+class LexicalSelector(SelectionStrategy):
+    name = "local"
+
+    def __init__(self, relevance_weight=0.7, length_weight=0.3):
+        self.relevance_weight = relevance_weight
+        self.length_weight = length_weight
+
+    #   Punktzahl (0 bis 1) für jede Antwort
+    def score(self, answers, context):
+        query = f"{context.get('last_user_message', '')} {context.get('message_text', '')}"
+        query_vector = Counter(tokenize(query))
+        wants_image = any(word in query.lower() for word in IMAGE_REQUEST_WORDS)
+        scores = {}
+        for bot, answer in answers.items():
+            relevance = cosine_similarity(query_vector, Counter(tokenize(answer)))
+            words = len(answer.split())
+            length = 1 - min(abs(words - TARGET_WORDS) / (2 * TARGET_WORDS), 1)
+            score = self.relevance_weight * relevance + self.length_weight * length
+            #   Bei Zeichenwünschen werden Antworten mit Bild bevorzugt
+            if wants_image and "[BILD:" in answer:
+                score += 0.2
+            scores[bot] = round(score, 4)
+        return scores
+
+    async def select(self, answers, context):
+        scores = self.score(answers, context)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        margin = ranked[0][1] - ranked[1][1] if len(ranked) > 1 else 1.0
+        return ranked[0][0], {"strategy": self.name, "margin": round(margin, 4), "scores": scores}
+
+#   Auswahl durch ein Sprachmodell (bisheriges Verfahren des Orchestrators)
+#   Der zurückgegebene Name wird geprüft, bei ungültiger Antwort wird None zurückgegeben
+class LLMSelector(SelectionStrategy):
+    name = "llm"
+
+    def __init__(self, openai_client, model="gpt-4o", hedger=None):
+        self.openai_client = openai_client
+        self.model = model
+        self.hedger = hedger    #   optional: sichert langsame Aufrufe mit einer zweiten Anfrage ab
+
+    def build_prompt(self, answers, context):
+        history = context.get("history") or [{"role": "user", "content": ""}]
+        prompt = f"""
+    Du dienst als Orchestrator in einem Gruppenchat und koordinierst, wann welcher Chatbot auf eine Nutzeranfrage antworten darf.
+    Wähle zwischen den verschiedenen Antworten, die beste aus.
+    Gebe anschließend ******nur*** den Namen des Bots*** zurück, dessen Antwort am besten passt.
+    z.B. "leonardo" oder "goten", "hermine"..
+    Hier ist der bisherige Gesprächsverlauf:
+    {json.dumps(history)}.
+    {history[-1]["role"]} hat folgendes geschrieben:
+    \"\"\"{context.get("message_text", "")}\"\"\"
+    Die folgenden Chatbots haben geantwortet (der letzte Bot wurde ausgeschlossen): {answers}.
+    Die zuletzt gestellte Nutzerfrage: {context.get("last_user_message", "")} sollte stets erfolgreich beantwortet werden.
+    Die Unterhaltung soll zielführend, aber vor allem auch unterhaltsam sein.
+    Die passendste Antwort kann auch einfach die unterhaltsamste sein, auch wenn sie inhaltlich nicht perfekt ist.
+    Die letzte Antwort ist von {history[-1]["role"]} gekommen. Wähle Sie/Ihn nicht aus!
+    Es wurden bereits {context.get("reply_count", 0)} Antworten zu der Nutzeranfrage gesendet.
+    """
+        #   Bildbeschreibung aus der einmaligen Bildanalyse
+        if context.get("image_description"):
+            prompt += f"Der Nutzer hat ein Bild geschickt. Bildanalyse: {context['image_description']}\n"
+        return prompt
+
+    async def select(self, answers, context):
+        messages = [
+            {"role": "user", "content": self.build_prompt(answers, context)}
+        ]
+        if self.hedger:
+            decision = await self.hedger.run(
+                "selector",
+                lambda model: self.openai_client.chat.completions.create(model=model, messages=messages),
+                self.model,
+                deadline=context.get("deadline")
+            )
+        else:
+            decision = await self.openai_client.chat.completions.create(model=self.model, messages=messages)
+        raw = decision.choices[0].message.content
+        print(f"[Auswahl] GPT-Auswahl-Rohtext: {raw}")
+        return match_bot_name(raw, answers), {"strategy": self.name, "raw": raw}
+
+#   Kombinierte Auswahl: die lokale Bewertung entscheidet sofort, wenn eine Antwort klar vorne liegt
+#   Liegen die besten Antworten näher als min_margin beieinander, entscheidet das Sprachmodell
+#   Liefert das Modell keinen gültigen Namen, schlägt fehl oder überschreitet die Frist der Runde
+#   (context["deadline"]), gilt die lokale Bewertung
+class HybridSelector(SelectionStrategy):
+    name = "hybrid"
+
+    def __init__(self, local, llm, min_margin=0.1):
+        self.local = local
+        self.llm = llm
+        self.min_margin = min_margin
+
+    async def select(self, answers, context):
+        chosen, info = await self.local.select(answers, context)
+        if len(answers) < 2 or info["margin"] >= self.min_margin:
+            return chosen, info
+        deadline = context.get("deadline")
+        timeout = None
+        if deadline is not None:
+            timeout = max(deadline - asyncio.get_running_loop().time(), 0)
+        try:
+            llm_chosen, llm_info = await asyncio.wait_for(self.llm.select(answers, context), timeout=timeout)
+        except Exception as e:
+            print(f"[Auswahl] Modellauswahl fehlgeschlagen, lokale Auswahl wird verwendet: {e}")
+            return chosen, {**info, "strategy": "local-fallback"}
+        if llm_chosen is None:
+            return chosen, {**info, "strategy": "local-fallback"}
+        return llm_chosen, {**info, "strategy": self.llm.name, "raw": llm_info.get("raw")}
+
+#   Führt die Auswahl aus und protokolliert Strategie, Abstand und Dauer
+#   Der gewählte Name ist immer einer der übergebenen Bots (oder None, wenn keine Auswahl möglich war)
+async def choose_bot(strategy, answers, context):
+    start = time.perf_counter()
+    chosen, info = await strategy.select(answers, context)
+    if chosen not in answers:
+        chosen = None
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"[Auswahl] {chosen} (Strategie: {info.get('strategy')}, Abstand: {info.get('margin')}, "
+          f"Punkte: {info.get('scores')}, {elapsed_ms:.2f} ms)")
+    return chosen
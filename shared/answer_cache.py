@@ -0,0 +1,97 @@
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+#   Lädt Variablen aus der .env-Datei
+load_dotenv()
+
+#   Regeln, wie stark der Gesprächskontext eine zwischengespeicherte Antwort beeinflusst
+#   "none": nur Persona und Frage zählen, der Kontext wird ignoriert
+#   "last_turn": die letzte Nachricht vor der Frage muss übereinstimmen
+#   "full": der gesamte übergebene Kontext muss übereinstimmen
+CONTEXT_POLICIES = ("none", "last_turn", "full")
+
+#   Vereinheitlicht eine Frage, damit gleiche Fragen denselben Schlüssel bekommen
+#   z.B. "Wer hat dieses Bild gemalt?" und "wer hat dieses bild gemalt" -> "wer hat dieses bild gemalt"
+def normalize_question(question):
+    question = question.lower()
+    question = re.sub(r"[^\w\s]", " ", question)
+    return re.sub(r"\s+", " ", question).strip()
+
+#   Zwischenspeicher für Antworten der Charakterbots auf häufige Fragen
+#   Schlüssel: Persona + normalisierte Frage + Fingerabdruck des Kontexts (abhängig von context_policy)
+#   Einträge verfallen nach ttl Sekunden, bei mehr als max_entries wird der älteste Eintrag entfernt
+class AnswerCache:
+    def __init__(self, ttl=3600, max_entries=500, context_policy="last_turn"):
+        if context_policy not in CONTEXT_POLICIES:
+            raise ValueError(f"Unbekannte Kontextregel: {context_policy}")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.context_policy = context_policy
+        self.entries = OrderedDict()    #   Schlüssel -> (Antwort, Zeitpunkt der Speicherung)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    #   Erstellt den Schlüssel aus Persona, Frage und Kontext
+    #   context: Liste von Texten (älteste zuerst), z.B. die bisherigen Nachrichten
+    def make_key(self, persona, question, context=()):
+        context = list(context)
+        if self.context_policy == "none":
+            relevant = []
+        elif self.context_policy == "last_turn":
+            relevant = context[-1:]
+        else:
+            relevant = context
+        fingerprint = hashlib.sha256("\x1f".join(relevant).encode("utf-8")).hexdigest()
+        raw = f"{persona}\x1e{normalize_question(question)}\x1e{fingerprint}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    #   Gibt die gespeicherte Antwort zurück oder None, falls nicht vorhanden oder abgelaufen
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        answer, stored_at = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self.entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return answer
+
+    #   Speichert eine Antwort
+    def put(self, key, answer):
+        if not answer:
+            return
+        self.entries[key] = (answer, time.monotonic())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    #   Kennzahlen des Zwischenspeichers
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+#   Gemeinsame Instanz, nur aktiv, wenn ANSWER_CACHE=on in der .env-Datei gesetzt ist
+answer_cache = AnswerCache(
+    ttl=int(os.getenv("ANSWER_CACHE_TTL", 3600)),
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 500)),
+    context_policy=os.getenv("ANSWER_CACHE_POLICY", "last_turn")
+) if os.getenv("ANSWER_CACHE", "off").lower() == "on" else None
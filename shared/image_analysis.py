@@ -0,0 +1,86 @@
+import asyncio
+import json
+from collections import OrderedDict
+
+#   Anzahl der Bildanalysen, die im Arbeitsspeicher zwischengespeichert werden
+MAX_CACHED_ANALYSES = 64
+
+#   Prompt für die einmalige Bildanalyse
+#   Das Ergebnis wird anschließend allen Charakterbots und dem Orchestrator als Text übergeben
+#   (im Einzelchat als Beschreibung des Bildes im Gesprächsverlauf)
+ANALYSIS_PROMPT = """
+Du analysierst ein Bild, das ein Museumsbesucher in einen Chat geschickt hat.
+Beschreibe das Bild sachlich und detailliert. Falls es sich um ein Kunstwerk handelt, nenne den Künstler und den Titel.
+Antworte ausschließlich als JSON-Objekt mit den Feldern:
+"kuenstler" (Name oder null), "titel" (Titel oder null), "beschreibung" (ausführliche Beschreibung des Bildes).
+"""
+
+#   Klasse für die einmalige Analyse eines hochgeladenen Bildes
+#   Statt das Bild an jeden Charakterbot zu schicken, wird es nur einmal analysiert
+#   Das Ergebnis wird pro Bild zwischengespeichert
+class ImageAnalyzer:
+    def __init__(self, openai_client, model="gpt-4o", max_cached_analyses=MAX_CACHED_ANALYSES):
+        self.openai_client = openai_client
+        self.model = model
+        self.max_cached_analyses = max_cached_analyses
+        self.cache = OrderedDict()  #   Bereits analysierte Bilder (Schlüssel: Anhang-ID oder URL)
+        self.pending = {}   #   Laufende Analysen, damit ein Bild nicht doppelt analysiert wird
+
+    #   Analyse-Aufruf an OpenAI, Ergebnis: {"artist", "title", "description"}
+    async def _analyze(self, b64_image, mime_type):
+        response = await self.openai_client.chat.completions.create(
+            model=self.model,
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": ANALYSIS_PROMPT},
+                {"role": "user", "content": [
+                    {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{b64_image}"}}
+                ]}
+            ]
+        )
+        content = response.choices[0].message.content
+        try:
+            data = json.loads(content)
+        except (TypeError, json.JSONDecodeError):
+            data = None
+        #   Falls kein gültiges JSON-Objekt zurückkommt (z.B. eine Liste oder ein String),
+        #   wird der gesamte Text als Beschreibung verwendet
+        if not isinstance(data, dict):
+            data = {"beschreibung": content}
+        return {
+            "artist": data.get("kuenstler"),
+            "title": data.get("titel"),
+            "description": data.get("beschreibung") or ""
+        }
+
+    #   Gibt die Analyse eines Bildes zurück (aus dem Zwischenspeicher oder neu erstellt)
+    async def analyze(self, key, b64_image, mime_type="image/jpeg"):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        task = self.pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._analyze(b64_image, mime_type))
+            self.pending[key] = task
+            task.add_done_callback(lambda _: self.pending.pop(key, None))
+
+        #   shield: Wird ein wartender Aufruf abgebrochen, läuft die Analyse für die anderen weiter
+        analysis = await asyncio.shield(task)
+        self.cache[key] = analysis
+        self.cache.move_to_end(key)
+        #   Älteste Analysen werden verworfen
+        while len(self.cache) > self.max_cached_analyses:
+            self.cache.popitem(last=False)
+        return analysis
+
+#   Wandelt eine Bildanalyse in einen Text für die Prompts um
+def analysis_to_text(analysis):
+    parts = []
+    if analysis.get("artist"):
+        parts.append(f"Künstler: {analysis['artist']}")
+    if analysis.get("title"):
+        parts.append(f"Titel: {analysis['title']}")
+    if analysis.get("description"):
+        parts.append(f"Beschreibung: {analysis['description']}")
+    return "; ".join(parts)
@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from dotenv import load_dotenv
+
+#   Lädt Variablen aus der .env-Datei
+load_dotenv()
+
+#   Standardordner für den Bildzwischenspeicher (neben diesem Modul)
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "image_cache")
+#   Maximale Gesamtgröße aller gespeicherten Bilder (in Bytes)
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+
+#   Vereinheitlicht einen Bildprompt, damit gleiche Anfragen denselben Schlüssel bekommen
+#   z.B. "  Die Mona Lisa! " und "die mona lisa" -> "die mona lisa"
+def normalize_prompt(prompt):
+    prompt = prompt.lower().strip()
+    prompt = re.sub(r"\s+", " ", prompt)
+    return prompt.strip(" .,!?;:\"'")
+
+#   Persistenter Zwischenspeicher für generierte Bilder
+#   Schlüssel: normalisierter Prompt + Persona + Modell + Bildgröße
+#   Die Bilddaten werden inhaltsadressiert (Dateiname = SHA-256 der Bytes) abgelegt,
+#   ein Index ordnet jedem Schlüssel seine Bilddatei und den Zeitpunkt der letzten Nutzung zu
+#   Überschreitet der Speicher max_bytes, werden die am längsten nicht genutzten Bilder gelöscht
+class ImageCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.blob_dir = os.path.join(cache_dir, "blobs")
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.max_bytes = max_bytes
+        self.index = None   #   Schlüssel -> {"blob", "size", "last_used"} (wird beim ersten Zugriff geladen)
+        self.lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    #   Erstellt den Schlüssel für einen Prompt
+    @staticmethod
+    def make_key(prompt, persona, model, size):
+        raw = f"{model}|{size}|{persona or ''}|{normalize_prompt(prompt)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    #   Index von der Festplatte laden (läuft in einem eigenen Thread)
+    def _load_index(self):
+        os.makedirs(self.blob_dir, exist_ok=True)
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    #   Index auf die Festplatte schreiben (erst in eine temporäre Datei, dann ersetzen)
+    def _save_index(self, index):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _blob_path(self, blob):
+        return os.path.join(self.blob_dir, blob)
+
+    def _read_blob(self, blob):
+        with open(self._blob_path(blob), "rb") as f:
+            return f.read()
+
+    def _write_blob(self, blob, data):
+        path = self._blob_path(blob)
+        if not os.path.exists(path):
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+    def _remove_blob(self, blob):
+        try:
+            os.remove(self._blob_path(blob))
+        except FileNotFoundError:
+            pass
+
+    async def _ensure_index(self):
+        if self.index is None:
+            self.index = await asyncio.to_thread(self._load_index)
+
+    #   Gibt die Bilddaten zum Schlüssel zurück oder None, falls nicht vorhanden
+    async def get(self, key):
+        async with self.lock:
+            await self._ensure_index()
+            entry = self.index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            try:
+                data = await asyncio.to_thread(self._read_blob, entry["blob"])
+            except FileNotFoundError:
+                #   Datei wurde außerhalb des Programms gelöscht
+                del self.index[key]
+                self.misses += 1
+                return None
+            entry["last_used"] = time.time()
+            self.hits += 1
+            return data
+
+    #   Speichert Bilddaten unter dem Schlüssel und räumt bei Bedarf alte Bilder auf
+    async def put(self, key, data):
+        blob = hashlib.sha256(data).hexdigest()
+        async with self.lock:
+            await self._ensure_index()
+            await asyncio.to_thread(self._write_blob, blob, data)
+            self.index[key] = {"blob": blob, "size": len(data), "last_used": time.time()}
+            removed_blobs = self._evict()
+            index_copy = dict(self.index)
+            for removed in removed_blobs:
+                await asyncio.to_thread(self._remove_blob, removed)
+            await asyncio.to_thread(self._save_index, index_copy)
+
+    #   Entfernt die am längsten nicht genutzten Einträge, bis die Gesamtgröße wieder passt
+    #   Gibt die Bilddateien zurück, die von keinem Eintrag mehr genutzt werden
+    def _evict(self):
+        blob_sizes = {}
+        for entry in self.index.values():
+            blob_sizes[entry["blob"]] = entry["size"]
+        total = sum(blob_sizes.values())
+        removed = []
+        for key, entry in sorted(self.index.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            del self.index[key]
+            #   Eine Bilddatei wird erst gelöscht, wenn kein anderer Schlüssel mehr darauf verweist
+            if not any(other["blob"] == entry["blob"] for other in self.index.values()):
+                total -= entry["size"]
+                removed.append(entry["blob"])
+        return removed
+
+    #   Kennzahlen des Zwischenspeichers
+    def stats(self):
+        index = self.index or {}
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(index),
+            "bytes": sum({entry["blob"]: entry["size"] for entry in index.values()}.values())
+        }
+
+#   Gemeinsame Instanz (Ordner und Größe aus der .env-Datei, falls gesetzt)
+image_cache = ImageCache(
+    cache_dir=os.getenv("IMAGE_CACHE_DIR", DEFAULT_CACHE_DIR),
+    max_bytes=int(os.getenv("IMAGE_CACHE_MAX_MB", DEFAULT_MAX_BYTES // (1024 * 1024))) * 1024 * 1024
+)
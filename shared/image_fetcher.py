@@ -0,0 +1,122 @@
+import asyncio
+from collections import OrderedDict
+import aiohttp
+from shared.image_preprocessing import image_preprocessor
+
+#   Maximale Größe eines heruntergeladenen Bildes (in Bytes)
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+#   Anzahl der Bilder, die im Arbeitsspeicher zwischengespeichert werden
+#   Aufbereitete Bilder behalten nur ihre verkleinerte Base64-Darstellung, nicht die Originalbytes
+MAX_CACHED_IMAGES = 32
+
+#   Klasse zum Herunterladen von Bildern über eine gemeinsame HTTP-Sitzung
+#   Jedes Bild wird pro Anfrage nur einmal heruntergeladen und für die Bildanalyse aufbereitet
+#   (verkleinert und in Base64 umgewandelt, siehe image_preprocessing.py)
+#   Alle Charakterbots greifen auf dieselben Bilddaten zu
+class ImageFetcher:
+    def __init__(self, max_bytes=MAX_IMAGE_BYTES, max_cached_images=MAX_CACHED_IMAGES):
+        self.max_bytes = max_bytes
+        self.max_cached_images = max_cached_images
+        self.session: None | aiohttp.ClientSession = None   #   Gemeinsame HTTP-Sitzung (wird beim ersten Download erstellt)
+        self.cache = OrderedDict()  #   Bereits heruntergeladene Bilder (Schlüssel: Anhang-ID oder URL)
+        self.pending = {}   #   Laufende Downloads, damit gleichzeitige Anfragen nicht doppelt laden
+
+    #   Gemeinsame HTTP-Sitzung mit Verbindungspool, Keep-Alive und DNS-Cache
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=20,   #   Maximale Anzahl offener Verbindungen
+                ttl_dns_cache=300,  #   DNS-Einträge werden 5 Minuten zwischengespeichert
+                keepalive_timeout=60    #   Verbindungen bleiben für weitere Downloads offen
+            )
+            self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30))
+        return self.session
+
+    #   Lädt ein Bild herunter, bricht ab, wenn es größer als max_bytes ist
+    async def _download(self, url):
+        session = self.get_session()
+        async with session.get(url) as resp:
+            if resp.status != 200:
+                return None
+            if resp.content_length and resp.content_length > self.max_bytes:
+                print(f"[ImageFetcher] Bild zu groß ({resp.content_length} Bytes): {url}")
+                return None
+            data = bytearray()
+            async for chunk in resp.content.iter_chunked(64 * 1024):
+                data.extend(chunk)
+                if len(data) > self.max_bytes:
+                    print(f"[ImageFetcher] Bild zu groß (> {self.max_bytes} Bytes): {url}")
+                    return None
+            return {
+                "bytes": bytes(data),
+                "content_type": resp.content_type
+            }
+
+    #   Gibt die Bilddaten zurück (aus dem Zwischenspeicher oder frisch heruntergeladen)
+    #   key: z.B. die Discord-Anhang-ID, standardmäßig die URL
+    #   prepare: Bild zusätzlich für die Bildanalyse aufbereiten ("b64" und "mime_type")
+    async def fetch(self, url, key=None, prepare=True):
+        image = await self._fetch_raw(url, key)
+        #   Aufbereitung nur einmal pro Bild, gleichzeitige Aufrufe teilen sie sich (siehe ImagePreprocessor)
+        if image and prepare and "b64" not in image:
+            image.update(await image_preprocessor.prepare(image["bytes"], image["content_type"]))
+            #   Die Originalbytes (bis zu max_bytes) werden danach nicht mehr gebraucht
+            image.pop("bytes", None)
+        return image
+
+    #   Bilddaten ohne Aufbereitung (Zwischenspeicher, laufender oder neuer Download)
+    async def _fetch_raw(self, url, key=None):
+        key = key or url
+        #   Treffer über die Anhang-ID oder die URL
+        for lookup in (key, url):
+            if lookup in self.cache:
+                self.cache.move_to_end(lookup)
+                return self.cache[lookup]
+
+        task = self.pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._download(url))
+            self.pending[key] = task
+            task.add_done_callback(lambda _: self.pending.pop(key, None))
+
+        #   shield: Wird ein wartender Aufruf abgebrochen, läuft der Download für die anderen weiter
+        try:
+            image = await asyncio.shield(task)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"[ImageFetcher] Fehler beim Herunterladen: {e}")
+            return None
+
+        if image:
+            #   Das Bild ist über die Anhang-ID und über die URL auffindbar (beide verweisen auf dieselben Daten)
+            for lookup in {key, url}:
+                self.cache[lookup] = image
+                self.cache.move_to_end(lookup)
+            #   Älteste Bilder werden verworfen
+            while len(self.cache) > self.max_cached_images:
+                self.cache.popitem(last=False)
+        return image
+
+    #   Gibt nur die Bytes des Bildes zurück
+    #   Wurden die Originalbytes nach der Aufbereitung verworfen, wird das Bild erneut heruntergeladen
+    async def fetch_bytes(self, url, key=None):
+        image = await self._fetch_raw(url, key)
+        if image and "bytes" not in image:
+            try:
+                image = await self._download(url)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"[ImageFetcher] Fehler beim Herunterladen: {e}")
+                return None
+        return image["bytes"] if image else None
+
+    #   Entfernt ein Bild aus dem Zwischenspeicher
+    def forget(self, *keys):
+        for key in keys:
+            self.cache.pop(key, None)
+
+    #   Schließt die HTTP-Sitzung beim Beenden des Programms
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+#   Gemeinsame Instanz für alle Bots im Prozess
+image_fetcher = ImageFetcher()
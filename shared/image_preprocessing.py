@@ -0,0 +1,148 @@
+import asyncio
+import base64
+import hashlib
+import io
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+#   Pillow ist optional: ohne Pillow werden Bilder unverändert (aber mit passendem Dateityp) weitergegeben
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+#   Lädt Variablen aus der .env-Datei
+load_dotenv()
+
+#   Verkleinern der Bilder vor der Bildanalyse an/aus (aus der .env-Datei, Standard: "on")
+IMAGE_PREPROCESSING = os.getenv("IMAGE_PREPROCESSING", "on").lower() == "on"
+#   Maximale Kantenlänge in Pixeln (OpenAI rechnet Bilder ohnehin auf höchstens 2048 x 768 Pixel herunter)
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", 1536))
+#   JPEG-Qualität beim erneuten Speichern (1-95)
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 85))
+#   Anzahl der Threads für die Bildverarbeitung
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+#   Anzahl der aufbereiteten Bilder im Arbeitsspeicher
+MAX_PREPARED_IMAGES = 64
+
+#   Erkennt den Dateityp an den ersten Bytes (Discord und Server liefern nicht immer den richtigen Content-Type)
+def sniff_mime_type(data, fallback="image/jpeg"):
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if fallback and fallback.startswith("image/"):
+        return fallback
+    return "image/jpeg"
+
+#   Verkleinert und speichert ein Bild neu (läuft in einem Thread, nicht im Event-Loop)
+#   Das Ergebnis wird nur verwendet, wenn es kleiner als das Original ist
+def _prepare(data, content_type, max_dimension, quality):
+    mime_type = sniff_mime_type(data, content_type)
+    width = height = None
+    #   GIFs bleiben unverändert (Animationen)
+    if Image is not None and mime_type != "image/gif":
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                width, height = img.size
+                #   Handyfotos: Ausrichtung aus den EXIF-Daten übernehmen, da diese beim Speichern verloren gehen
+                img = ImageOps.exif_transpose(img)
+                if max(img.size) > max_dimension:
+                    img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+                out = io.BytesIO()
+                #   Bilder mit Transparenz bleiben PNG, alles andere wird JPEG
+                if img.mode in ("RGBA", "LA", "P") and (img.mode != "P" or "transparency" in img.info):
+                    img.save(out, format="PNG", optimize=True)
+                    new_type = "image/png"
+                else:
+                    img.convert("RGB").save(out, format="JPEG", quality=quality, optimize=True)
+                    new_type = "image/jpeg"
+                if out.tell() < len(data):
+                    data = out.getvalue()
+                    mime_type = new_type
+                    width, height = img.size
+        except Exception as e:
+            print(f"[ImagePreprocessor] Bild konnte nicht verkleinert werden, Original wird verwendet: {e}")
+    return {
+        "b64": base64.b64encode(data).decode("utf-8"),
+        "mime_type": mime_type,
+        "size": len(data),
+        "width": width,
+        "height": height
+    }
+
+#   Aufbereitung von Bildern für die Bildanalyse (Verkleinern, Neukodieren, Base64)
+#   Die Arbeit läuft in einem Thread-Pool, damit der Event-Loop und damit alle Bots nicht blockiert werden
+#   Ergebnisse werden über den Hash des Inhalts zwischengespeichert (gleiches Bild unter anderer URL = Treffer)
+class ImagePreprocessor:
+    def __init__(self, enabled=IMAGE_PREPROCESSING, max_dimension=IMAGE_MAX_DIMENSION, quality=IMAGE_QUALITY,
+                 workers=IMAGE_WORKERS, max_prepared_images=MAX_PREPARED_IMAGES):
+        self.enabled = enabled
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.max_prepared_images = max_prepared_images
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-prep")
+        self.cache = OrderedDict()  #   Hash des Inhalts -> aufbereitetes Bild
+        self.pending = {}   #   Laufende Aufbereitungen, damit gleiche Bilder nicht doppelt verarbeitet werden
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.hits = 0
+        if enabled and Image is None:
+            print("[ImagePreprocessor] Pillow ist nicht installiert, Bilder werden nicht verkleinert")
+
+    #   Gibt {"b64", "mime_type", "size", "width", "height"} zurück
+    async def prepare(self, data, content_type=None):
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(self.executor, lambda: hashlib.sha256(data).hexdigest())
+        if digest in self.cache:
+            self.cache.move_to_end(digest)
+            self.hits += 1
+            return self.cache[digest]
+
+        future = self.pending.get(digest)
+        if future is None:
+            #   Ausgeschaltet: nur Base64 und Dateityp, aber ebenfalls außerhalb des Event-Loops
+            if self.enabled:
+                work = lambda: _prepare(data, content_type, self.max_dimension, self.quality)
+            else:
+                work = lambda: {"b64": base64.b64encode(data).decode("utf-8"),
+                                "mime_type": sniff_mime_type(data, content_type), "size": len(data),
+                                "width": None, "height": None}
+            future = loop.run_in_executor(self.executor, work)
+            self.pending[digest] = future
+            future.add_done_callback(lambda _: self.pending.pop(digest, None))
+
+        #   shield: Wird ein wartender Aufruf abgebrochen, läuft die Aufbereitung für die anderen weiter
+        prepared = await asyncio.shield(future)
+        if digest not in self.cache:
+            self.bytes_in += len(data)
+            self.bytes_out += prepared["size"]
+        self.cache[digest] = prepared
+        self.cache.move_to_end(digest)
+        #   Älteste Bilder werden verworfen
+        while len(self.cache) > self.max_prepared_images:
+            self.cache.popitem(last=False)
+        return prepared
+
+    #   Kennzahlen: Treffer, Größe vor und nach der Aufbereitung
+    def stats(self):
+        return {
+            "cached": len(self.cache),
+            "hits": self.hits,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None
+        }
+
+#   Data-URL für die Bildanalyse von OpenAI
+def to_data_url(prepared):
+    return f"data:{prepared['mime_type']};base64,{prepared['b64']}"
+
+#   Gemeinsame Instanz
+image_preprocessor = ImagePreprocessor()
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import os
+from dotenv import load_dotenv
+
+#   Lädt Variablen aus der .env-Datei
+load_dotenv()
+
+#   Grobe Schätzung: ein Token entspricht etwa 4 Zeichen
+CHARS_PER_TOKEN = 4
+#   Geschätzte Tokenanzahl eines Bildes (OpenAI, Bild mit hoher Detailstufe)
+IMAGE_TOKENS = 765
+
+#   Maximale Anzahl an Tokens für den Gesprächsverlauf pro Anfrage
+TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", 3000))
+#   Anzahl der neuesten Nachrichten, die unverändert erhalten bleiben (ältere werden zusammengefasst)
+RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", 8))
+#   Maximale Anzahl gespeicherter Nachrichten, unabhängig von der Zusammenfassung
+MAX_ENTRIES = int(os.getenv("MEMORY_MAX_ENTRIES", 200))
+#   Anzahl älterer Nachrichten (außerhalb von RECENT_TURNS), ab der auch innerhalb des Tokenbudgets zusammengefasst wird
+COMPACTION_BATCH = int(os.getenv("MEMORY_COMPACTION_BATCH", 8))
+#   Maximale Länge der Zusammenfassung (in Zeichen)
+MAX_SUMMARY_CHARS = 2000
+
+#   Prompt für die schrittweise Zusammenfassung älterer Nachrichten
+SUMMARY_PROMPT = """
+Du fasst einen laufenden Chatverlauf zwischen Museumsbesuchern und Chatbots zusammen.
+Ergänze die bisherige Zusammenfassung um die neuen Nachrichten.
+Behalte alles, was der Nutzer über sich oder seine Wünsche gesagt hat, besprochene Kunstwerke und offene Fragen.
+Antworte nur mit der neuen Zusammenfassung, höchstens 150 Wörter.
+"""
+
+#   Schätzt die Tokenanzahl eines Nachrichteninhalts (Text oder Liste aus Text- und Bildteilen)
+def estimate_tokens(content):
+    if content is None:
+        return 0
+    if isinstance(content, str):
+        return len(content) // CHARS_PER_TOKEN + 1
+    if isinstance(content, list):
+        total = 0
+        for part in content:
+            if isinstance(part, dict) and part.get("type") == "image_url":
+                total += IMAGE_TOKENS
+            elif isinstance(part, dict):
+                total += estimate_tokens(part.get("text", ""))
+            else:
+                total += estimate_tokens(str(part))
+        return total
+    return estimate_tokens(json.dumps(content))
+
+#   Gibt die neuesten Texte zurück, die zusammen in das Tokenbudget passen (älteste zuerst)
+def fit_to_budget(texts, token_budget):
+    result = []
+    used = 0
+    for text in reversed(texts):
+        cost = estimate_tokens(text)
+        if result and used + cost > token_budget:
+            break
+        result.append(text)
+        used += cost
+    result.reverse()
+    return result
+
+#   Ersetzt Bilder in einer Nachricht durch ihre Beschreibung (bzw. einen Platzhalter)
+def without_images(message, description=None):
+    content = message.get("content")
+    if not isinstance(content, list):
+        return message
+    parts = []
+    for part in content:
+        if part.get("type") == "image_url":
+            parts.append({"type": "text", "text": f"[Bild: {description}]" if description else "[Bild]"})
+        else:
+            parts.append(part)
+    return {**message, "content": parts}
+
+#   Textdarstellung einer Nachricht (ohne Bilder)
+def message_text(message):
+    content = message.get("content")
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+    return str(content or "")
+
+#   Erstellt eine Zusammenfassungsfunktion, die ein OpenAI-Modell verwendet
+def make_openai_summarizer(openai_client, model="gpt-4o-mini"):
+    async def summarize(summary, new_messages):
+        response = await openai_client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"Bisherige Zusammenfassung:\n{summary or '-'}\n\nNeue Nachrichten:\n{new_messages}"}
+            ]
+        )
+        return response.choices[0].message.content.strip()
+    return summarize
+
+#   Begrenzter Gesprächsspeicher mit Tokenbudget
+#   Die neuesten Nachrichten bleiben unverändert, ältere werden schrittweise zusammengefasst
+#   Bilder werden nur beim ersten Senden mitgeschickt, danach durch ihre Beschreibung ersetzt
+#   Optional werden Nachrichten und Zusammenfassung dauerhaft gespeichert (persistence, Schlüssel key)
+class ConversationMemory:
+    def __init__(self, token_budget=TOKEN_BUDGET, recent_turns=RECENT_TURNS, max_entries=MAX_ENTRIES, summarizer=None,
+                 persistence=None, key=None, compaction_batch=COMPACTION_BATCH):
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.max_entries = max_entries
+        self.compaction_batch = compaction_batch
+        self.summarizer = summarizer    #   async (bisherige Zusammenfassung, neue Nachrichten) -> neue Zusammenfassung
+        self.entries = []   #   {"message", "description", "images_sent"}
+        self.summary = ""   #   Zusammenfassung aller älteren Nachrichten
+        self.compaction_lock = asyncio.Lock()
+        self.compaction_task = None
+        self.token_estimate = None  #   Zwischengespeicherte Tokenschätzung, wird bei Änderungen zurückgesetzt
+        self.persistence = persistence  #   Dauerhafter Speicher (ConversationStore) oder None
+        self.key = key  #   Schlüssel des Gesprächs im dauerhaften Speicher
+
+    #   Fügt eine Nachricht hinzu (Format wie bei OpenAI: {"role", "content"})
+    def add(self, message, description=None):
+        self.entries.append({"message": message, "description": description, "images_sent": False})
+        self.token_estimate = None
+        #   Gespeichert wird nur der Text, Bilder werden durch ihre Beschreibung ersetzt
+        if self.persistence:
+            self.persistence.record_message(self.key, message.get("role"),
+                                            message_text(without_images(message, description)))
+        #   Harte Obergrenze: überzählige Nachrichten werden ohne Modellaufruf in die Zusammenfassung übernommen
+        while len(self.entries) > self.max_entries:
+            dropped = self.entries.pop(0)
+            self._append_to_summary(self._entry_text(dropped))
+
+    #   Setzt die Beschreibung der Bilder einer Nachricht (z.B. das Ergebnis einer Bildanalyse)
+    #   Nachrichten, die bereits in die Zusammenfassung übernommen wurden, bleiben unverändert
+    def describe_images(self, message, description):
+        for entry in reversed(self.entries):
+            if entry["message"] is message:
+                entry["description"] = description
+                self.token_estimate = None
+                return
+
+    #   Markiert alle Bilder als gesendet, ab jetzt werden nur noch ihre Beschreibungen verwendet
+    def mark_images_sent(self):
+        for entry in self.entries:
+            entry["images_sent"] = True
+        self.token_estimate = None
+
+    #   Nachrichten für die nächste Anfrage: Zusammenfassung + neueste Nachrichten innerhalb des Tokenbudgets
+    #   Die neueste Nachricht wird immer übernommen
+    def messages(self, token_budget=None):
+        budget = token_budget or self.token_budget
+        used = estimate_tokens(self.summary)
+        result = []
+        for entry in reversed(self.entries):
+            message = entry["message"]
+            if entry["images_sent"]:
+                message = without_images(message, entry["description"])
+            cost = estimate_tokens(message.get("content"))
+            if result and used + cost > budget:
+                break
+            result.append(message)
+            used += cost
+        result.reverse()
+        if self.summary:
+            result.insert(0, {"role": "system", "content": f"Zusammenfassung des bisherigen Gesprächs: {self.summary}"})
+        return result
+
+    #   Geschätzte Tokenanzahl aller gespeicherten Nachrichten und der Zusammenfassung
+    def estimated_tokens(self):
+        if self.token_estimate is None:
+            total = estimate_tokens(self.summary)
+            for entry in self.entries:
+                message = entry["message"]
+                if entry["images_sent"]:
+                    message = without_images(message, entry["description"])
+                total += estimate_tokens(message.get("content"))
+            self.token_estimate = total
+        return self.token_estimate
+
+    #   Texte aller gespeicherten Nachrichten (älteste zuerst)
+    def texts(self):
+        return [message_text(entry["message"]) for entry in self.entries]
+
+    #   Startet die Zusammenfassung im Hintergrund, sobald der Verlauf das Tokenbudget überschreitet
+    #   oder sich außerhalb von recent_turns compaction_batch ältere Nachrichten angesammelt haben
+    #   So wird nicht nach jeder Nachricht ein Modellaufruf gestartet
+    #   Die Antwort an den Nutzer muss dadurch nicht auf die Zusammenfassung warten
+    def schedule_compaction(self):
+        older = len(self.entries) - self.recent_turns
+        if older <= 0:
+            return
+        if older < self.compaction_batch and self.estimated_tokens() <= self.token_budget:
+            return
+        if self.compaction_task and not self.compaction_task.done():
+            return
+        self.compaction_task = asyncio.create_task(self.compact())
+
+    #   Fasst alle Nachrichten außer den neuesten recent_turns zusammen
+    async def compact(self):
+        async with self.compaction_lock:
+            old_entries = self.entries[:-self.recent_turns] if self.recent_turns else list(self.entries)
+            if not old_entries:
+                return
+            new_text = "\n".join(self._entry_text(entry) for entry in old_entries)
+            summary = None
+            if self.summarizer:
+                try:
+                    summary = await self.summarizer(self.summary, new_text)
+                except Exception as e:
+                    print(f"[Memory] Zusammenfassung fehlgeschlagen: {e}")
+            #   Während der Zusammenfassung können neue Nachrichten hinzugekommen sein,
+            #   daher werden genau die zusammengefassten Einträge entfernt
+            old_ids = {id(entry) for entry in old_entries}
+            self.entries = [entry for entry in self.entries if id(entry) not in old_ids]
+            self.token_estimate = None
+            if summary is not None:
+                self.summary = summary[-MAX_SUMMARY_CHARS:]
+                self._persist_summary()
+            else:
+                self._append_to_summary(new_text)
+
+    #   Zusammenfassung ohne Modell: Text wird angehängt, nur die neuesten MAX_SUMMARY_CHARS Zeichen bleiben
+    def _append_to_summary(self, text):
+        self.summary = f"{self.summary}\n{text}".strip()[-MAX_SUMMARY_CHARS:]
+        self._persist_summary()
+
+    def _persist_summary(self):
+        if self.persistence:
+            self.persistence.record_summary(self.key, self.summary)
+
+    #   Stellt das Gespräch aus dem dauerhaften Speicher wieder her (z.B. nach einem Neustart)
+    #   Geladen werden die Zusammenfassung und die neuesten recent_turns Nachrichten, ältere sind in der Zusammenfassung enthalten
+    async def rehydrate(self):
+        if not self.persistence or self.entries:
+            return
+        summary, messages = await self.persistence.load_conversation(self.key, self.recent_turns)
+        self.summary = summary or ""
+        self.entries = [{"message": message, "description": None, "images_sent": True} for message in messages]
+        self.token_estimate = None
+
+    @staticmethod
+    def _entry_text(entry):
+        message = without_images(entry["message"], entry["description"])
+        return f"{message.get('role')}: {message_text(message)}"
@@ -0,0 +1,360 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from shared.memory import estimate_tokens
+
+#   Lädt Variablen aus der .env-Datei
+load_dotenv()
+
+#   Prioritäten der Anfragen (kleinere Zahl = wird zuerst bearbeitet)
+PRIORITY_ANSWER = 0     #   Antworten der Charakterbots, Planung, Bildanalyse (Nutzer wartet direkt darauf)
+PRIORITY_SELECTOR = 1   #   Auswahl der besten Antwort
+PRIORITY_IMAGE = 2      #   Bildgenerierung
+PRIORITY_BACKGROUND = 3     #   Zusammenfassungen im Hintergrund
+
+#   Grenzen des eigenen OpenAI-Kontos für gpt-4o und nicht aufgeführte Modelle (aus der .env-Datei)
+#   Anfragen pro Minute (rpm) und Tokens pro Minute (tpm), Standard: 500 rpm und 30000 tpm
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", 500))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", 30000))
+
+#   Standardgrenzen pro Modell
+#   Können in der .env-Datei über OPENAI_RATE_LIMITS (JSON) einzeln angepasst werden
+DEFAULT_RATE_LIMITS = {
+    "gpt-4o": {"rpm": OPENAI_RPM, "tpm": OPENAI_TPM},
+    "gpt-4o-mini": {"rpm": 500, "tpm": 200000},
+    "dall-e-3": {"rpm": 5, "tpm": 0}
+}
+#   Grenzen für Modelle, die oben nicht aufgeführt sind
+FALLBACK_RATE_LIMIT = {"rpm": OPENAI_RPM, "tpm": OPENAI_TPM}
+#   Angenommene Länge einer Antwort (in Tokens), solange die tatsächliche Nutzung noch nicht bekannt ist
+DEFAULT_COMPLETION_TOKENS = 500
+
+#   Maximale Anzahl gleichzeitig laufender Anfragen an OpenAI (aus der .env-Datei, Standard: 8)
+MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 8))
+#   Wiederholungen bei Ratenbegrenzung (429), Zeitüberschreitung, Verbindungs- und Serverfehlern
+#   (aus der .env-Datei, Standard: 4)
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 4))
+#   Wartezeit vor der ersten Wiederholung und Obergrenze (in Sekunden), dazwischen exponentiell mit Zufallsanteil
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+
+#   Token-Bucket: füllt sich gleichmäßig mit per_minute Einheiten pro Minute auf
+#   per_minute = 0 bedeutet keine Begrenzung
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    #   Wartezeit in Sekunden, bis amount Einheiten verfügbar sind
+    def wait_time(self, amount):
+        if not self.capacity:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    #   Verbraucht amount Einheiten (negativ = Rückgabe zu viel reservierter Einheiten)
+    def consume(self, amount):
+        if not self.capacity:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+#   Zentrale Warteschlange für alle OpenAI-Anfragen
+#   - begrenzt Anfragen und Tokens pro Minute für jedes Modell
+#   - bearbeitet wartende Anfragen nach Priorität (bei gleicher Priorität in Eingangsreihenfolge)
+#   - wiederholt fehlgeschlagene Anfragen mit exponentieller Wartezeit und beachtet Retry-After
+#   - sammelt Kennzahlen (Warteschlangenlänge, Wartezeit, Wiederholungen)
+class OpenAIScheduler:
+    def __init__(self, api_key=None, base_url=None, rate_limits=None, max_concurrency=MAX_CONCURRENCY,
+                 max_retries=MAX_RETRIES):
+        self.api_key = api_key
+        self.base_url = base_url    #   z.B. lokaler Test-Server statt der OpenAI-API
+        self.rate_limits = {**DEFAULT_RATE_LIMITS, **(rate_limits or {})}
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.openai_client = None   #   wird bei der ersten Anfrage erstellt
+        self.buckets = {}   #   Modell -> {"requests": TokenBucket, "tokens": TokenBucket}
+        self.blocked_until = {}     #   Modell -> Zeitpunkt, bis zu dem nach einem 429 nichts gesendet wird
+        self.waiting = []   #   [(Priorität, Reihenfolge, Future, Modell, Tokens)]
+        self.sequence = itertools.count()
+        self.in_flight = 0
+        self.changed = asyncio.Event()
+        self.pump_task = None
+        self.metrics = {"requests": 0, "retries": 0, "rate_limited": 0, "errors": 0, "wait_seconds": 0.0}
+        self.listeners = []     #   Funktionen (Modell, Priorität, Dauer, Tokens, Ergebnis), z.B. für Kennzahlen
+
+    #   OpenAI-Client ohne eigene Wiederholungen (werden hier gesteuert)
+    def _client(self):
+        if self.openai_client is None:
+            self.openai_client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+        return self.openai_client
+
+    #   Registriert eine Funktion, die nach jedem Aufruf an OpenAI aufgerufen wird
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def _notify(self, model, priority, seconds, tokens, outcome):
+        for listener in self.listeners:
+            try:
+                listener(model, priority, seconds, tokens, outcome)
+            except Exception as e:
+                print(f"[OpenAI] Fehler in Listener: {e}")
+
+    #   Client-Ersatz mit fester Priorität, kann überall statt eines AsyncOpenAI-Clients übergeben werden
+    def client(self, priority):
+        return ScheduledClient(self, priority)
+
+    def _buckets(self, model):
+        if model not in self.buckets:
+            limits = self.rate_limits.get(model, FALLBACK_RATE_LIMIT)
+            self.buckets[model] = {"requests": TokenBucket(limits.get("rpm", 0)),
+                                   "tokens": TokenBucket(limits.get("tpm", 0))}
+        return self.buckets[model]
+
+    #   Wartezeit, bis eine Anfrage für das Modell gesendet werden darf
+    def _wait_time(self, model, tokens):
+        buckets = self._buckets(model)
+        blocked = self.blocked_until.get(model, 0) - time.monotonic()
+        return max(blocked, buckets["requests"].wait_time(1), buckets["tokens"].wait_time(tokens))
+
+    #   Verteilt freie Plätze an wartende Anfragen, solange welche warten
+    async def _pump(self):
+        while self.waiting:
+            self.changed.clear()
+            #   Abgebrochene Anfragen (z.B. durch eine neuere Nutzeranfrage) werden entfernt
+            self.waiting = [entry for entry in self.waiting if not entry[2].done()]
+            delay = None
+            if self.in_flight < self.max_concurrency:
+                for entry in sorted(self.waiting):
+                    _, _, future, model, tokens = entry
+                    wait = self._wait_time(model, tokens)
+                    if wait <= 0:
+                        buckets = self._buckets(model)
+                        buckets["requests"].consume(1)
+                        buckets["tokens"].consume(tokens)
+                        self.waiting.remove(entry)
+                        self.in_flight += 1
+                        future.set_result(None)
+                        delay = 0
+                        break
+                    delay = wait if delay is None else min(delay, wait)
+            if delay == 0 or not self.waiting:
+                continue
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    #   Wartet, bis die Anfrage an der Reihe ist
+    async def _acquire(self, priority, model, tokens):
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.append((priority, next(self.sequence), future, model, tokens))
+        self.changed.set()
+        if self.pump_task is None or self.pump_task.done():
+            self.pump_task = asyncio.create_task(self._pump())
+        start = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            #   Abbruch, nachdem der Platz bereits vergeben wurde: Platz wieder freigeben
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        self.metrics["wait_seconds"] += time.monotonic() - start
+
+    def _release(self):
+        self.in_flight -= 1
+        self.changed.set()
+
+    #   Wartezeit vor der nächsten Wiederholung: Retry-After des Servers oder exponentiell mit Zufallsanteil
+    @staticmethod
+    def _retry_delay(error, attempt):
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except ValueError:
+            pass
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    #   Führt eine Anfrage mit Warteschlange, Ratenbegrenzung und Wiederholungen aus
+    #   call: async Funktion ohne Parameter, die die eigentliche Anfrage sendet
+    #   stream: die Antwort ist ein Stream, der Platz bleibt belegt, bis er gelesen oder geschlossen ist (ScheduledStream)
+    async def submit(self, call, priority, model, tokens=0, stream=False):
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(priority, model, tokens)
+            self.metrics["requests"] += 1
+            start = time.monotonic()
+            hold = False
+            try:
+                response = await call()
+            except (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError) as e:
+                self._notify(model, priority, time.monotonic() - start, 0, type(e).__name__)
+                if isinstance(e, RateLimitError):
+                    self.metrics["rate_limited"] += 1
+                if attempt >= self.max_retries:
+                    self.metrics["errors"] += 1
+                    raise
+                delay = self._retry_delay(e, attempt)
+                if isinstance(e, RateLimitError):
+                    #   Alle Anfragen an dieses Modell pausieren, bis der Server wieder Anfragen annimmt
+                    self.blocked_until[model] = max(self.blocked_until.get(model, 0), time.monotonic() + delay)
+                self.metrics["retries"] += 1
+                print(f"[OpenAI] {type(e).__name__} bei {model}, neuer Versuch in {delay:.1f}s "
+                      f"({attempt + 1}/{self.max_retries})")
+            except Exception as e:
+                self.metrics["errors"] += 1
+                self._notify(model, priority, time.monotonic() - start, 0, type(e).__name__)
+                raise
+            else:
+                if stream:
+                    hold = True
+                    return ScheduledStream(self, response, priority, model, tokens, start)
+                self._complete(model, priority, tokens, start, getattr(response, "usage", None))
+                return response
+            finally:
+                if not hold:
+                    self._release()
+            await asyncio.sleep(delay)
+
+    #   Abschluss einer erfolgreichen Anfrage: reservierte Tokens werden mit der tatsächlichen Nutzung verrechnet
+    def _complete(self, model, priority, tokens, start, usage, outcome="ok"):
+        total_tokens = getattr(usage, "total_tokens", None)
+        self._notify(model, priority, time.monotonic() - start,
+                     total_tokens if isinstance(total_tokens, int) else 0, outcome)
+        if isinstance(total_tokens, int) and tokens:
+            self._buckets(model)["tokens"].consume(total_tokens - tokens)
+
+    #   Chat-Anfrage (gleiche Parameter wie chat.completions.create)
+    #   Bei stream=True wird die Tokennutzung im letzten Abschnitt des Streams mitgeschickt (include_usage)
+    async def chat(self, priority=PRIORITY_ANSWER, **kwargs):
+        model = kwargs.get("model", "gpt-4o")
+        prompt_tokens = sum(estimate_tokens(message.get("content")) for message in kwargs.get("messages", []))
+        tokens = prompt_tokens + kwargs.get("max_tokens", DEFAULT_COMPLETION_TOKENS)
+        stream = bool(kwargs.get("stream"))
+        if stream:
+            kwargs["stream_options"] = {**kwargs.get("stream_options", {}), "include_usage": True}
+        return await self.submit(lambda: self._client().chat.completions.create(**kwargs), priority, model, tokens,
+                                 stream=stream)
+
+    #   Bildgenerierung (gleiche Parameter wie images.generate)
+    async def generate_image(self, priority=PRIORITY_IMAGE, **kwargs):
+        model = kwargs.get("model", "dall-e-3")
+        return await self.submit(lambda: self._client().images.generate(**kwargs), priority, model)
+
+    #   Freie Kapazität: keine wartenden Anfragen und weniger als max_concurrency laufende (z.B. für zusätzliche Anfragen)
+    def has_capacity(self):
+        return self.in_flight < self.max_concurrency and all(entry[2].done() for entry in self.waiting)
+
+    #   Kennzahlen: wartende Anfragen pro Priorität, laufende Anfragen, Wiederholungen, durchschnittliche Wartezeit
+    def stats(self):
+        queued = {}
+        for priority, _, future, _, _ in self.waiting:
+            if not future.done():
+                queued[priority] = queued.get(priority, 0) + 1
+        requests = self.metrics["requests"]
+        return {
+            "queued": queued,
+            "in_flight": self.in_flight,
+            "requests": requests,
+            "retries": self.metrics["retries"],
+            "rate_limited": self.metrics["rate_limited"],
+            "errors": self.metrics["errors"],
+            "avg_wait_ms": round(self.metrics["wait_seconds"] / requests * 1000, 1) if requests else 0.0
+        }
+
+#   Ersatz für einen AsyncOpenAI-Client: client.chat.completions.create(...) und client.images.generate(...)
+#   laufen über den Scheduler mit der festgelegten Priorität
+class ScheduledClient:
+    def __init__(self, scheduler, priority):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.chat = self
+        self.completions = self
+        self.images = _ScheduledImages(self)
+
+    async def create(self, **kwargs):
+        return await self.scheduler.chat(priority=self.priority, **kwargs)
+
+#   Gestreamte Antwort: belegt ihren Platz im Scheduler, bis sie vollständig gelesen oder geschlossen wurde
+#   Danach wird die Reservierung mit der Tokennutzung aus dem letzten Abschnitt verrechnet
+#   Verwendung wie der Stream von OpenAI: async for chunk in stream (optional in async with stream)
+class ScheduledStream:
+    def __init__(self, scheduler, stream, priority, model, tokens, start):
+        self.scheduler = scheduler
+        self.stream = stream
+        self.priority = priority
+        self.model = model
+        self.tokens = tokens    #   Reservierte Tokens
+        self.start = start
+        self.usage = None
+        self.outcome = "ok"
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        try:
+            async for chunk in self.stream:
+                if getattr(chunk, "usage", None):
+                    self.usage = chunk.usage
+                yield chunk
+        except (Exception, asyncio.CancelledError) as e:
+            self.outcome = type(e).__name__
+            raise
+        finally:
+            await self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    #   Gibt den Platz frei (einmalig) und schließt die Verbindung
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.scheduler._complete(self.model, self.priority, self.tokens, self.start, self.usage, self.outcome)
+        self.scheduler._release()
+        close = getattr(self.stream, "close", None)
+        if close:
+            try:
+                await close()
+            except Exception as e:
+                print(f"[OpenAI] Fehler beim Schließen des Streams: {e}")
+
+class _ScheduledImages:
+    def __init__(self, client):
+        self.client = client
+
+    async def generate(self, **kwargs):
+        return await self.client.scheduler.generate_image(priority=self.client.priority, **kwargs)
+
+#   Gemeinsame Instanz für alle Bots
+#   OPENAI_BASE_URL erlaubt Tests gegen einen lokalen Ersatz-Server
+scheduler = OpenAIScheduler(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    base_url=os.getenv("OPENAI_BASE_URL") or None,
+    rate_limits=json.loads(os.getenv("OPENAI_RATE_LIMITS") or "{}")
+)
@@ -0,0 +1,227 @@
+import asyncio
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from dotenv import load_dotenv
+
+#   Lädt Variablen aus der .env-Datei
+load_dotenv()
+
+#   Dauerhafte Speicherung der Gespräche an/aus (aus der .env-Datei, Standard: "off")
+PERSISTENCE = os.getenv("PERSISTENCE", "off").lower() == "on"
+#   Ordner für Datenbanken mit relativem Pfad (neben diesem Modul, unabhängig vom Arbeitsverzeichnis)
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+#   Pfad der SQLite-Datenbank (relative Pfade gelten ab DATA_DIR)
+CONVERSATION_DB = os.path.join(DATA_DIR, os.getenv("CONVERSATION_DB", "conversations.db"))
+#   Maximale Wartezeit in Sekunden, bis gesammelte Schreibvorgänge gespeichert werden
+DB_FLUSH_INTERVAL = float(os.getenv("DB_FLUSH_INTERVAL", 0.5))
+#   Maximale Anzahl an Schreibvorgängen pro Transaktion
+DB_BATCH_SIZE = 500
+
+#   Tabellen und Indizes (nach Kanal)
+#   Discord-IDs steigen mit der Zeit, daher entspricht die Sortierung nach ID der zeitlichen Reihenfolge
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversation (
+    id INTEGER PRIMARY KEY,
+    channel_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT,
+    created_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_conversation_channel ON conversation (channel_id, id);
+CREATE TABLE IF NOT EXISTS summaries (
+    channel_id TEXT PRIMARY KEY,
+    summary TEXT,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS user_messages (
+    message_id INTEGER PRIMARY KEY,
+    channel_id TEXT NOT NULL,
+    content TEXT,
+    image_url TEXT,
+    created_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_user_messages_channel ON user_messages (channel_id, message_id);
+CREATE TABLE IF NOT EXISTS bot_messages (
+    sent_message_id INTEGER PRIMARY KEY,
+    channel_id TEXT NOT NULL,
+    received_message_id INTEGER,
+    root_message_id INTEGER,
+    bot_name TEXT,
+    is_image INTEGER,
+    content TEXT,
+    created_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_bot_messages_channel ON bot_messages (channel_id, sent_message_id);
+"""
+
+INSERT_CONVERSATION = "INSERT INTO conversation (channel_id, role, content, created_at) VALUES (?, ?, ?, ?)"
+UPSERT_SUMMARY = "INSERT OR REPLACE INTO summaries (channel_id, summary, updated_at) VALUES (?, ?, ?)"
+INSERT_USER_MESSAGE = ("INSERT OR REPLACE INTO user_messages (message_id, channel_id, content, image_url, created_at) "
+                       "VALUES (?, ?, ?, ?, ?)")
+INSERT_BOT_MESSAGE = ("INSERT OR REPLACE INTO bot_messages (sent_message_id, channel_id, received_message_id, "
+                      "root_message_id, bot_name, is_image, content, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+
+#   Dauerhafter Gesprächsspeicher (SQLite)
+#   Schreibvorgänge werden nur in eine Warteschlange gelegt und von einem eigenen Thread gesammelt
+#   in einer Transaktion gespeichert, der Event-Loop wartet also nie auf die Festplatte
+#   Gelesen wird nur beim ersten Zugriff auf einen Kanal (Wiederherstellung nach einem Neustart),
+#   ebenfalls in einem eigenen Thread, auf den der Event-Loop nur mit await wartet
+class ConversationStore:
+    def __init__(self, path=CONVERSATION_DB, flush_interval=DB_FLUSH_INTERVAL, batch_size=DB_BATCH_SIZE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.pending = queue.SimpleQueue()  #   (SQL, Parameter) oder None zum Beenden
+        self.writer = None  #   Schreib-Thread, wird beim ersten Schreibvorgang gestartet
+        self.reader = None  #   Verbindung für Abfragen (nur im Lese-Thread)
+        self.read_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-reader")
+        self.start_lock = threading.Lock()
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+
+    def _connect(self, check_same_thread=True):
+        connection = sqlite3.connect(self.path, check_same_thread=check_same_thread)
+        #   WAL: Lesen und Schreiben blockieren sich nicht gegenseitig, weniger Schreibzugriffe pro Transaktion
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        return connection
+
+    def _enqueue(self, sql, params):
+        if self.writer is None:
+            with self.start_lock:
+                if self.writer is None:
+                    self.writer = threading.Thread(target=self._write_loop, name="conversation-store", daemon=True)
+                    self.writer.start()
+        self.pending.put((sql, params))
+
+    #   Sammelt Schreibvorgänge, bis batch_size erreicht oder flush_interval vergangen ist
+    def _write_loop(self):
+        connection = self._connect()
+        running = True
+        while running:
+            item = self.pending.get()
+            if item is None:
+                break
+            batch = [item]
+            flush_at = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = flush_at - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.pending.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            self._write(connection, batch)
+        connection.close()
+
+    #   Speichert einen Stapel in einer Transaktion, gleiche Anweisungen werden zusammen ausgeführt
+    def _write(self, connection, batch):
+        try:
+            with connection:
+                for sql, items in groupby(batch, key=lambda item: item[0]):
+                    connection.executemany(sql, [params for _, params in items])
+            self.written += len(batch)
+            self.batches += 1
+        except sqlite3.Error as e:
+            self.failed += len(batch)
+            print(f"[Persistenz] Speichern von {len(batch)} Einträgen fehlgeschlagen: {e}")
+
+    #   Schreibt alle ausstehenden Einträge und beendet den Schreib-Thread
+    def close(self):
+        if self.writer is not None:
+            self.pending.put(None)
+            self.writer.join()
+            self.writer = None
+        #   Laufende Abfragen werden noch beendet, danach wird die Leseverbindung hier geschlossen
+        self.read_executor.shutdown(wait=True)
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+    #   Nachricht des Gesprächsverlaufs (nur Text, Bilder werden nicht gespeichert)
+    def record_message(self, channel_id, role, content):
+        self._enqueue(INSERT_CONVERSATION, (str(channel_id), role, content, time.time()))
+
+    #   Zusammenfassung älterer Nachrichten (ein Eintrag pro Kanal)
+    def record_summary(self, channel_id, summary):
+        self._enqueue(UPSERT_SUMMARY, (str(channel_id), summary, time.time()))
+
+    def record_user_message(self, channel_id, message_id, content, image_url=None):
+        self._enqueue(INSERT_USER_MESSAGE, (message_id, str(channel_id), content, image_url, time.time()))
+
+    #   Botnachricht samt Verweis auf die beantwortete Nachricht und die ursprüngliche Nutzeranfrage
+    def record_bot_message(self, channel_id, sent_message_id, received_message_id, root_message_id, bot_name,
+                           is_image, content):
+        self._enqueue(INSERT_BOT_MESSAGE, (sent_message_id, str(channel_id), received_message_id, root_message_id,
+                                           bot_name, int(bool(is_image)), content, time.time()))
+
+    #   Abfrage im Lese-Thread (Verbindung und Tabellen werden beim ersten Lesen dort angelegt)
+    async def _query(self, sql, params):
+        return await asyncio.get_running_loop().run_in_executor(self.read_executor, self._read, sql, params)
+
+    def _read(self, sql, params):
+        if self.reader is None:
+            self.reader = self._connect(check_same_thread=False)
+            self.reader.row_factory = sqlite3.Row
+        return self.reader.execute(sql, params).fetchall()
+
+    #   Zusammenfassung und neueste Nachrichten eines Gesprächs (älteste zuerst)
+    async def load_conversation(self, channel_id, limit):
+        rows = await self._query("SELECT summary FROM summaries WHERE channel_id = ?", (str(channel_id),))
+        summary = rows[0]["summary"] if rows else ""
+        rows = await self._query("SELECT role, content FROM conversation WHERE channel_id = ? ORDER BY id DESC LIMIT ?",
+                           (str(channel_id), limit))
+        return summary, [{"role": row["role"], "content": row["content"]} for row in reversed(rows)]
+
+    #   Neueste Nutzeranfragen eines Kanals (älteste zuerst, Format wie in ChannelSession)
+    async def load_user_history(self, channel_id, limit):
+        rows = await self._query("SELECT message_id, content, image_url FROM user_messages WHERE channel_id = ? "
+                           "ORDER BY message_id DESC LIMIT ?", (str(channel_id), limit))
+        return [{"message": row["content"], "image_url": row["image_url"], "message_id": row["message_id"]}
+                for row in reversed(rows)]
+
+    #   Neueste Botnachrichten eines Kanals (älteste zuerst, Format wie in ChannelSession)
+    async def load_bot_messages(self, channel_id, limit):
+        rows = await self._query("SELECT * FROM bot_messages WHERE channel_id = ? ORDER BY sent_message_id DESC LIMIT ?",
+                           (str(channel_id), limit))
+        return [self._bot_message(row) for row in reversed(rows)]
+
+    @staticmethod
+    def _bot_message(row):
+        return {
+            "message_text": row["content"],
+            "received_message_id": row["received_message_id"],
+            "sent_message_id": row["sent_message_id"],
+            "root_message_id": row["root_message_id"],
+            "is_image": bool(row["is_image"]),
+            "bot_name": row["bot_name"]
+        }
+
+    #   Kennzahlen: gespeicherte und wartende Einträge, Anzahl der Transaktionen
+    def stats(self):
+        return {
+            "written": self.written,
+            "pending": self.pending.qsize(),
+            "batches": self.batches,
+            "failed": self.failed,
+            "avg_batch": round(self.written / self.batches, 1) if self.batches else 0.0
+        }
+
+#   Gemeinsame Instanz (None, wenn die dauerhafte Speicherung ausgeschaltet ist)
+conversation_store = ConversationStore() if PERSISTENCE else None
+#   Ausstehende Einträge werden beim Beenden des Programms noch gespeichert
+if conversation_store:
+    atexit.register(conversation_store.close)
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from collections import deque
+
+#   Discord erlaubt etwa 5 Nachrichten pro 5 Sekunden und Kanal
+RATE_LIMIT_MESSAGES = 5
+RATE_LIMIT_SECONDS = 5.0
+#   Anzahl gespeicherter Versandzeiten für die Kennzahlen
+LATENCY_WINDOW = 500
+
+#   Fasst kurze, aufeinanderfolgende Absätze zu Nachrichten von höchstens max_length Zeichen zusammen
+#   z.B. ["Hallo!", "Die Mona Lisa ..."] -> ["Hallo!\n\nDie Mona Lisa ..."]
+#   Absätze, die allein zu lang sind, bleiben unverändert (werden später mit split_message aufgeteilt)
+def merge_paragraphs(paragraphs, max_length=2000, separator="\n\n"):
+    merged = []
+    for paragraph in paragraphs:
+        if merged and len(merged[-1]) + len(separator) + len(paragraph) <= max_length:
+            merged[-1] = f"{merged[-1]}{separator}{paragraph}"
+        else:
+            merged.append(paragraph)
+    return merged
+
+#   Ausgehende Warteschlange für Discord-Nachrichten eines Bots
+#   Pro Kanal werden Nachrichten in Eingangsreihenfolge und im Rahmen der Discord-Grenzen versendet,
+#   damit der Bot nicht in Discords Ratenbegrenzung (429) läuft
+#   send() gibt sofort ein Future zurück, das mit der gesendeten Nachricht erfüllt wird
+#   Bearbeiten und Löschen (edit, delete) laufen über dieselbe Warteschlange und dieselben Grenzen
+#   on_sent: optionale Funktion (Wartezeit in der Warteschlange, Dauer des Aufrufs) nach jedem Versand
+class OutboundQueue:
+    def __init__(self, rate=RATE_LIMIT_MESSAGES, per=RATE_LIMIT_SECONDS, on_sent=None):
+        self.rate = rate
+        self.per = per
+        self.on_sent = on_sent
+        self.channels = {}  #   Kanal-ID -> {"queue", "worker", "recent"}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)   #   Zeit von send() bis zum Versand (Sekunden)
+        self.sent = 0
+        self.failed = 0
+
+    #   Legt eine Nachricht in die Warteschlange des Kanals (Parameter wie bei channel.send)
+    def send(self, channel, content=None, **kwargs):
+        return self._enqueue(channel, "send", channel, content, kwargs)
+
+    #   Bearbeitet eine gesendete Nachricht (z.B. beim Streaming einer Antwort)
+    #   Eine noch wartende Bearbeitung derselben Nachricht wird durch den neuesten Text ersetzt
+    def edit(self, message, content):
+        state = self.channels.get(message.channel.id)
+        if state:
+            for item in state["queue"]:
+                if item[0] == "edit" and item[1] is message and not item[4].done():
+                    item[2] = content
+                    return item[4]
+        return self._enqueue(message.channel, "edit", message, content, {})
+
+    #   Löscht eine gesendete Nachricht (z.B. die Übergangsnachricht)
+    def delete(self, message):
+        return self._enqueue(message.channel, "delete", message, None, {})
+
+    #   Legt einen Auftrag (send, edit, delete) in die Warteschlange des Kanals
+    def _enqueue(self, channel, action, target, content, kwargs):
+        future = asyncio.get_running_loop().create_future()
+        state = self.channels.get(channel.id)
+        if state is None:
+            state = {"queue": deque(), "worker": None, "recent": deque()}
+            self.channels[channel.id] = state
+        state["queue"].append([action, target, content, kwargs, future, time.monotonic()])
+        if state["worker"] is None or state["worker"].done():
+            state["worker"] = asyncio.create_task(self._worker(channel, state))
+        return future
+
+    #   Wartet, bis im Kanal wieder eine Nachricht gesendet werden darf
+    async def _pace(self, state):
+        recent = state["recent"]
+        while True:
+            now = time.monotonic()
+            while recent and now - recent[0] >= self.per:
+                recent.popleft()
+            if len(recent) < self.rate:
+                return
+            await asyncio.sleep(self.per - (now - recent[0]))
+
+    #   Versendet die Nachrichten eines Kanals nacheinander
+    async def _worker(self, channel, state):
+        queue = state["queue"]
+        while queue:
+            action, target, content, kwargs, future, queued_at = queue.popleft()
+            #   Abgebrochene Nachrichten (z.B. veraltete Nutzeranfrage) werden nicht mehr gesendet
+            if future.done():
+                continue
+            await self._pace(state)
+            if future.done():
+                continue
+            send_start = time.monotonic()
+            try:
+                if action == "send":
+                    message = await target.send(content, **kwargs)
+                elif action == "edit":
+                    message = await target.edit(content=content)
+                else:
+                    message = await target.delete()
+            except Exception as e:
+                self.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            now = time.monotonic()
+            state["recent"].append(now)
+            self.latencies.append(now - queued_at)
+            self.sent += 1
+            if self.on_sent:
+                self.on_sent(send_start - queued_at, now - send_start)
+            if not future.done():
+                future.set_result(message)
+        #   Leere Kanäle werden entfernt, die Versandzeiten bleiben nur für die Ratenbegrenzung relevant
+        if not state["recent"] or time.monotonic() - state["recent"][-1] >= self.per:
+            self.channels.pop(channel.id, None)
+
+    #   Kennzahlen: wartende Nachrichten pro Kanal, Anzahl versendeter Nachrichten, Versanddauer
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            "queued": {channel_id: len(state["queue"]) for channel_id, state in self.channels.items() if state["queue"]},
+            "sent": self.sent,
+            "failed": self.failed,
+            "avg_latency_ms": round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0.0,
+            "p95_latency_ms": round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000, 1) if latencies else 0.0
+        }
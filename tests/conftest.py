@@ -0,0 +1,9 @@
+import os
+import sys
+
+#   Die Module von Einzel- und Gruppenchat werden wie beim Start der Bots direkt importiert,
+#   gemeinsame Module über das Paket shared im Projektverzeichnis
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "Gruppenchat"), os.path.join(ROOT, "Einzelchat")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,53 @@
+import asyncio
+import pytest
+from shared.answer_cache import AnswerCache, normalize_question
+from shared.image_cache import ImageCache, normalize_prompt
+
+def test_questions_are_normalized():
+    assert normalize_question("Wer hat dieses Bild gemalt?") == "wer hat dieses bild gemalt"
+    cache = AnswerCache()
+    assert cache.make_key("hermine", "Wer hat  dieses Bild gemalt?!", ["Hallo"]) == \
+        cache.make_key("hermine", "wer hat dieses bild gemalt", ["Hallo"])
+    assert cache.make_key("hermine", "Wer bist du?") != cache.make_key("goten", "Wer bist du?")
+
+def test_context_policies():
+    last_turn = AnswerCache(context_policy="last_turn")
+    assert last_turn.make_key("p", "frage", ["alt", "neu"]) == last_turn.make_key("p", "frage", ["anders", "neu"])
+    assert last_turn.make_key("p", "frage", ["neu"]) != last_turn.make_key("p", "frage", ["anders"])
+    none = AnswerCache(context_policy="none")
+    assert none.make_key("p", "frage", ["a"]) == none.make_key("p", "frage", ["b"])
+    full = AnswerCache(context_policy="full")
+    assert full.make_key("p", "frage", ["alt", "neu"]) != full.make_key("p", "frage", ["anders", "neu"])
+    with pytest.raises(ValueError):
+        AnswerCache(context_policy="alles")
+
+def test_answer_cache_expiry_and_size():
+    cache = AnswerCache(max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.put(key, f"Antwort {key}")
+    assert cache.get("a") is None
+    assert cache.get("c") == "Antwort c"
+    assert cache.stats()["evictions"] == 1
+    expired = AnswerCache(ttl=-1)
+    expired.put("a", "Antwort")
+    assert expired.get("a") is None
+    assert expired.stats()["expired"] == 1
+
+def test_prompts_are_normalized():
+    assert normalize_prompt("  Die   Mona Lisa! ") == "die mona lisa"
+    key = ImageCache.make_key("  Die Mona Lisa! ", "leonardo", model="dall-e-3", size="1024x1024")
+    assert key == ImageCache.make_key("die mona lisa", "leonardo", model="dall-e-3", size="1024x1024")
+    assert key != ImageCache.make_key("die mona lisa", "goten", model="dall-e-3", size="1024x1024")
+    assert key != ImageCache.make_key("die mona lisa", "leonardo", model="dall-e-3", size="512x512")
+
+def test_image_cache_round_trip(tmp_path):
+    async def run():
+        cache = ImageCache(cache_dir=str(tmp_path), max_bytes=10)
+        await cache.put("a", b"12345678")
+        assert await cache.get("a") == b"12345678"
+        #   Über der Obergrenze wird das am längsten nicht genutzte Bild gelöscht
+        await cache.put("b", b"abcdefgh")
+        assert await cache.get("a") is None
+        assert await cache.get("b") == b"abcdefgh"
+        assert cache.stats()["bytes"] == 8
+    asyncio.run(run())
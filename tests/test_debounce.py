@@ -0,0 +1,66 @@
+import asyncio
+from types import SimpleNamespace
+from debounce import CoalescedMessage, MessageDebouncer
+
+def message(message_id, content, channel_id=1, attachments=()):
+    return SimpleNamespace(id=message_id, content=content, channel=SimpleNamespace(id=channel_id),
+                           author=SimpleNamespace(bot=False), attachments=list(attachments))
+
+def test_fragments_are_coalesced():
+    async def run():
+        handled = []
+        async def handler(msg):
+            handled.append(msg)
+        debouncer = MessageDebouncer(handler, window=0.05, max_wait=1)
+        await debouncer.add(message(1, "Hallo"))
+        await debouncer.add(message(2, "  wer hat das gemalt? ", attachments=["bild.png"]))
+        await asyncio.sleep(0.15)
+        assert len(handled) == 1
+        coalesced = handled[0]
+        assert isinstance(coalesced, CoalescedMessage)
+        assert coalesced.id == 2
+        assert coalesced.content == "Hallo\nwer hat das gemalt?"
+        assert coalesced.attachments == ["bild.png"]
+    asyncio.run(run())
+
+def test_single_message_is_passed_through():
+    async def run():
+        handled = []
+        async def handler(msg):
+            handled.append(msg)
+        debouncer = MessageDebouncer(handler, window=0.05, max_wait=1)
+        first = message(1, "Hallo")
+        await debouncer.add(first)
+        #   Nachrichten anderer Kanäle werden getrennt gesammelt
+        await debouncer.add(message(2, "Hi", channel_id=2))
+        await asyncio.sleep(0.15)
+        assert first in handled
+        assert len(handled) == 2
+    asyncio.run(run())
+
+def test_max_wait_limits_the_delay():
+    async def run():
+        handled = []
+        async def handler(msg):
+            handled.append(msg)
+        debouncer = MessageDebouncer(handler, window=0.1, max_wait=0.15)
+        #   Der Nutzer schreibt ununterbrochen weiter, die Runde startet trotzdem nach max_wait
+        for message_id in range(1, 5):
+            await debouncer.add(message(message_id, f"Teil {message_id}"))
+            await asyncio.sleep(0.06)
+        await asyncio.sleep(0.2)
+        assert len(handled) >= 2
+        assert sum(len(getattr(msg, "messages", [msg])) for msg in handled) == 4
+    asyncio.run(run())
+
+def test_zero_window_handles_immediately():
+    async def run():
+        handled = []
+        async def handler(msg):
+            handled.append(msg)
+        debouncer = MessageDebouncer(handler, window=0)
+        first = message(1, "Hallo")
+        await debouncer.add(first)
+        assert handled == [first]
+        assert not debouncer.pending
+    asyncio.run(run())
@@ -0,0 +1,69 @@
+import asyncio
+from shared.memory import ConversationMemory, estimate_tokens, fit_to_budget
+
+def add_messages(memory, count):
+    for number in range(count):
+        memory.add({"role": "user", "content": f"Nachricht {number}"})
+
+def test_no_compaction_below_batch_and_budget():
+    async def run():
+        memory = ConversationMemory(recent_turns=2, compaction_batch=4, token_budget=1000)
+        add_messages(memory, 5)
+        memory.schedule_compaction()
+        assert memory.compaction_task is None
+    asyncio.run(run())
+
+def test_compaction_after_a_batch():
+    async def run():
+        calls = []
+        async def summarizer(summary, new_messages):
+            calls.append(new_messages)
+            return "Zusammenfassung"
+        memory = ConversationMemory(recent_turns=2, compaction_batch=4, token_budget=1000, summarizer=summarizer)
+        add_messages(memory, 6)
+        memory.schedule_compaction()
+        await memory.compaction_task
+        assert len(calls) == 1
+        assert calls[0].splitlines() == [f"user: Nachricht {number}" for number in range(4)]
+        assert memory.texts() == ["Nachricht 4", "Nachricht 5"]
+        messages = memory.messages()
+        assert messages[0]["role"] == "system"
+        assert "Zusammenfassung" in messages[0]["content"]
+    asyncio.run(run())
+
+def test_compaction_over_token_budget():
+    async def run():
+        async def summarizer(summary, new_messages):
+            return "kurz"
+        memory = ConversationMemory(recent_turns=1, compaction_batch=100, token_budget=10, summarizer=summarizer)
+        memory.add({"role": "user", "content": "x" * 100})
+        memory.add({"role": "user", "content": "y"})
+        memory.schedule_compaction()
+        await memory.compaction_task
+        assert memory.summary == "kurz"
+        assert memory.texts() == ["y"]
+    asyncio.run(run())
+
+def test_failed_summary_keeps_the_text():
+    async def run():
+        async def summarizer(summary, new_messages):
+            raise RuntimeError("nicht erreichbar")
+        memory = ConversationMemory(recent_turns=1, summarizer=summarizer)
+        add_messages(memory, 3)
+        await memory.compact()
+        assert memory.summary == "user: Nachricht 0\nuser: Nachricht 1"
+        assert memory.texts() == ["Nachricht 2"]
+    asyncio.run(run())
+
+def test_max_entries_without_model_call():
+    memory = ConversationMemory(max_entries=3)
+    add_messages(memory, 5)
+    assert memory.texts() == ["Nachricht 2", "Nachricht 3", "Nachricht 4"]
+    assert memory.summary == "user: Nachricht 0\nuser: Nachricht 1"
+
+def test_messages_respect_the_budget():
+    memory = ConversationMemory(token_budget=estimate_tokens("x" * 40) * 2 + estimate_tokens(""))
+    for text in ("a" * 40, "b" * 40, "c" * 40):
+        memory.add({"role": "user", "content": text})
+    assert [message["content"] for message in memory.messages()] == ["b" * 40, "c" * 40]
+    assert fit_to_budget(["a" * 400, "b"], 5) == ["b"]
@@ -0,0 +1,100 @@
+import asyncio
+import message_storage
+from message_storage import ChannelSession, MessageStorage
+
+USER_MESSAGE = 100
+
+def new_session():
+    return ChannelSession(1, dispatch=lambda job: True)
+
+#   Text- und Bildantworten auf eine Nutzeranfrage
+async def store_chain(session):
+    await session.store_bot_messages("Hallo", USER_MESSAGE, 201, bot_name="hermine")
+    await session.store_bot_messages("[BILD: a.png]", 201, 202, is_image=True, bot_name="leonardo")
+    await session.store_bot_messages("Schönes Bild", 202, 203, bot_name="goten")
+
+def test_reply_index_depth_and_root():
+    async def run():
+        session = new_session()
+        await store_chain(session)
+        index = session.reply_index
+        assert index["depth"] == {201: 1, 202: 2, 203: 3}
+        #   Bildnachrichten zählen nicht zur Antwortanzahl und unterbrechen die Kette der Textnachrichten
+        assert index["text_depth"] == {201: 1, 203: 1}
+        assert all(index["root"][sent] == USER_MESSAGE for sent in (201, 202, 203))
+        assert await session.get_root_reply_counts(USER_MESSAGE) == {"text": 2, "image": 1}
+        assert await session.get_root_message_id(203) == USER_MESSAGE
+        assert session.is_image_message(202)
+        assert not session.is_image_message(203)
+        assert session.sent_text(203) == "Schönes Bild"
+    asyncio.run(run())
+
+def test_reply_limit():
+    async def run():
+        session = new_session()
+        received = USER_MESSAGE
+        for sent in range(201, 206):
+            assert await session.can_bot_reply(received)
+            await session.store_bot_messages(f"Antwort {sent}", received, sent)
+            received = sent
+        assert await session.get_reply_count(205) == 5
+        assert not await session.can_bot_reply(205)
+    asyncio.run(run())
+
+def test_old_bot_messages_are_unindexed(monkeypatch):
+    monkeypatch.setattr(message_storage, "MAX_BOT_MESSAGES", 2)
+    async def run():
+        session = new_session()
+        await store_chain(session)
+        assert [msg["sent_message_id"] for msg in session.store["bot_messages"]] == [202, 203]
+        assert 201 not in session.reply_index["root"]
+        assert 201 not in session.reply_index["text_depth"]
+        #   Der Index der neueren Nachrichten bleibt unverändert
+        assert session.reply_index["depth"][203] == 3
+    asyncio.run(run())
+
+def test_wait_until_indexed():
+    async def run():
+        session = new_session()
+        waiting = asyncio.create_task(session.wait_until_indexed(201, timeout=1))
+        await asyncio.sleep(0)
+        await session.store_bot_messages("Hallo", USER_MESSAGE, 201)
+        assert await waiting
+        assert await session.wait_until_indexed(201, timeout=0.01)
+        assert not await session.wait_until_indexed(999, timeout=0.01)
+    asyncio.run(run())
+
+def test_turns_cancel_older_work():
+    async def run():
+        session = new_session()
+        session.start_turn(1)
+        old_task = asyncio.create_task(asyncio.sleep(10))
+        assert session.track(1, old_task)
+        #   Der Nutzer schreibt weiter: alte Arbeiten werden abgebrochen, keine Anfrage ist mehr aktuell
+        session.end_turn()
+        await asyncio.sleep(0)
+        assert old_task.cancelled()
+        assert session.is_stale(1)
+        assert not session.track(1, asyncio.create_task(asyncio.sleep(0)))
+        session.start_turn(2)
+        assert not session.is_stale(2)
+        assert session.is_stale(1)
+    asyncio.run(run())
+
+def test_evict_idle_keeps_busy_channels():
+    async def run():
+        storage = MessageStorage(idle_timeout=60, persistence=None)
+        idle = await storage.session(1)
+        busy = await storage.session(2)
+        recent = await storage.session(3)
+        now = idle.last_active + 120
+        idle.last_active = busy.last_active = now - 120
+        recent.last_active = now - 10
+        busy.queued_jobs = 1
+        storage.evict_idle(now)
+        assert set(storage.sessions) == {2, 3}
+        #   Sobald der Auftrag übernommen wurde, darf auch dieser Kanal entfernt werden
+        busy.take_job()
+        storage.evict_idle(now)
+        assert set(storage.sessions) == {3}
+    asyncio.run(run())
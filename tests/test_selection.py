@@ -0,0 +1,38 @@
+import asyncio
+from selection import LexicalSelector, match_bot_name
+
+QUESTION = {"last_user_message": "Wer hat die Mona Lisa gemalt?"}
+
+def test_relevant_answer_scores_higher():
+    answers = {
+        "leonardo": "Die Mona Lisa habe ich gemalt, in Florenz, mit viel Geduld und feinen Lasuren über viele Jahre.",
+        "goten": "Ich habe heute schon drei Stunden trainiert und jetzt richtig großen Hunger auf Nudeln!"
+    }
+    scores = LexicalSelector().score(answers, QUESTION)
+    assert scores["leonardo"] > scores["goten"]
+
+def test_length_close_to_target_is_preferred():
+    selector = LexicalSelector(relevance_weight=0.0, length_weight=1.0)
+    answers = {"hermine": " ".join(["wort"] * 20), "goten": "Ja!"}
+    scores = selector.score(answers, QUESTION)
+    assert scores["hermine"] == 1.0
+    assert scores["goten"] < 0.6
+
+def test_image_answers_win_drawing_requests():
+    answers = {"leonardo": "Gerne! [BILD: eine Katze]", "hermine": "Gerne!"}
+    scores = LexicalSelector().score(answers, {"last_user_message": "Zeichne eine Katze"})
+    assert scores["leonardo"] > scores["hermine"]
+
+def test_select_returns_best_bot_and_margin():
+    answers = {"leonardo": "Die Mona Lisa habe ich gemalt.", "goten": "Keine Ahnung."}
+    chosen, info = asyncio.run(LexicalSelector().select(answers, QUESTION))
+    assert chosen == "leonardo"
+    assert info["strategy"] == "local"
+    assert info["margin"] == round(info["scores"]["leonardo"] - info["scores"]["goten"], 4)
+
+def test_match_bot_name():
+    candidates = {"hermine": "", "goten": ""}
+    assert match_bot_name(" Hermine. ", candidates) == "hermine"
+    assert match_bot_name("Ich wähle goten", candidates) == "goten"
+    assert match_bot_name("hermine oder goten", candidates) is None
+    assert match_bot_name("leonardo", candidates) is None
@@ -0,0 +1,50 @@
+import asyncio
+import time
+from sessions import SessionManager
+from shared.memory import ConversationMemory
+
+def new_manager(**kwargs):
+    return SessionManager(lambda key: ConversationMemory(), **kwargs)
+
+def test_idle_sessions_are_removed():
+    async def run():
+        manager = new_manager(idle_timeout=60)
+        idle = await manager.get(1, "a")
+        await manager.get(1, "b")
+        idle.last_active = time.monotonic() - 120
+        manager.evict()
+        assert list(manager.sessions) == [(1, "b")]
+    asyncio.run(run())
+
+def test_sessions_in_use_are_kept():
+    async def run():
+        manager = new_manager(idle_timeout=60)
+        async with manager.use(1, "a") as session:
+            session.last_active = time.monotonic() - 120
+            manager.evict()
+            assert (1, "a") in manager.sessions
+        #   Nach der Anfrage gilt die Sitzung wieder als aktiv
+        manager.evict()
+        assert (1, "a") in manager.sessions
+    asyncio.run(run())
+
+def test_least_recently_used_session_goes_first():
+    async def run():
+        manager = new_manager(max_sessions=2)
+        await manager.get(1, "a")
+        await manager.get(1, "b")
+        await manager.get(1, "a")
+        await manager.get(1, "c")
+        assert list(manager.sessions) == [(1, "a"), (1, "c")]
+    asyncio.run(run())
+
+def test_token_limit_removes_sessions():
+    async def run():
+        manager = new_manager(max_total_tokens=100)
+        first = await manager.get(1, "a")
+        first.memory.add({"role": "user", "content": "x" * 800})
+        second = await manager.get(1, "b")
+        second.memory.add({"role": "user", "content": "x" * 40})
+        manager.evict(keep=(1, "b"))
+        assert list(manager.sessions) == [(1, "b")]
+    asyncio.run(run())